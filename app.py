@@ -1,19 +1,25 @@
 from flask import Flask, render_template, request
 from dbconnect.dbconn import db
+from dbconnect import budget as query_budget
 from bak.member_routes import member_bp
 from management.dish_bp import dish_bp
+from management.metrics_bp import metrics_bp
 from models.search_bp import search_bp
 from models.family_bp import family_bp
 from models.nutrition_bp import nutrition_bp
 
 app = Flask(__name__)
 
+# 每个请求统计 SQL 条数和 DB 耗时，疑似 N+1 时写日志
+query_budget.init_app(app)
+
 # 注册蓝图
 app.register_blueprint(member_bp)
 app.register_blueprint(family_bp)
 app.register_blueprint(dish_bp)
 app.register_blueprint(nutrition_bp)
 app.register_blueprint(search_bp)
+app.register_blueprint(metrics_bp)  # 内部指标，需令牌（见 metrics_bp）
 
 # 保留原有的基本路由
 @app.route('/')
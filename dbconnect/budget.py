@@ -0,0 +1,136 @@
+# budget.py
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_current: ContextVar[Optional["QueryBudget"]] = ContextVar("ejiacan_query_budget", default=None)
+
+
+class QueryBudget:
+    """
+    一个作用域（通常是一次 Flask 请求）内的 SQL 账本：
+    语句数、DB 总耗时、每个指纹出现的次数。
+    同一指纹在作用域内出现 >= repeat_threshold 次即视为疑似 N+1。
+    """
+
+    def __init__(self, label: str = "", max_queries: int = 50, repeat_threshold: int = 3,
+                 parent: "QueryBudget" = None):
+        self.label = label
+        self.max_queries = max_queries
+        self.repeat_threshold = repeat_threshold
+        self.parent = parent
+        self.count = 0
+        self.db_ms = 0.0
+        self.fingerprints: Dict[str, Dict[str, float]] = {}
+        self.started = time.perf_counter()
+        self.elapsed_ms = 0.0
+
+    def add(self, fp: str, elapsed_ms: float):
+        self.count += 1
+        self.db_ms += elapsed_ms
+        item = self.fingerprints.get(fp)
+        if item is None:
+            item = self.fingerprints[fp] = {'count': 0, 'total_ms': 0.0}
+        item['count'] += 1
+        item['total_ms'] += elapsed_ms
+        if self.parent is not None:
+            self.parent.add(fp, elapsed_ms)
+
+    @property
+    def repeated(self) -> Dict[str, int]:
+        """疑似 N+1 的指纹 -> 次数（按次数倒序）"""
+        hits = {fp: int(v['count']) for fp, v in self.fingerprints.items()
+                if v['count'] >= self.repeat_threshold}
+        return dict(sorted(hits.items(), key=lambda x: x[1], reverse=True))
+
+    @property
+    def over_budget(self) -> bool:
+        return self.max_queries is not None and self.count > self.max_queries
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'label': self.label,
+            'query_count': self.count,
+            'db_ms': round(self.db_ms, 3),
+            'elapsed_ms': round(self.elapsed_ms, 3),
+            'max_queries': self.max_queries,
+            'over_budget': self.over_budget,
+            'repeated': self.repeated,
+        }
+
+    def log_if_suspicious(self):
+        """超出语句预算或出现重复指纹时写 warning 日志"""
+        repeated = self.repeated
+        if not repeated and not self.over_budget:
+            return
+        logger.warning("query budget %s: %s queries, %.1fms db time%s",
+                       self.label, self.count, self.db_ms,
+                       " (over budget %s)" % self.max_queries if self.over_budget else "")
+        for fp, n in repeated.items():
+            logger.warning("  possible N+1 x%s: %s", n, fp)
+
+
+def current_budget() -> Optional[QueryBudget]:
+    return _current.get()
+
+
+def record_statement(fp: str, elapsed_ms: float, rows: int, error: bool):
+    """QueryStats 的 listener：把语句记到当前作用域的账本上"""
+    budget = _current.get()
+    if budget is not None:
+        budget.add(fp, elapsed_ms)
+
+
+@contextmanager
+def track_queries(label: str = "", max_queries: int = 50, repeat_threshold: int = 3):
+    """
+    with track_queries("merge") as budget: ...
+    退出后 budget.count / budget.db_ms / budget.repeated 可直接断言；嵌套作用域会同时计入外层
+    """
+    budget = QueryBudget(label, max_queries, repeat_threshold, parent=_current.get())
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        budget.elapsed_ms = (time.perf_counter() - budget.started) * 1000
+        _current.reset(token)
+
+
+def init_app(app, max_queries: int = 50, repeat_threshold: int = 3):
+    """
+    给 Flask 应用挂上请求级 SQL 账本：
+    - flask.g.query_budget 可在视图里读取
+    - 响应头 X-DB-Query-Count / X-DB-Time-Ms
+    - 超预算或疑似 N+1 时写 warning 日志
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_query_budget():
+        budget = QueryBudget("%s %s" % (request.method, request.path), max_queries, repeat_threshold)
+        g.query_budget = budget
+        g.query_budget_token = _current.set(budget)
+
+    @app.after_request
+    def _report_query_budget(response):
+        budget = g.get('query_budget')
+        if budget is not None:
+            budget.elapsed_ms = (time.perf_counter() - budget.started) * 1000
+            response.headers['X-DB-Query-Count'] = str(budget.count)
+            response.headers['X-DB-Time-Ms'] = "%.1f" % budget.db_ms
+            budget.log_if_suspicious()
+        return response
+
+    @app.teardown_request
+    def _end_query_budget(exc=None):
+        token = g.pop('query_budget_token', None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # 不同上下文里 reset 会失败，直接清空即可
+                _current.set(None)
@@ -1,5 +1,69 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import pymysql
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSDictCursor
+
+from dbconnect.pool import ConnectionPool
+from dbconnect.stats import QueryStats
+from dbconnect.budget import record_statement, track_queries
+from dbconnect.deadline import statement_timeout
+from dbconnect.forksafe import after_fork_in_child
+
+def in_clause(values):
+    """
+    把列表参数展开成固定档位（1, 2, 4, 8, ...）的 IN 占位符，不足的档位用最后一个值补齐，
+    这样不同长度的列表落到同一条 SQL 文本上（指纹统计、语句缓存都能复用），也避免拼字符串注入。
+    先按出现顺序去重；空列表返回 ("NULL", [])，IN (NULL) 不匹配任何行。
+    :return: (占位串, 参数列表)，如 [3, 5, 7] -> ("%s,%s,%s,%s", [3, 5, 7, 7])
+    """
+    values = list(dict.fromkeys(values))
+    if not values:
+        return "NULL", []
+    size = 1
+    while size < len(values):
+        size <<= 1
+    return ",".join(["%s"] * size), values + [values[-1]] * (size - len(values))
+
+class Transaction:
+    """
+    绑定单条连接的执行器，每条语句都计入 QueryStats。
+    由 db.transaction() 产出时，块内语句不单独提交，退出时统一提交或回滚；
+    Database 的单语句方法也借它在自动提交的连接上执行。
+    """
+
+    def __init__(self, conn, stats: QueryStats):
+        self.conn = conn
+        self.stats = stats
+
+    def query(self, sql, params=None):
+        with self.conn.cursor() as cur, self.stats.track(sql) as t:
+            cur.execute(statement_timeout(sql), params or ())
+            rows = cur.fetchall()
+            t.rows = len(rows)
+            return rows
+
+    def execute(self, sql, params=None):
+        with self.conn.cursor() as cur, self.stats.track(sql) as t:
+            cur.execute(sql, params or ())
+            t.rows = cur.rowcount
+            return cur.rowcount
+
+    def execute_return_id(self, sql, params=None):
+        with self.conn.cursor() as cur, self.stats.track(sql) as t:
+            cur.execute(sql, params or ())
+            t.rows = cur.rowcount
+            return cur.lastrowid
+
+    def executemany(self, sql, seq_of_params):
+        """空序列直接返回 0；INSERT ... VALUES 会被 pymysql 合并成一条多值插入"""
+        if not seq_of_params:
+            return 0
+        with self.conn.cursor() as cur, self.stats.track(sql) as t:
+            cur.executemany(sql, seq_of_params)
+            t.rows = cur.rowcount
+            return cur.rowcount
 
 class Database:
     def __init__(self):
@@ -8,24 +72,125 @@ class Database:
             'user': 'root',
             'password': 'Dd2009zw#',
             'database': 'ejiacan',
-            'cursorclass': DictCursor
+            'cursorclass': DictCursor,
+            # 连接会被连接池复用，必须自动提交，否则只读查询会一直停留在旧快照上
+            'autocommit': True
+        }
+        # 连接池参数（每个 worker 进程一个池）
+        self.pool_config = {
+            'min_size': 1,
+            'max_size': 10,
+            'max_idle_seconds': 300,
+            'ping_after_seconds': 30,
+            'checkout_timeout': 10
         }
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        after_fork_in_child(self._after_fork)
+        # SQL 指纹统计：次数、行数、耗时直方图；超过阈值(ms)记慢查询日志
+        self.stats = QueryStats(slow_query_ms=500)
+        # 请求级账本（语句数 / DB 耗时 / 重复指纹），见 dbconnect.budget
+        self.stats.add_listener(record_statement)
+
+    def _after_fork(self):
+        # 连接池自己在子进程里重置，这里只换掉创建连接池用的锁
+        self._pool_lock = threading.Lock()
 
     def get_connection(self):
+        """新建一条物理连接（连接池的工厂方法，业务代码请用 connection()）"""
         return pymysql.connect(**self.config)
 
+    @property
+    def pool(self) -> ConnectionPool:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(self.get_connection, **self.pool_config)
+        return self._pool
+
+    def connection(self):
+        """从连接池借出连接：with db.connection() as conn: ..."""
+        return self.pool.connection()
+
+    def pool_stats(self):
+        """连接池指标快照（容量、借出数、等待耗时等）"""
+        return self.pool.stats()
+
+    def query_stats(self, top=None):
+        """按 SQL 指纹聚合的执行统计快照（按总耗时倒序）"""
+        return self.stats.snapshot(top)
+
+    @staticmethod
+    def in_clause(values):
+        """见模块级 in_clause：db.in_clause(ids) -> ("%s,%s", [1, 2])"""
+        return in_clause(values)
+
+    def track_queries(self, label="", max_queries=50, repeat_threshold=3):
+        """统计一个作用域内的语句：with db.track_queries("merge") as budget: ..."""
+        return track_queries(label, max_queries, repeat_threshold)
+
+    @contextmanager
+    def transaction(self):
+        """
+        工作单元：with db.transaction() as tx: tx.execute(...)
+        块内语句共用一条连接，正常退出时一次提交，抛异常则整体回滚
+        """
+        with self.connection() as conn:
+            conn.begin()
+            try:
+                yield Transaction(conn, self.stats)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
     def query(self, sql, params=None):
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params or ())
-                return cur.fetchall()
+        with self.connection() as conn:
+            return Transaction(conn, self.stats).query(sql, params)
+
+    def stream(self, sql, params=None, batch_size=500, batches=False):
+        """
+        服务端游标（SSDictCursor）逐批读取大结果集，内存只保留当前一批
+        :param sql:         带占位符的 SQL 模板
+        :param params:      参数元组/列表/字典
+        :param batch_size:  每次 fetchmany 的行数
+        :param batches:     True 时按批 yield 行列表，否则逐行 yield
+        读取期间独占一条连接；未读完就中途退出时该连接直接关闭，
+        不再把剩余结果从服务端读空。
+        """
+        statement = statement_timeout(sql)
+        pool = self.pool
+        conn = pool.acquire()
+        exhausted = False
+        failed = False
+        start = time.perf_counter()
+        total = 0
+        try:
+            # 不用 with：SSCursor.close() 会把剩余结果读空，中途退出时不能调用
+            cur = conn.cursor(SSDictCursor)
+            cur.execute(statement, params or ())
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    cur.close()
+                    exhausted = True
+                    break
+                total += len(rows)
+                if batches:
+                    yield rows
+                else:
+                    yield from rows
+        except Exception:
+            failed = True
+            raise
+        finally:
+            pool.release(conn, broken=not exhausted)
+            # 耗时包含调用方消费数据的时间，反映的是连接被占用的时长
+            self.stats.record(sql, (time.perf_counter() - start) * 1000, total, failed)
 
     def execute(self, sql, params=None):
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params or ())
-                conn.commit()
-                return cur.rowcount
+        with self.connection() as conn:
+            return Transaction(conn, self.stats).execute(sql, params)
     def execute_return_id(self, sql, params=None):
         """
         执行插入操作并返回自增ID
@@ -33,24 +198,18 @@ class Database:
         :param params:  参数元组/列表/字典
         :return:        插入的自增ID
         """
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params or ())
-                conn.commit()
-                return cur.lastrowid
+        with self.connection() as conn:
+            return Transaction(conn, self.stats).execute_return_id(sql, params)
 
     def executemany(self, sql, seq_of_params):
         """
-        批量执行同一条 SQL 语句
+        批量执行同一条 SQL 语句（整批一个事务）
         :param sql:               带占位符的 SQL 模板
         :param seq_of_params:     序列，每个元素为一条参数元组/列表/字典
         :return:                  累计影响的行数
         """
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.executemany(sql, seq_of_params)
-                conn.commit()
-                return cur.rowcount
+        with self.transaction() as tx:
+            return tx.executemany(sql, seq_of_params)
 
 # 创建全局实例
-db = Database()
\ No newline at end of file
+db = Database()
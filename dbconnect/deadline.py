@@ -0,0 +1,77 @@
+# deadline.py
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("ejiacan_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """作用域的耗时预算已用完，不再发新的 SQL"""
+
+
+class Deadline:
+    """
+    一个作用域（通常是一次生成请求）的耗时预算：
+    - 各阶段之间查 expired，超时就跳过后面的可选阶段，并用 skip() 记下跳过了什么
+    - 作用域内的 SELECT 带上剩余时间作为语句超时（见 statement_timeout）
+    """
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.started = time.perf_counter()
+        self.skipped: List[str] = []
+
+    def remaining_ms(self) -> float:
+        return self.budget_ms - (time.perf_counter() - self.started) * 1000
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining_ms() <= 0
+
+    def skip(self, stage: str):
+        self.skipped.append(stage)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(budget_ms: Optional[float]):
+    """
+    with deadline_scope(300) as deadline: ...
+    budget_ms 为 None 时不设预算（沿用外层的，没有外层时 deadline 为 None）；
+    嵌套时内层预算不超过外层剩余时间
+    """
+    outer = _current.get()
+    if budget_ms is None:
+        yield outer
+        return
+    if outer is not None:
+        budget_ms = min(budget_ms, outer.remaining_ms())
+    deadline = Deadline(budget_ms)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def statement_timeout(sql: str) -> str:
+    """
+    有预算的作用域里：预算已用完直接抛 DeadlineExceeded；
+    SELECT 加 MySQL 优化器提示 MAX_EXECUTION_TIME(剩余毫秒)，超时由服务端中止语句。
+    其它语句（写操作不支持该提示）原样返回
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return sql
+    remaining = deadline.remaining_ms()
+    if remaining <= 0:
+        raise DeadlineExceeded("deadline of %sms exceeded before query" % deadline.budget_ms)
+    stripped = sql.lstrip()
+    if stripped[:6].upper() != "SELECT" or "MAX_EXECUTION_TIME" in stripped.upper():
+        return sql
+    return "SELECT /*+ MAX_EXECUTION_TIME(%d) */%s" % (max(1, int(remaining)), stripped[6:])
@@ -0,0 +1,27 @@
+# forksafe.py
+import os
+import weakref
+from typing import Callable
+
+
+def after_fork_in_child(fn: Callable[[], None]):
+    """
+    fork 出的子进程里调用 fn（批量生成的进程池、gunicorn preload 都会 fork）：
+    子进程只剩发起 fork 的那个线程，父进程其它线程（目录后台刷新、接口请求）当时持有的锁永远不会释放，
+    持锁的类 / 对象在 fn 里换新锁、丢掉父进程进行中的状态。
+    fn 是实例的绑定方法时只弱引用该实例；不支持 fork 的平台什么都不做
+    """
+    if not hasattr(os, "register_at_fork"):
+        return
+    owner = getattr(fn, "__self__", None)
+    if owner is None or isinstance(owner, type):
+        os.register_at_fork(after_in_child=fn)
+        return
+    ref = weakref.WeakMethod(fn)
+
+    def call():
+        method = ref()
+        if method is not None:
+            method()
+
+    os.register_at_fork(after_in_child=call)
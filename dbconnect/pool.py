@@ -0,0 +1,225 @@
+# pool.py
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Any
+
+import pymysql
+
+from dbconnect.forksafe import after_fork_in_child
+
+
+class PoolTimeoutError(Exception):
+    """等待空闲连接超时"""
+
+
+class ConnectionPool:
+    """
+    线程安全的有界连接池
+    - min_size：常驻连接数，回收空闲连接时不会低于该值
+    - max_size：同时借出 + 空闲的连接总数上限
+    - max_idle_seconds：空闲超过该时长的多余连接会被关闭
+    - ping_after_seconds：连接空闲超过该时长，借出前先 ping 一次确认存活
+    - checkout_timeout：池满时等待归还的最长秒数
+    """
+
+    def __init__(self, factory: Callable[[], Any], min_size: int = 1, max_size: int = 10,
+                 max_idle_seconds: float = 300, ping_after_seconds: float = 30,
+                 checkout_timeout: float = 10):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("连接池大小配置非法: min_size=%s max_size=%s" % (min_size, max_size))
+        self._factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.ping_after_seconds = ping_after_seconds
+        self.checkout_timeout = checkout_timeout
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()          # (conn, last_used)，右进右出，保持热连接优先
+        self._size = 0                # 已创建且未关闭的连接数（借出 + 空闲）
+        self._pid = os.getpid()       # gunicorn fork 之后不能复用父进程的 socket
+        after_fork_in_child(self._after_fork)
+
+        # 指标
+        self._checkouts = 0
+        self._created = 0
+        self._closed = 0
+        self._ping_failures = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._waiting = 0
+
+    # -------------------------------------------------
+    # 借出 / 归还
+    # -------------------------------------------------
+    def acquire(self):
+        """借出一个可用连接，池满时阻塞等待，超时抛 PoolTimeoutError"""
+        self._check_fork()
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    self._reap_locked()
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, last_used = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            "等待数据库连接超时(%.1fs)，max_size=%s" % (self.checkout_timeout, self.max_size))
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        # 建连、ping 都在锁外进行，避免阻塞其他线程
+        if conn is None:
+            return self._create()
+        if time.monotonic() - last_used >= self.ping_after_seconds and not self._is_alive(conn):
+            self._discard(conn, count_slot=False)
+            return self._create()
+        return conn
+
+    def release(self, conn, broken: bool = False):
+        """归还连接；broken=True 或连接来自 fork 前的进程时直接关闭"""
+        if broken or os.getpid() != self._pid:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: 出错时回滚，连接级错误则丢弃该连接"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except pymysql.err.OperationalError:
+            broken = True
+            raise
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    # -------------------------------------------------
+    # 维护
+    # -------------------------------------------------
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接归还后照常入池）"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._closed += len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池快照：容量、使用情况和等待耗时"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': idle,
+                'in_use': self._size - idle,
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'created': self._created,
+                'closed': self._closed,
+                'ping_failures': self._ping_failures,
+                'timeouts': self._timeouts,
+                'wait_total_ms': round(self._wait_total * 1000, 3),
+                'wait_avg_ms': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+    # ------------------ 下面全是小工具 ------------------
+    def _create(self):
+        try:
+            conn = self._factory()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _discard(self, conn, count_slot: bool = True):
+        """关闭连接；count_slot=False 表示名额留给马上要新建的连接"""
+        self._close_quietly(conn)
+        with self._cond:
+            self._closed += 1
+            if count_slot:
+                self._size -= 1
+                self._cond.notify()
+
+    def _is_alive(self, conn) -> bool:
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._cond:
+                self._ping_failures += 1
+            return False
+
+    def _reap_locked(self):
+        """关闭空闲过久的多余连接（调用方已持有锁）；最老的连接在左侧"""
+        now = time.monotonic()
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] >= self.max_idle_seconds):
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._closed += 1
+            self._close_quietly(conn)
+
+    def _after_fork(self):
+        """fork 出的子进程里：换新锁（父进程其它线程可能正持有），继承来的连接直接丢掉（不能发 QUIT）"""
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()
+        self._size = 0
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        """子进程里丢弃继承来的连接，按空池重新开始"""
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        with self._cond:
+            if pid == self._pid:
+                return
+            self._idle.clear()
+            self._size = 0
+            self._pid = pid
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
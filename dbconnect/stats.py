@@ -0,0 +1,188 @@
+# stats.py
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Any, List, Callable
+
+from dbconnect.forksafe import after_fork_in_child
+
+logger = logging.getLogger(__name__)
+
+# 直方图桶上界（毫秒），最后一个桶收纳所有更慢的语句
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+_RE_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_RE_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_RE_LINE_COMMENT = re.compile(r"(?:--|#)[^\n]*")
+_RE_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+_RE_VALUES_ROWS = re.compile(r"(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_RE_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(sql: str) -> str:
+    """
+    把 SQL 归一化成指纹：字面量/占位符 → ?，IN 列表和多值 VALUES 折叠，
+    去注释、压空白。同一语句不同参数得到同一指纹。
+    """
+    s = _RE_STRING.sub("?", sql)
+    s = _RE_BLOCK_COMMENT.sub(" ", s)
+    s = _RE_LINE_COMMENT.sub(" ", s)
+    s = _RE_PLACEHOLDER.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_IN_LIST.sub("IN (?+)", s)
+    s = _RE_VALUES_ROWS.sub(r"\1", s)
+    return _RE_SPACE.sub(" ", s).strip().rstrip(";").strip()
+
+
+class _Tracked:
+    """track() 产出的记录对象，调用方在块内写入 rows"""
+    __slots__ = ("sql", "rows")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.rows = 0
+
+
+class _FingerprintStats:
+    __slots__ = ("count", "errors", "rows", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+
+class QueryStats:
+    """
+    按 SQL 指纹统计执行次数、返回/影响行数、耗时直方图；
+    超过 slow_query_ms 的语句写慢查询日志。
+    listener 回调签名：fn(fingerprint, elapsed_ms, rows, error)
+    """
+
+    def __init__(self, slow_query_ms: float = 500, enabled: bool = True):
+        self.slow_query_ms = slow_query_ms
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _FingerprintStats] = {}
+        self._listeners: List[Callable] = []
+        self._slow_count = 0
+        after_fork_in_child(self._after_fork)
+
+    def add_listener(self, fn: Callable):
+        self._listeners.append(fn)
+
+    @contextmanager
+    def track(self, sql: str):
+        """with stats.track(sql) as t: ...; t.rows = n"""
+        if not self.enabled:
+            yield _Tracked(sql)
+            return
+        t = _Tracked(sql)
+        start = time.perf_counter()
+        error = False
+        try:
+            yield t
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(sql, (time.perf_counter() - start) * 1000, t.rows, error)
+
+    def record(self, sql: str, elapsed_ms: float, rows: int = 0, error: bool = False):
+        fp = fingerprint(sql)
+        with self._lock:
+            st = self._stats.get(fp)
+            if st is None:
+                st = self._stats[fp] = _FingerprintStats()
+            st.count += 1
+            st.rows += rows or 0
+            st.total_ms += elapsed_ms
+            if elapsed_ms > st.max_ms:
+                st.max_ms = elapsed_ms
+            if error:
+                st.errors += 1
+            for i, bound in enumerate(LATENCY_BUCKETS_MS):
+                if elapsed_ms <= bound:
+                    st.buckets[i] += 1
+                    break
+            slow = self.slow_query_ms is not None and elapsed_ms >= self.slow_query_ms
+            if slow:
+                self._slow_count += 1
+
+        if slow:
+            logger.warning("slow query %.1fms rows=%s: %s", elapsed_ms, rows, fp)
+        for fn in self._listeners:
+            try:
+                fn(fp, elapsed_ms, rows, error)
+            except Exception as e:
+                logger.warning("query stats listener error: %s", e)
+
+    def snapshot(self, top: int = None) -> Dict[str, Any]:
+        """
+        统计快照，按总耗时倒序：
+        {'slow_query_ms', 'slow_count', 'statements': [{fingerprint, count, rows, total_ms,
+         avg_ms, max_ms, p50_ms, p95_ms, p99_ms, errors, histogram}, ...]}
+        分位数取所在直方图桶的上界，是近似值
+        """
+        with self._lock:
+            items = [(fp, st.count, st.errors, st.rows, st.total_ms, st.max_ms, list(st.buckets))
+                     for fp, st in self._stats.items()]
+            slow_count = self._slow_count
+
+        statements = []
+        for fp, count, errors, rows, total_ms, max_ms, buckets in items:
+            statements.append({
+                'fingerprint': fp,
+                'count': count,
+                'errors': errors,
+                'rows': rows,
+                'total_ms': round(total_ms, 3),
+                'avg_ms': round(total_ms / count, 3) if count else 0.0,
+                'max_ms': round(max_ms, 3),
+                'p50_ms': self._percentile(buckets, count, 0.50, max_ms),
+                'p95_ms': self._percentile(buckets, count, 0.95, max_ms),
+                'p99_ms': self._percentile(buckets, count, 0.99, max_ms),
+                'histogram': {self._bucket_label(b): n for b, n in zip(LATENCY_BUCKETS_MS, buckets) if n},
+            })
+        statements.sort(key=lambda x: x['total_ms'], reverse=True)
+        if top:
+            statements = statements[:top]
+        return {
+            'slow_query_ms': self.slow_query_ms,
+            'slow_count': slow_count,
+            'statements': statements,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow_count = 0
+
+    # ------------------ 下面全是小工具 ------------------
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _percentile(buckets: List[int], count: int, q: float, max_ms: float) -> float:
+        if not count:
+            return 0.0
+        target = q * count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS, buckets):
+            seen += n
+            if seen >= target:
+                return round(min(bound, max_ms), 3)
+        return round(max_ms, 3)
+
+    @staticmethod
+    def _bucket_label(bound: float) -> str:
+        return "+inf" if bound == float('inf') else "<=%gms" % bound
@@ -2,6 +2,8 @@ from typing import List, Dict, Optional
 from ejiacanAI.models import Dish, FamilyNeed, MemberConstraints, NeedInfo, RecommendationConfig
 import logging
 
+from dbconnect.dbconn import in_clause
+
 logger = logging.getLogger(__name__)
 
 
@@ -11,7 +13,7 @@ class EnhancedDataAccess:
 
     def get_member_needs(self, member_ids: List[int]) -> NeedInfo:
         """获取成员需求信息（包含权重）"""
-        ids_str = ','.join(map(str, member_ids))
+        ids_in, params = in_clause(member_ids)
 
         sql = f"""
             SELECT 
@@ -21,10 +23,10 @@ class EnhancedDataAccess:
                 COUNT(*) OVER (PARTITION BY dn.need_code) as need_frequency
             FROM ejia_member_diet_need dn
             JOIN ejia_enum_diet_need_tbl edn ON dn.need_code = edn.code
-            WHERE dn.member_id IN ({ids_str})
+            WHERE dn.member_id IN ({ids_in})
         """
 
-        rows = self.db.query(sql)
+        rows = self.db.query(sql, params)
 
         member_needs = {}
         all_need_codes = set()
@@ -53,23 +55,42 @@ class EnhancedDataAccess:
 
     def get_member_constraints(self, member_ids: List[int]) -> MemberConstraints:
         """获取成员约束条件"""
-        ids_str = ','.join(map(str, member_ids))
+        ids_in, params = in_clause(member_ids)
 
         # 获取过敏信息
         allergy_sql = f"""
-            SELECT DISTINCT ma.member_id
+            SELECT DISTINCT ma.member_id, ma.allergen_code
             FROM ejia_member_allergen ma
-            WHERE ma.member_id IN ({ids_str})
+            WHERE ma.member_id IN ({ids_in})
         """
-        allergy_rows = self.db.query(allergy_sql)
-        allergy_member_ids = [row['member_id'] for row in allergy_rows]
+        allergy_rows = self.db.query(allergy_sql, params)
+        allergy_member_ids = list(dict.fromkeys(row['member_id'] for row in allergy_rows))
+        allergen_codes = list(dict.fromkeys(row['allergen_code'] for row in allergy_rows if row['allergen_code']))
 
-        return MemberConstraints(allergy_member_ids=allergy_member_ids)
+        return MemberConstraints(allergy_member_ids=allergy_member_ids, allergen_codes=allergen_codes)
+
+    @staticmethod
+    def _allergen_exclusion(constraints: MemberConstraints):
+        """
+        家庭过敏原 -> (SQL 条件, 参数)。
+        与原来按成员关联 ejia_member_allergen 的子查询等价：过敏原编码已在 get_member_constraints 查出，
+        这里直接按编码参数化，仍以 ejia_enum_allergen_tbl（过敏原 -> 食材）为准，不依赖进程内菜品目录；
+        家庭没有过敏原时条件为空
+        """
+        if not constraints.allergen_codes:
+            return "", []
+        code_in, code_params = in_clause(constraints.allergen_codes)
+        return f"""AND d.id NOT IN (
+                SELECT dfr.dish_id
+                FROM ejia_dish_food_rel dfr
+                JOIN ejia_enum_allergen_tbl ea ON ea.food_id = dfr.food_id
+                WHERE ea.code IN ({code_in})
+            )""", code_params
 
     def get_dishes_for_need(self, need_code: str, constraints: MemberConstraints,
                             min_score: float = 0.6, limit: int = 50) -> List[Dict]:
         """根据单一需求获取菜品（适应纵表结构）"""
-        member_ids_str = ','.join(map(str, constraints.allergy_member_ids)) if constraints.allergy_member_ids else '-1'
+        allergen_sql, allergen_params = self._allergen_exclusion(constraints)
 
         sql = f"""
             SELECT 
@@ -95,20 +116,14 @@ class EnhancedDataAccess:
             LEFT JOIN view_dish_nutrients_long dnl ON dnl.dish_id = d.id
             WHERE nm.need_code = %s
             AND nm.match_score >= %s
-            AND d.id NOT IN (
-                SELECT DISTINCT dfr.dish_id
-                FROM ejia_dish_food_rel dfr
-                JOIN ejia_enum_allergen_tbl ea ON ea.food_id = dfr.food_id
-                JOIN ejia_member_allergen ma ON ma.allergen_code = ea.code
-                WHERE ma.member_id IN ({member_ids_str})
-            )
+            {allergen_sql}
             GROUP BY d.id, d.name, d.emoji, d.default_portion_g, d.max_servings, d.rating, 
                      nm.match_score, nm.need_code
             ORDER BY nm.match_score DESC, d.rating DESC
             LIMIT %s
         """
 
-        return self.db.query(sql, (need_code, min_score, limit))
+        return self.db.query(sql, [need_code, min_score] + allergen_params + [limit])
 
     def get_dishes_for_multiple_needs(self, need_codes: List[str], constraints: MemberConstraints,
                                       need_weights: Dict[str, float], limit: int = 100) -> List[Dict]:
@@ -116,15 +131,17 @@ class EnhancedDataAccess:
         if not need_codes:
             return []
 
-        need_codes_str = ','.join([f"'{code}'" for code in need_codes])
-        member_ids_str = ','.join(map(str, constraints.allergy_member_ids)) if constraints.allergy_member_ids else '-1'
+        need_in, need_params = in_clause(need_codes)
+        allergen_sql, allergen_params = self._allergen_exclusion(constraints)
 
-        # 构建权重条件
+        # 构建权重条件（参数化，按需求码排序保证 SQL 文本稳定）
         weight_conditions = []
-        for need_code, weight in need_weights.items():
-            weight_conditions.append(f"WHEN nm.need_code = '{need_code}' THEN {weight}")
+        weight_params = []
+        for need_code, weight in sorted(need_weights.items()):
+            weight_conditions.append("WHEN nm.need_code = %s THEN %s")
+            weight_params += [need_code, weight]
 
-        weight_case = f"CASE {' '.join(weight_conditions)} ELSE 1 END"
+        weight_case = f"CASE {' '.join(weight_conditions)} ELSE 1 END" if weight_conditions else "1"
 
         sql = f"""
             SELECT 
@@ -149,22 +166,16 @@ class EnhancedDataAccess:
             FROM ejia_dish d
             JOIN ejia_need_dish_match nm ON nm.dish_id = d.id
             LEFT JOIN view_dish_nutrients_long dnl ON dnl.dish_id = d.id
-            WHERE nm.need_code IN ({need_codes_str})
+            WHERE nm.need_code IN ({need_in})
             AND nm.match_score > 0
-            AND d.id NOT IN (
-                SELECT DISTINCT dfr.dish_id
-                FROM ejia_dish_food_rel dfr
-                JOIN ejia_enum_allergen_tbl ea ON ea.food_id = dfr.food_id
-                JOIN ejia_member_allergen ma ON ma.allergen_code = ea.code
-                WHERE ma.member_id IN ({member_ids_str})
-            )
+            {allergen_sql}
             GROUP BY d.id, d.name, d.emoji, d.default_portion_g, d.rating
             HAVING matched_needs_count >= 1
             ORDER BY weighted_score DESC, d.rating DESC
             LIMIT %s
         """
 
-        return self.db.query(sql, (limit,))
+        return self.db.query(sql, weight_params + need_params + allergen_params + [limit])
 
     def fetch_matching_combos_new(self, recommended: List[dict]) -> List[dict]:
         """
@@ -183,7 +194,7 @@ class EnhancedDataAccess:
         if not recommended_dish_ids:
             return []
 
-        ids_str = ','.join(map(str, recommended_dish_ids))
+        dish_in, dish_params = in_clause(sorted(recommended_dish_ids))
 
         # 查询包含推荐菜品的套餐
         sql = f"""
@@ -194,17 +205,16 @@ class EnhancedDataAccess:
                 c.meal_type
             FROM ejia_combo c
             JOIN ejia_combo_dish_rel cd ON cd.combo_id = c.id
-            WHERE cd.dish_id IN ({ids_str})
+            WHERE cd.dish_id IN ({dish_in})
             ORDER BY c.id
         """
-        combo_rows = self.db.query(sql)
+        combo_rows = self.db.query(sql, dish_params)
 
         if not combo_rows:
             return []
 
         # 获取这些套餐的所有菜品
-        combo_ids = [str(row['combo_id']) for row in combo_rows]
-        combo_ids_str = ','.join(combo_ids)
+        combo_in, combo_params = in_clause([row['combo_id'] for row in combo_rows])
 
         dishes_sql = f"""
             SELECT
@@ -220,10 +230,10 @@ class EnhancedDataAccess:
             FROM ejia_combo c
             JOIN ejia_combo_dish_rel cd ON cd.combo_id = c.id
             JOIN ejia_dish d ON d.id = cd.dish_id
-            WHERE c.id IN ({combo_ids_str})
+            WHERE c.id IN ({combo_in})
             ORDER BY c.id, cd.dish_id
         """
-        dish_rows = self.db.query(dishes_sql)
+        dish_rows = self.db.query(dishes_sql, combo_params)
 
         # 创建推荐信息映射
         rec_info_map = {}
@@ -361,7 +371,7 @@ class EnhancedDataAccess:
 
     def get_popular_dishes(self, constraints: MemberConstraints, limit: int = 20) -> List[Dict]:
         """获取受欢迎的菜品（无特殊需求时使用）- 使用纵表结构"""
-        member_ids_str = ','.join(map(str, constraints.allergy_member_ids)) if constraints.allergy_member_ids else '-1'
+        allergen_sql, allergen_params = self._allergen_exclusion(constraints)
 
         sql = f"""
             SELECT 
@@ -384,19 +394,13 @@ class EnhancedDataAccess:
             FROM ejia_dish d
             LEFT JOIN view_dish_nutrients_long dnl ON dnl.dish_id = d.id
             WHERE d.rating >= 4.0
-            AND d.id NOT IN (
-                SELECT DISTINCT dfr.dish_id
-                FROM ejia_dish_food_rel dfr
-                JOIN ejia_enum_allergen_tbl ea ON ea.food_id = dfr.food_id
-                JOIN ejia_member_allergen ma ON ma.allergen_code = ea.code
-                WHERE ma.member_id IN ({member_ids_str})
-            )
+            {allergen_sql}
             GROUP BY d.id, d.name, d.emoji, d.default_portion_g, d.max_servings, d.rating
             ORDER BY d.rating DESC, RAND()
             LIMIT %s
         """
 
-        rows = self.db.query(sql, (limit,))
+        rows = self.db.query(sql, allergen_params + [limit])
 
         # 处理数据类型转换
         processed_rows = []
@@ -0,0 +1,39 @@
+# dish2_allergen_index.py
+from typing import Dict, Iterable, Sequence
+
+import numpy as np
+
+from ejiacanAI.dish2_combo_models import Dish
+
+
+class AllergenIndex:
+    """
+    过敏原位掩码：目录里出现过的每个过敏原编码占一位，每道菜一个掩码。
+    一次请求先把家庭过敏原折成一个掩码，再对整个目录做一次向量化的 AND 判断。
+    目录里没有任何菜含有的过敏原不占位（也不影响过滤结果）。
+    """
+
+    def __init__(self, dishes: Sequence[Dish]):
+        codes = sorted({code for d in dishes for code in d.allergens if code})
+        self.bits: Dict[str, int] = {code: 1 << i for i, code in enumerate(codes)}
+        # 过敏原不超过 64 种时用 uint64 数组，否则退回 Python int（object 数组同样支持按位与）
+        dtype = np.uint64 if len(codes) <= 64 else object
+        self.masks = np.array([self.mask_of(d.allergens) for d in dishes], dtype=dtype)
+
+    def mask_of(self, codes: Iterable[str]) -> int:
+        mask = 0
+        for code in codes:
+            mask |= self.bits.get(code, 0)
+        return mask
+
+    def family_mask(self, allergen_codes: Iterable[str]) -> int:
+        """家庭成员过敏原 -> 掩码"""
+        return self.mask_of(allergen_codes)
+
+    def safe(self, family_mask: int) -> np.ndarray:
+        """按目录顺序的布尔数组：True 表示该菜不含家庭任何过敏原"""
+        if not family_mask:
+            return np.ones(len(self.masks), dtype=bool)
+        if self.masks.dtype == object:
+            return np.bitwise_and(self.masks, family_mask) == 0
+        return (self.masks & np.uint64(family_mask)) == 0
@@ -0,0 +1,123 @@
+# dish2_batch.py
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ejiacanAI.dish2_catalog import DishCatalog
+from ejiacanAI.dish2_combo_data import DishComboData
+from ejiacanAI.dish2_combo_generator import MealGeneratorV2
+from ejiacanAI.dish2_combo_models import ComboMeal, MealRequest
+from models.nutrition_data import NutritionData
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchResult:
+    index: int                          # 在输入里的下标（结果按完成顺序产出）
+    request: MealRequest
+    meals: Optional[List[ComboMeal]] = None
+    error: Optional[str] = None         # 单个家庭失败不影响其它家庭
+
+
+class MealBatch:
+    """
+    多家庭批量生成：
+    - 父进程先加载一次菜品目录快照，子进程用 fork 启动直接继承（不支持 fork 的平台由子进程各自加载）；
+      父进程其它线程持有的锁、进行中的合并请求由各模块的 after_fork_in_child 钩子在子进程里重置
+    - 请求按过滤键（餐次, 菜系, 烹饪时间）分组再切块，同一块的家庭共用一份目录过滤结果，
+      块内成员的营养需求、过敏原各一条批量查询
+    - 块在进程池里并行跑，跑完一块产出一块（BatchResult），调用方可以边收边写
+    - 走与接口相同的生成路径，方案缓存照常写入（配置了共享存储时接口能直接命中）
+    workers <= 1 时在当前进程顺序执行，便于调试。
+    """
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 50):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = max(1, chunk_size)
+        self.families = 0
+        self.failed = 0
+        self.elapsed = 0.0
+
+    def run(self, requests: Iterable[MealRequest]) -> Iterator[BatchResult]:
+        requests = list(requests)
+        start = time.perf_counter()
+        self.families = self.failed = 0
+        DishCatalog.get()
+        chunks = self.chunks(requests, self.chunk_size)
+        logger.info("batch start: %d families, %d chunks, %d workers", len(requests), len(chunks), self.workers)
+        try:
+            for results in self._run_chunks(chunks):
+                for index, meals, error in results:
+                    self.families += 1
+                    if error is not None:
+                        self.failed += 1
+                    yield BatchResult(index, requests[index], meals, error)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            logger.info("batch done: %s", self.stats())
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'families': self.families,
+            'failed': self.failed,
+            'seconds': round(self.elapsed, 3),
+            'families_per_sec': round(self.families / self.elapsed, 2) if self.elapsed else 0.0,
+        }
+
+    @staticmethod
+    def chunks(requests: List[MealRequest], chunk_size: int) -> List[List[Tuple[int, MealRequest]]]:
+        """按过滤键分组（保持首次出现的顺序），组内按 chunk_size 切块"""
+        groups: "OrderedDict[tuple, List[Tuple[int, MealRequest]]]" = OrderedDict()
+        for index, req in enumerate(requests):
+            key = (req.meal_type, req.dish_series, req.cook_time_limit)
+            groups.setdefault(key, []).append((index, req))
+        return [entries[i:i + chunk_size]
+                for entries in groups.values()
+                for i in range(0, len(entries), chunk_size)]
+
+    # ------------------ 下面全是小工具 ------------------
+    def _run_chunks(self, chunks: List[List[Tuple[int, MealRequest]]]):
+        if self.workers <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield _run_chunk(chunk)
+            return
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(chunks)), mp_context=context) as pool:
+            futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+def _run_chunk(chunk: List[Tuple[int, MealRequest]]) -> List[Tuple[int, Optional[List[ComboMeal]], Optional[str]]]:
+    """
+    子进程里跑一块请求（模块级函数，进程池才能 pickle）：
+    先一次取回整块成员的营养需求（进当天缓存）和过敏原，再逐个家庭生成
+    """
+    NutritionData.get_daily_nutrient_targets_actual_batch(
+        m.get('member_id') for _, req in chunk for m in (req.members or [])
+    )
+    allergens_by_member = DishComboData.get_members_allergens(
+        mid for _, req in chunk for mid in (req.member_ids or [])
+    )
+
+    results = []
+    for index, req in chunk:
+        try:
+            allergen_codes = sorted({code for mid in (req.member_ids or [])
+                                     for code in allergens_by_member.get(mid, [])})
+            if req.member_ids in (None, [], [0]):
+                meals = MealGeneratorV2.generate_per_meal_default(req, allergen_codes=allergen_codes)
+            else:
+                meals = MealGeneratorV2.generate_per_meal(req, allergen_codes=allergen_codes)
+            results.append((index, meals, None))
+        except Exception as e:
+            logger.exception("batch family %s failed", req.member_ids)
+            results.append((index, None, f"{type(e).__name__}: {e}"))
+    return results
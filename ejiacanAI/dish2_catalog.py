@@ -0,0 +1,207 @@
+# dish2_catalog.py
+import dataclasses
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dbconnect.forksafe import after_fork_in_child
+from ejiacanAI.dish2_combo_models import MealRequest, Dish
+from ejiacanAI.dish2_combo_data import DishComboData
+from ejiacanAI.dish2_matrix import NutrientMatrix, DISH_NUTRIENT_CODES
+from ejiacanAI.dish2_tag_index import TagIndex
+from ejiacanAI.dish2_allergen_index import AllergenIndex
+from ejiacanAI.dish2_want_eat import WantEatIndex
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSnapshot:
+    """
+    某一版本的全量菜品目录（已组装好的 Dish），加载后只读，多个请求共享。
+    需要修改的菜品请先 DishCatalog.checkout() 拿副本。
+    matrix 是同一批菜的 菜品×营养素 矩阵，供向量化打分使用；
+    tag_index 是标签倒排位图，classify 给定时同时预先算好每道菜的结构类型；
+    allergens 是每道菜的过敏原位掩码；want_eat 是菜名 / 食材名到菜品的索引。
+    """
+    __slots__ = ("version", "watermark", "loaded_at", "load_ms", "dishes", "by_id", "matrix", "tag_index",
+                 "allergens", "want_eat")
+
+    def __init__(self, version: int, watermark: Optional[str], dishes: List[Dish], load_ms: float,
+                 classify: Optional[Callable[[Dish], str]] = None):
+        self.version = version
+        self.watermark = watermark
+        self.loaded_at = time.time()
+        self.load_ms = load_ms
+        self.dishes: Tuple[Dish, ...] = tuple(dishes)
+        self.by_id: Dict[int, Dish] = {d.dish_id: d for d in self.dishes}
+        self.matrix = NutrientMatrix(self.dishes, DISH_NUTRIENT_CODES)
+        self.tag_index = TagIndex(self.dishes, classify)
+        self.allergens = AllergenIndex(self.dishes)
+        self.want_eat = WantEatIndex(self.dishes)
+
+    def __len__(self):
+        return len(self.dishes)
+
+    def select(self, dishes: List[Dish], mask: int, fallback: Callable[[Dish], bool]) -> List[Dish]:
+        """
+        按标签位图筛选一组菜：本快照菜品的副本查位图，其它菜（或标签已不是同一份的）走 fallback
+        """
+        allowed = None
+        selected = []
+        for dish in dishes:
+            pos = self._tag_position(dish)
+            if pos is None:
+                ok = fallback(dish)
+            else:
+                if allowed is None:
+                    allowed = set(TagIndex.positions(mask))
+                ok = pos in allowed
+            if ok:
+                selected.append(dish)
+        return selected
+
+    def group_by_structure(self, dishes: List[Dish], structure_types: Iterable[str],
+                           classify: Callable[[Dish], str]) -> Dict[str, List[Dish]]:
+        """
+        按结构类型给一组菜分桶，每次调用都是新字典（请求内私有）；
+        只收 structure_types 里的类型，目录菜用预先算好的类型，其它菜用 classify 现算
+        """
+        groups: Dict[str, List[Dish]] = {t: [] for t in structure_types}
+        for dish in dishes:
+            bucket = groups.get(self.structure_type_of(dish) or classify(dish))
+            if bucket is not None:
+                bucket.append(dish)
+        return groups
+
+    def structure_type_of(self, dish: Dish) -> Optional[str]:
+        """预先算好的结构类型；标签或营养素已不是快照里那一份时返回 None，由调用方现算"""
+        pos = self._tag_position(dish)
+        if pos is None or self.dishes[pos].nutrients is not dish.nutrients:
+            return None
+        return self.tag_index.structure_types[pos]
+
+    def _tag_position(self, dish: Dish) -> Optional[int]:
+        pos = self.tag_index.position.get(dish.dish_id)
+        if pos is None or self.dishes[pos].dish_tags is not dish.dish_tags:
+            return None
+        return pos
+
+
+class DishCatalog:
+    """
+    进程内菜品目录快照：
+    - 第一次 get() 同步加载；之后每隔 check_interval 秒在后台线程比对一次目录水位，
+      水位变化才重新加载，加载完成后整体替换引用，正在用旧快照的请求不受影响
+    - 后台管理保存菜品后调用 invalidate()，下一次 get() 跳过水位比对直接后台重载
+    - 后台加载失败时继续使用旧快照，只写日志
+    """
+    check_interval = 60
+
+    _snapshot: Optional[CatalogSnapshot] = None
+    _lock = threading.Lock()
+    _refresh_thread: Optional[threading.Thread] = None
+    _last_check = 0.0
+    _dirty = False
+
+    @classmethod
+    def get(cls) -> CatalogSnapshot:
+        snapshot = cls._snapshot
+        if snapshot is None:
+            with cls._lock:
+                if cls._snapshot is None:
+                    cls._snapshot = cls._load(1)
+                    cls._last_check = time.monotonic()
+            return cls._snapshot
+        if cls._dirty or time.monotonic() - cls._last_check >= cls.check_interval:
+            cls._refresh_async()
+        return snapshot
+
+    @classmethod
+    def invalidate(cls):
+        """菜品 / 食材 / 标签被修改后调用，下一次 get() 触发后台重载"""
+        cls._dirty = True
+
+    @classmethod
+    def refresh(cls, force: bool = False) -> CatalogSnapshot:
+        """同步比对水位，变化（或 force）时重新加载并替换快照"""
+        with cls._lock:
+            cls._last_check = time.monotonic()
+            force = force or cls._dirty
+            cls._dirty = False
+            current = cls._snapshot
+            if current is not None and not force:
+                if DishComboData.get_catalog_watermark() == current.watermark:
+                    return current
+            version = current.version + 1 if current is not None else 1
+            cls._snapshot = cls._load(version)
+            return cls._snapshot
+
+    @classmethod
+    def stats(cls) -> Dict:
+        snapshot = cls._snapshot
+        if snapshot is None:
+            return {'loaded': False}
+        return {
+            'loaded': True,
+            'version': snapshot.version,
+            'watermark': snapshot.watermark,
+            'dish_count': len(snapshot),
+            'loaded_at': snapshot.loaded_at,
+            'load_ms': round(snapshot.load_ms, 3),
+        }
+
+    @staticmethod
+    def checkout(dish: Dish) -> Dish:
+        """
+        复制一道菜供单个请求修改：选菜会写 is_selected / meal_structure_type，
+        份量缩放会替换 exact_portion、nutrients 并改写 ingredients 里的克数
+        """
+        return dataclasses.replace(dish, ingredients=[dict(i) for i in dish.ingredients])
+
+    # ------------------ 下面全是小工具 ------------------
+    @classmethod
+    def _after_fork(cls):
+        # 快照原样沿用；父进程的后台刷新线程不会跟到子进程里，刷新锁换新的，检查时间从现在算
+        cls._lock = threading.Lock()
+        cls._refresh_thread = None
+        cls._last_check = time.monotonic()
+
+    @classmethod
+    def _refresh_async(cls):
+        thread = cls._refresh_thread
+        if thread is not None and thread.is_alive():
+            return
+        # 先占住检查时间，避免并发请求各自起线程
+        cls._last_check = time.monotonic()
+        thread = threading.Thread(target=cls._refresh_quietly, name="dish-catalog-refresh", daemon=True)
+        cls._refresh_thread = thread
+        thread.start()
+
+    @classmethod
+    def _refresh_quietly(cls):
+        try:
+            before = cls._snapshot
+            after = cls.refresh()
+            if after is not before:
+                logger.info("dish catalog reloaded: version=%s dishes=%s %.1fms",
+                            after.version, len(after), after.load_ms)
+        except Exception as e:
+            logger.warning("dish catalog refresh failed, keep version %s: %s",
+                           cls._snapshot.version if cls._snapshot else None, e)
+
+    @staticmethod
+    def _load(version: int) -> CatalogSnapshot:
+        # 与 generator 互相引用，延迟导入
+        from ejiacanAI.dish2_combo_generator import MealGeneratorV2
+
+        start = time.perf_counter()
+        # 先取水位再读数据：读的过程中若有修改，下一次比对水位时会再加载一次
+        watermark = DishComboData.get_catalog_watermark()
+        wide_rows = DishComboData.stream_dish_food_nutrient([], MealRequest())
+        dishes = MealGeneratorV2.build_true_dishes(wide_rows, MealRequest())
+        return CatalogSnapshot(version, watermark, dishes, (time.perf_counter() - start) * 1000,
+                               classify=MealGeneratorV2._classify_dish_structure_type)
+
+
+after_fork_in_child(DishCatalog._after_fork)
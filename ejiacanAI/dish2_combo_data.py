@@ -1,8 +1,9 @@
 # dish_combo_data.py  追加内容
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Iterator, Tuple
 
 from ejiacanAI.dish2_combo_models import DishFoodNutrient, MemberNeedNutrient, MealRequest
-from dbconnect.dbconn import db
+from dbconnect.dbconn import db, in_clause
+from models.nutrient_config import NUTRIENT_MAPPING
 
 class DishComboData:
     ...  # 原有代码不动
@@ -12,16 +13,43 @@ class DishComboData:
     # -------------------------------------------------
     @staticmethod
     def list_dish_food_nutrient(dish_ids: List[int], req: MealRequest) -> List[DishFoodNutrient]:
+        sql, params = DishComboData._dish_food_nutrient_sql(dish_ids, req)
+        rows = db.query(sql, params)
+        return [DishFoodNutrient(**r) for r in rows]
+
+    @staticmethod
+    def stream_dish_food_nutrient(dish_ids: List[int], req: MealRequest,
+                                  batch_size: int = 1000) -> Iterator[DishFoodNutrient]:
+        """
+        与 list_dish_food_nutrient 同一条 SQL，但走服务端游标逐行产出，
+        行按 dish_id, food_id 有序，调用方可以边读边组装菜品
+        """
+        sql, params = DishComboData._dish_food_nutrient_sql(dish_ids, req)
+        for r in db.stream(sql, params, batch_size=batch_size):
+            yield DishFoodNutrient(**r)
+
+    @staticmethod
+    def _dish_food_nutrient_sql(dish_ids: List[int], req: MealRequest) -> Tuple[str, list]:
+        """返回 (sql, params)；IN 列表按固定档位展开，同档位的请求共用同一条 SQL 文本"""
+        params = []
         # 1. 收集所有要满足的 tags
         must_tags = []
         if req.meal_type and req.meal_type != "all":
             must_tags.append(req.meal_type)
-        must_tags = [t for t in must_tags if t]  # 去空
+        must_tags = list(dict.fromkeys(t for t in must_tags if t))  # 去空、去重
 
-        # 2. 拼 tag 子查询（必须全部满足）
+        # 2. 主查询按菜品过滤（占位符在 SQL 里先出现）
+        dish_where = ""
+        if dish_ids:
+            dish_in, dish_params = in_clause(dish_ids)
+            dish_where = f"AND v.dish_id IN ({dish_in})"
+            params += dish_params
+
+        # 3. 拼 tag 子查询（必须全部满足）
         tag_where = ""
         if must_tags:
-            in_str = ",".join([f"'{t}'" for t in must_tags])
+            in_str, tag_params = in_clause(must_tags)
+            params += tag_params + [len(must_tags)]
             tag_where = f"""
             AND v.dish_id IN (
                 SELECT d.id
@@ -30,14 +58,10 @@ class DishComboData:
                 JOIN ejia_dish_tag_tbl dtt ON dtr.tag_id = dtt.id
                 WHERE dtt.tag_code IN ({in_str})
                 GROUP BY d.id
-                HAVING COUNT(DISTINCT dtt.tag_code) = {len(must_tags)}
+                HAVING COUNT(DISTINCT dtt.tag_code) = %s
             )
             """
 
-        # 3. 主查询
-        dish_where = (
-            "WHERE dish_id IN ({})".format(",".join(map(str, dish_ids))) if dish_ids else ""
-        )
         sql = f"""
             SELECT *
             FROM v3_dish_food_complete_view v
@@ -46,8 +70,50 @@ class DishComboData:
             {tag_where}
             ORDER BY dish_id, food_id
         """
+        return sql, params
+
+    @staticmethod
+    def get_catalog_watermark() -> Optional[str]:
+        """
+        菜品目录水位：菜品、食材关系、标签关系三张表各自的 行数-CRC 校验和。
+        表上没有 updated_at，改用校验和；只扫关系表，不展开视图，比重读目录便宜得多。
+        """
+        sql = """
+            SELECT CONCAT_WS(':',
+                (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS('|',
+                        id, name, cook_time, rating, need_tags))), 0))
+                   FROM ejia_dish),
+                (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS('|',
+                        dish_id, food_id, amount_grams, is_main_food))), 0))
+                   FROM ejia_dish_food_rel),
+                (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS('|',
+                        dish_id, tag_id))), 0))
+                   FROM ejia_dish_tag_rel)
+            ) AS watermark
+        """
         rows = db.query(sql)
-        return [DishFoodNutrient(**r) for r in rows]
+        return rows[0]["watermark"] if rows else None
+
+    @staticmethod
+    def list_food_nutrition() -> List[dict]:
+        """food_nutrition 全表营养列（每 100g 可食部），供营养计算矩阵使用"""
+        cols = ", ".join(NUTRIENT_MAPPING.keys())
+        sql = f"""
+            SELECT foodCode, {cols}
+            FROM food_nutrition
+            WHERE foodCode IS NOT NULL
+        """
+        return db.query(sql)
+
+    @staticmethod
+    def list_dish_food_rel(dish_ids: Optional[List[int]] = None) -> List[dict]:
+        """ejia_dish_food_rel 用量行 (dish_id, food_id, amount_grams)；dish_ids 为空表示全部"""
+        sql = "SELECT dish_id, food_id, amount_grams FROM ejia_dish_food_rel"
+        params = []
+        if dish_ids:
+            dish_in, params = in_clause(dish_ids)
+            sql += f" WHERE dish_id IN ({dish_in})"
+        return db.query(sql + " ORDER BY dish_id", params)
 
     # -------------------------------------------------
     # 2. 读取 v2_member_need_nutrient 视图
@@ -57,19 +123,31 @@ class DishComboData:
         """
         直接从 v2_member_need_nutrient 视图查询，返回模型列表
         """
-        sql = """
+        in_str, params = in_clause(member_ids or [])
+        sql = f"""
             SELECT *
             FROM v2_member_need_nutrient
-            WHERE member_id IN ({})
-        """.format(",".join(map(str, member_ids)) if member_ids else "NULL")
-        rows = db.query(sql)
+            WHERE member_id IN ({in_str})
+        """
+        rows = db.query(sql, params)
         return [MemberNeedNutrient(**r) for r in rows]
 
     # 4. 家庭过敏原
     @staticmethod
     def get_family_allergens(member_ids: List[int]) -> List[str]:
-        ids_str = ",".join(map(str, member_ids))
+        in_str, params = in_clause(member_ids or [])
         return [row["allergen_code"] for row in db.query(
-            f"SELECT DISTINCT allergen_code FROM ejia_member_allergen WHERE member_id IN ({ids_str})"
+            f"SELECT DISTINCT allergen_code FROM ejia_member_allergen WHERE member_id IN ({in_str})", params
         )]
 
+    @staticmethod
+    def get_members_allergens(member_ids: Iterable[int]) -> Dict[int, List[str]]:
+        """多个成员的过敏原一次查回：{member_id: [allergen_code]}，没有过敏原的成员不在结果里"""
+        in_str, params = in_clause(sorted(set(member_ids or [])))
+        allergens: Dict[int, List[str]] = {}
+        for row in db.query(
+            f"SELECT DISTINCT member_id, allergen_code FROM ejia_member_allergen WHERE member_id IN ({in_str})", params
+        ):
+            allergens.setdefault(row["member_id"], []).append(row["allergen_code"])
+        return allergens
+
@@ -1,16 +1,36 @@
 # meal_generator_v2.py
+import dataclasses
 import json
 import logging
+import os
 import random
-from typing import List, Dict, Optional
+import sys
+import time
+import zlib
+from itertools import groupby
+from typing import List, Dict, Optional, Iterable, Set, Callable, Tuple
 from collections import defaultdict
 
 from ejiacanAI.MealStructureGenerator import MealStructureGenerator
 from ejiacanAI.dish2_combo_models import MealRequest, ComboMeal, Dish, ExactPortion, DishFoodNutrient, Food
 from ejiacanAI.dish2_combo_data import DishComboData   # 统一数据入口
-from models.nutrient_config import MEAL_RATIO, nutrient_priority, structure_def, NUTRIENT_MAPPING,FOOD_CATEGORY_MAPPING,MEAL_FOOD_CATEGORY_TARGETS,all_categories
+from ejiacanAI.dish2_catalog import DishCatalog
+from ejiacanAI.dish2_nutrient_kernel import NutrientKernel
+from ejiacanAI.dish2_portion_solver import PortionSolver
+from ejiacanAI.dish2_score_context import DishScoreContext
+from ejiacanAI.dish2_plan_cache import PlanCache
+from ejiacanAI.dish2_singleflight import SingleFlight
+from dbconnect.deadline import current_deadline, deadline_scope
+from models.nutrient_config import MEAL_RATIO, structure_def, FOOD_CATEGORY_MAPPING,MEAL_FOOD_CATEGORY_TARGETS,all_categories
 from models.common_nutrient_calculator import CommonNutrientCalculator
 
+logger = logging.getLogger(__name__)
+
+# Food 里除 food_id / 用量 / 是否主料以外的字段，同一食材在所有菜品里相同
+_FOOD_SHARED_FIELDS = tuple(f.name for f in dataclasses.fields(Food)
+                            if f.name not in ("food_id", "food_amount_grams", "is_main_food"))
+
+
 class MealGeneratorV2:
     """
     一次性读取两张视图 → 内存对象列表 → 选菜 → 份量微调 → 打包三餐
@@ -28,91 +48,135 @@ class MealGeneratorV2:
     # 4. 去重增重：主料+做法相似
     # -------------------------------------------------
     @classmethod
-    def _dedup_increase_weight(cls, new: Dish, existing: List[Dish]) -> Dish:
+    def _dedup_increase_weight(cls, new: Dish, used_main_foods: Set[int]) -> Optional[Dish]:
         """
-        主料去重：如果主料（用量最大的食材）与已选菜品重复，则返回 None
+        主料去重：主料（用量最大的食材，目录组装时已算好 main_food_id）与已选菜品重复则返回 None；
+        不重复时把主料记入 used_main_foods（调用方随后把菜加入已选）
         """
-        if not new.ingredients:
+        main_food_id = new.main_food_id
+        if main_food_id is None:
             return new  # 无食材信息，直接保留
+        if main_food_id in used_main_foods:
+            return None  # 主料重复，丢弃新菜
+        used_main_foods.add(main_food_id)
+        return new
 
-        # 修改：提取主料（用量最大的食材）- 现在需要从列表结构中提取
-        try:
-            # 找到用量最大的食材
-            main_ingredient_new = max(new.ingredients,
-                                      key=lambda x: float(x['grams']))
-            main_ingredient_name = main_ingredient_new['name']
-        except (ValueError, KeyError):
-            # 如果无法确定主料，直接保留
-            return new
-
-        # 检查是否与已选菜品主料重复
-        for old in existing:
-            if not old.ingredients:
-                continue
-            try:
-                # 同样找到已选菜品的主料
-                main_ingredient_old = max(old.ingredients,
-                                          key=lambda x: float(x['grams']))
-                main_ingredient_old_name = main_ingredient_old['name']
-
-                if main_ingredient_name == main_ingredient_old_name:
-                    return None  # 主料重复，丢弃新菜
-            except (ValueError, KeyError):
-                continue
+    @staticmethod
+    def _used_main_foods(dishes: Iterable[Dish]) -> Set[int]:
+        """一餐已选菜品的主料集合"""
+        return {d.main_food_id for d in dishes if d.main_food_id is not None}
 
-        return new  # 主料不重复，保留新菜
+    @classmethod
+    def generate_per_meal_default(cls, req: MealRequest, prefetch: int = 0,
+                                  allergen_codes: Optional[List[str]] = None) -> List[ComboMeal]:
+        """默认家庭（未指定成员）：不做份量缩放"""
+        return cls._generate_shared("generate_per_meal_default", req, scale_portions=False,
+                                    allergen_codes=allergen_codes, prefetch=prefetch)
 
     @classmethod
-    def generate_per_meal_default(cls, req: MealRequest) -> List[ComboMeal]:
-        dish_list_wide = DishComboData.list_dish_food_nutrient([], req)  # 一次性拉全表
-        # 过滤一部分不满足req的dish，如level_la，qingzhen，sushi等，除memberneed
-        dish_list = cls.build_true_dishes(dish_list_wide, req)
-        # 只保留符合要求的菜系、种类、时间、应季等
-        filtered_dishes = cls.filter_dishes(dish_list, req)
-        rng = random.Random(req.refresh_key)
-        rng.shuffle(filtered_dishes)
-        # need_list = DishComboData.list_member_need_nutrient(req.member_ids)
+    def generate_per_meal(cls, req: MealRequest, prefetch: int = 0,
+                          allergen_codes: Optional[List[str]] = None) -> List[ComboMeal]:
+        """
+        prefetch > 0 时顺带生成接下来 prefetch 次"换一批"（refresh_key + 1 ...）的方案放进 PlanCache，
+        见 _generate_batches；allergen_codes 由调用方批量查好时直接传入（批量生成），否则按 member_ids 查
+        """
+        return cls._generate_shared("generate_per_meal", req, scale_portions=True,
+                                    allergen_codes=allergen_codes, prefetch=prefetch)
+
+    @classmethod
+    def generate_batch(cls, requests: Iterable[MealRequest], workers: Optional[int] = None,
+                       chunk_size: int = 50):
+        """
+        多个家庭一次批量生成（夜间预生成等）：逐个产出 BatchResult（完成顺序，带原始下标），
+        详见 MealBatch
+        """
+        from ejiacanAI.dish2_batch import MealBatch  # dish2_batch 依赖本模块，延迟导入
+        return MealBatch(workers=workers, chunk_size=chunk_size).run(requests)
+
+    @classmethod
+    def _generate_shared(cls, entry: str, req: MealRequest, scale_portions: bool,
+                         allergen_codes: Optional[List[str]] = None, generate: Optional[Callable] = None,
+                         prefetch: int = 0):
+        """
+        目录水位、家庭需求、过敏原和请求字段都相同时直接用缓存的方案；
+        没有缓存时同一时刻相同的请求只算一次（SingleFlight），其余请求等结果。
+        allergen_codes 由调用方批量查好时直接传入；generate 默认是单日的 _generate，
+        其它生成方式（如 _generate_week）传入同签名的函数，entry 要能区分它们。
+        prefetch：单日生成时顺带算好后面几次"换一批"的方案，按 refresh_key + i 的指纹写入缓存
+        """
+        # 目录快照是进程级的，首次加载不算进单次请求的耗时预算；
+        # 家庭需求和过敏原同样在预算外查：过敏原不能因为超时被跳过，查到一半被中止也没有可降级的结果
+        # 目录水位取不到时无法判断方案是否过期，只合并并发请求、不缓存
+        watermark = DishCatalog.get().watermark
         daily_range = CommonNutrientCalculator.get_daily_range(req.members)
+        if allergen_codes is None:
+            allergen_codes = DishComboData.get_family_allergens(req.member_ids or [])
+        with deadline_scope(req.deadline_ms) as deadline:
+            plan_key = PlanCache.fingerprint(entry, req, watermark, daily_range, allergen_codes)
+            if watermark is not None:
+                cached = PlanCache.get(plan_key)
+                if cached is not None:
+                    return cached
+
+            def build():
+                if prefetch > 0 and generate is None and deadline is None:
+                    plans, rankings = cls._generate_batches(req, daily_range, allergen_codes, scale_portions,
+                                                            1 + prefetch)
+                    if watermark is not None:
+                        cls._store_prefetched(entry, req, watermark, daily_range, allergen_codes, plans, rankings)
+                    combo_meals = plans[0]
+                else:
+                    combo_meals = (generate or cls._generate)(req, daily_range, allergen_codes, scale_portions)
+                # 超时降级的方案不缓存
+                if watermark is not None and (deadline is None or not deadline.skipped):
+                    PlanCache.put(plan_key, combo_meals)
+                return combo_meals
 
-        # 根据请求决定要生成几餐
-        if req.meal_type == "all":
-            meals_to_build = ["breakfast", "lunch", "dinner"]
-        else:
-            meals_to_build = [req.meal_type]
+            # 带耗时预算的请求各算各的：合并后等的是别人的预算，降级结果也不能给没设预算的请求
+            if deadline is not None:
+                return build()
+            return SingleFlight.do(plan_key, build)
 
-        # 逐餐处理
-        msg = MealStructureGenerator()
-        combo_meals: List[ComboMeal] = []
-        for meal_code in meals_to_build:
-            meal_range = cls._build_single_meal_range(daily_range, meal_code)
-            meal_structure = msg.calculate_meal_config(
-                req.members, meal_code, req.province_code
-            )
-            dishes = cls._select_dishes_for_meal(
-                filtered_dishes, meal_range, meal_code, req, meal_structure
-            )
-            # cls._scale_portions(dishes, meal_range)  # 按餐次独立缩放
+    @classmethod
+    def _generate(cls, req: MealRequest, daily_range: Dict[str, Dict[str, float]],
+                  allergen_codes: List[str], scale_portions: bool) -> List[ComboMeal]:
+        return cls._generate_batches(req, daily_range, allergen_codes, scale_portions, 1)[0][0]
 
-            combo_meal = cls._build_combo_meal(meal_code, dishes)
-            need_nutrients = cls._build_need_nutrients(meal_range)
-            combo_meal.need_nutrients = need_nutrients
-            combo_meal.meal_structure = meal_structure
-            combo_meals.append(combo_meal)
-        return combo_meals
+    @classmethod
+    def _store_prefetched(cls, entry: str, req: MealRequest, watermark: str,
+                          daily_range: Dict[str, Dict[str, float]], allergen_codes: List[str],
+                          plans: List[List[ComboMeal]], rankings: List[Dict[str, Dict[str, List[int]]]]):
+        """
+        预生成的第 i 套按 refresh_key + i 的指纹写入 PlanCache，只在该 key 还没有方案时写：
+        用户已经看过（已缓存）的那一批不被替换。写入时把它取自的排名（ranked:餐次）一并按同一请求存下，
+        换菜（_ranked_meal_pool）用的就是这套方案真正的来源，而不是按 refresh_key + i 重新洗牌排名
+        """
+        for i in range(1, len(plans)):
+            next_req = dataclasses.replace(req, refresh_key=req.refresh_key + i)
+            if not PlanCache.add(PlanCache.fingerprint(entry, next_req, watermark, daily_range, allergen_codes),
+                                 plans[i]):
+                continue
+            for meal_code, ranked_ids in rankings[i].items():
+                PlanCache.put(PlanCache.fingerprint(f"ranked:{meal_code}", next_req, watermark, daily_range,
+                                                    allergen_codes), ranked_ids)
 
     @classmethod
-    def generate_per_meal(cls, req: MealRequest) -> List[ComboMeal]:
-        dish_list_wide = DishComboData.list_dish_food_nutrient([],req)  # 一次性拉全表
-        # 过滤一部分不满足req的dish，如level_la，qingzhen，sushi等，除memberneed
-        dish_list = cls.build_true_dishes(dish_list_wide, req)
-        # 只保留符合要求的菜系、种类、时间、应季等
-        filtered_dishes = cls.filter_dishes(dish_list, req)
+    def _generate_batches(cls, req: MealRequest, daily_range: Dict[str, Dict[str, float]],
+                          allergen_codes: List[str], scale_portions: bool, batches: int
+                          ) -> Tuple[List[List[ComboMeal]], List[Dict[str, Dict[str, List[int]]]]]:
+        """
+        生成 batches 套方案（第一套就是本次请求的方案，其余留给"换一批"）：
+        每餐只排名一次，后面几套在同一份分桶里去掉前面各套用过的菜（主要 + 备选）再选，
+        即从排名结果里不放回地往下取。后面几套选出的菜换成副本再缩放，池里的选菜标记恢复原样，
+        第一套的结果与只生成一套时完全相同。
+        同时返回后面几套各自取自的排名 {餐次: {结构类型: [dish_id, ...]}}（第一套为空，换菜时照常重新排名）
+        """
+        # 进程内菜品快照 + 请求级过滤（菜系、烹饪时间等），拿到的是可修改的副本
+        filtered_dishes = cls.load_request_dishes(req, allergen_codes)
         rng = random.Random(req.refresh_key)
         rng.shuffle(filtered_dishes)
         # need_list = DishComboData.list_member_need_nutrient(req.member_ids)
 
-        daily_range = CommonNutrientCalculator.get_daily_range(req.members)
-
         # 根据请求决定要生成几餐
         if req.meal_type == "all":
             meals_to_build = ["breakfast", "lunch", "dinner"]
@@ -121,23 +185,184 @@ class MealGeneratorV2:
 
         # 逐餐处理
         msg = MealStructureGenerator()
-        combo_meals: List[ComboMeal] = []
-        for meal_code in meals_to_build:
-            meal_range = cls._build_single_meal_range(daily_range, meal_code)
-            meal_structure = msg.calculate_meal_config(
-                req.members, meal_code, req.province_code
-            )
-            dishes = cls._select_dishes_for_meal(
-                filtered_dishes, meal_range, meal_code, req, meal_structure
-            )
+        plans: List[List[ComboMeal]] = [[] for _ in range(batches)]
+        rankings: List[Dict[str, Dict[str, List[int]]]] = [{} for _ in range(batches)]
+        # 本次请求的打分共用一份解析结果和缓存（三餐都用）
+        with DishScoreContext.scope(req):
+            for meal_code in meals_to_build:
+                meal_range = cls._build_single_meal_range(daily_range, meal_code)
+                meal_structure = msg.calculate_meal_config(
+                    req.members, meal_code, req.province_code
+                )
+                skipped = cls._skipped_stages()
+                filtered_pool, ranked = cls._prepare_and_rank(filtered_dishes, meal_range, meal_code, req)
+                if ranked is None:
+                    dishes = cls._quick_pick(cls._group_dishes_by_structure(filtered_pool), meal_structure)
+                else:
+                    dishes = cls._select_from_ranked(filtered_pool, ranked, meal_code, req, meal_structure)
+                used = {d.dish_id for d in dishes}
+                plans[0].append(cls._finish_meal(meal_code, dishes, meal_range, meal_structure,
+                                                 scale_portions, skipped))
+                if batches == 1 or ranked is None:
+                    continue
+
+                marks = {id(d): (d.is_selected, d.meal_structure_type) for d in filtered_pool}
+                for b in range(1, batches):
+                    rest = {st: [d for d in ds if d.dish_id not in used] for st, ds in ranked.items()}
+                    rest_pool = [d for d in filtered_pool if d.dish_id not in used]
+                    rankings[b][meal_code] = {st: [d.dish_id for d in ds] for st, ds in rest.items()}
+                    dishes = cls._select_from_ranked(rest_pool, rest, meal_code, req, meal_structure)
+                    used.update(d.dish_id for d in dishes)
+                    dishes = cls._detach_selected(dishes, marks)
+                    plans[b].append(cls._finish_meal(meal_code, dishes, meal_range, meal_structure,
+                                                     scale_portions, skipped))
+        return plans, rankings
+
+    @classmethod
+    def _finish_meal(cls, meal_code: str, dishes: List[Dish], meal_range: Dict[str, Dict[str, float]],
+                     meal_structure: Dict[str, int], scale_portions: bool, skipped: int) -> ComboMeal:
+        """缩放份量并打包成一餐；skipped 是选这一餐之前已跳过的阶段数，用来判断这一餐是否降级"""
+        if scale_portions:
             cls._scale_portions(dishes, meal_range)  # 按餐次独立缩放
 
-            combo_meal = cls._build_combo_meal(meal_code, dishes)
-            need_nutrients = cls._build_need_nutrients(meal_range)
-            combo_meal.need_nutrients = need_nutrients
-            combo_meal.meal_structure = meal_structure
-            combo_meals.append(combo_meal)
-        return combo_meals
+        combo_meal = cls._build_combo_meal(meal_code, dishes)
+        need_nutrients = cls._build_need_nutrients(meal_range)
+        combo_meal.need_nutrients = need_nutrients
+        combo_meal.meal_structure = meal_structure
+        combo_meal.degraded = cls._skipped_stages() > skipped
+        return combo_meal
+
+    # -------------------------------------------------
+    # 多日（周）方案
+    # -------------------------------------------------
+    week_budget_ms = 1500       # generate_week 默认的耗时预算（7 天 21 餐），请求没带 deadline_ms 时使用
+    week_carry_limit = 0.3      # 每天结转的营养差额不超过基础需求的这个比例
+
+    @classmethod
+    def generate_week(cls, req: MealRequest, days: int = 7, scale_portions: bool = True) -> List[List[ComboMeal]]:
+        """
+        连续 days 天的方案，返回 [第1天的餐列表, 第2天..., ...]，每天的餐次同 generate_per_meal。
+        与缓存、并发合并走同一条路径（entry 带天数和是否缩放份量，两种方案不能共用缓存）。
+        耗时预算：请求的 deadline_ms，没带时用 week_budget_ms，走与单日相同的 deadline_scope —
+        预算用完后剩下的餐跳过排名等阶段快速凑齐（ComboMeal.degraded），降级的结果不缓存
+        """
+        if req.deadline_ms is None:
+            req = dataclasses.replace(req, deadline_ms=cls.week_budget_ms)
+
+        def generate(req, daily_range, allergen_codes, scale_portions):
+            return cls._generate_week(req, daily_range, allergen_codes, scale_portions, days)
+
+        return cls._generate_shared(f"generate_week:{days}:{int(scale_portions)}", req, scale_portions, generate=generate)
+
+    @classmethod
+    def _generate_week(cls, req: MealRequest, daily_range: Dict[str, Dict[str, float]],
+                       allergen_codes: List[str], scale_portions: bool, days: int) -> List[List[ComboMeal]]:
+        """
+        - 菜品池、家庭需求、餐次结构、打分上下文全周只准备一次
+        - 本周选过的菜不再选；前一天用过的主料当天不再用（候选不够一餐时放开这两条限制）
+        - 每天实际供给与当天目标的差额（不足或超出）结转到第二天的 meal_range，
+          单个营养素的结转量限制在基础需求的 week_carry_limit 以内
+        """
+        start = time.perf_counter()
+        pool = cls.load_request_dishes(req, allergen_codes)
+        random.Random(req.refresh_key).shuffle(pool)
+        meals_to_build = ["breakfast", "lunch", "dinner"] if req.meal_type == "all" else [req.meal_type]
+        msg = MealStructureGenerator()
+        structures = {m: msg.calculate_meal_config(req.members, m, req.province_code) for m in meals_to_build}
+
+        used_dish_ids: Set[int] = set()
+        yesterday_main_foods: Set[int] = set()
+        day_range = daily_range
+        week: List[List[ComboMeal]] = []
+        with DishScoreContext.scope(req):
+            for _ in range(days):
+                today_main_foods: Set[int] = set()
+                combo_meals: List[ComboMeal] = []
+                for meal_code in meals_to_build:
+                    meal_range = cls._build_single_meal_range(day_range, meal_code)
+                    meal_structure = structures[meal_code]
+                    candidates = cls._week_candidates(pool, used_dish_ids, yesterday_main_foods,
+                                                      sum(meal_structure.values()))
+                    skipped = cls._skipped_stages()
+                    dishes = cls._detach_selected(
+                        cls._select_dishes_for_meal(candidates, meal_range, meal_code, req, meal_structure)
+                    )
+                    combo_meals.append(cls._finish_meal(meal_code, dishes, meal_range, meal_structure,
+                                                        scale_portions, skipped))
+                    for d in dishes:
+                        if d.is_selected != 0:  # 备选菜不算用过
+                            used_dish_ids.add(d.dish_id)
+                            if d.main_food_id is not None:
+                                today_main_foods.add(d.main_food_id)
+                week.append(combo_meals)
+                yesterday_main_foods = today_main_foods
+                day_range = cls._carry_forward(daily_range, day_range, combo_meals)
+
+        deadline = current_deadline()
+        if deadline is not None and deadline.skipped:
+            logger.warning("generate_week degraded after %.0fms (budget %sms, %d days, %d dishes in pool), "
+                           "skipped %d stages", (time.perf_counter() - start) * 1000, deadline.budget_ms,
+                           days, len(pool), len(deadline.skipped))
+        return week
+
+    @classmethod
+    def _week_candidates(cls, pool: List[Dish], used_dish_ids: Set[int], avoid_main_foods: Set[int],
+                         need: int) -> List[Dish]:
+        """优先排除本周用过的菜和前一天的主料，剩下的不够一餐的两倍时逐步放开"""
+        fresh = [d for d in pool if d.dish_id not in used_dish_ids]
+        varied = [d for d in fresh if d.main_food_id is None or d.main_food_id not in avoid_main_foods]
+        for candidates in (varied, fresh, pool):
+            if len(candidates) >= need * 2:
+                break
+        return candidates
+
+    @staticmethod
+    def _detach_selected(dishes: List[Dish], marks: Optional[Dict[int, tuple]] = None) -> List[Dish]:
+        """
+        一餐选出的菜换成副本（后面缩放份量改的是副本），池里的原对象清掉选菜标记
+        （marks 给出 id(菜) -> (is_selected, meal_structure_type) 时恢复成选菜前的样子），
+        多餐共用一个菜品池，不用每餐复制整池
+        """
+        detached = [DishCatalog.checkout(d) for d in dishes]
+        for d in dishes:
+            d.is_selected, d.meal_structure_type = (marks or {}).get(id(d), (None, None))
+        return detached
+
+    @classmethod
+    def _carry_forward(cls, base: Dict[str, Dict[str, float]], today: Dict[str, Dict[str, float]],
+                       combo_meals: List[ComboMeal]) -> Dict[str, Dict[str, float]]:
+        """
+        第二天的每日需求 = 基础需求 + 当天差额（当天目标 - 当天实际供给），
+        差额限制在 ±week_carry_limit × 基础需求；min / max 同步平移，min 不小于 0
+        """
+        supplied = defaultdict(float)
+        for meal in combo_meals:
+            for code, value in meal.nutrients.items():
+                supplied[code] += value
+
+        next_range = {}
+        for code, v in base.items():
+            limit = v["need"] * cls.week_carry_limit
+            offset = max(-limit, min(limit, today[code]["need"] - supplied.get(code, 0.0)))
+            next_range[code] = {"min": max(0.0, v["min"] + offset), "max": v["max"] + offset,
+                                "need": max(0.0, v["need"] + offset)}
+        return next_range
+
+    @classmethod
+    def load_request_dishes(cls, req: MealRequest, allergen_codes: Optional[List[str]] = None) -> List[Dish]:
+        """
+        从进程内菜品快照（DishCatalog）取本次请求可用的菜：
+        餐次、烹饪时间、菜系过滤是标签位图的交集（与 filter_dishes 等价），
+        家庭过敏原每次请求只查一次（调用方已查过时直接传入），折成掩码后对整个目录做一次 AND 判断；
+        最后只复制留下来的菜
+        """
+        snapshot = DishCatalog.get()
+        if allergen_codes is None:
+            allergen_codes = DishComboData.get_family_allergens(req.member_ids or [])
+        family_mask = snapshot.allergens.family_mask(allergen_codes)
+        safe = snapshot.allergens.safe(family_mask)
+        return [DishCatalog.checkout(snapshot.dishes[i])
+                for i in snapshot.tag_index.request_positions(req) if safe[i]]
 
     @classmethod
     def _build_need_nutrients(cls, meal_range: Dict[str, Dict[str, float]]) -> Dict[str, float]:
@@ -176,25 +401,45 @@ class MealGeneratorV2:
             meal_structure: Dict[str, int]
     ) -> List[Dish]:
         """为单餐选择菜品（主要菜品 + 备选菜品）"""
+        # 请求带 deadline_ms 时每个阶段前查一次，超时就用已有结果凑出完整的一餐，跳过后面的阶段
+        filtered_pool, meal_structure_dished = cls._prepare_and_rank(dish_list, meal_range, meal_code, req)
+        if meal_structure_dished is None:
+            return cls._quick_pick(cls._group_dishes_by_structure(filtered_pool), meal_structure)
+        return cls._select_from_ranked(filtered_pool, meal_structure_dished, meal_code, req, meal_structure)
 
+    @classmethod
+    def _prepare_and_rank(cls, dish_list: List[Dish], meal_range: Dict[str, Dict[str, float]],
+                          meal_code: str, req: MealRequest):
+        """1. 准备菜品池并按结构分桶排名；超时跳过排名时桶为 None"""
+        filtered_pool = cls._prepare_dish_pool(dish_list, meal_code, req)
+        if cls._out_of_time("ranking"):
+            return filtered_pool, None
+        return filtered_pool, cls._structure_and_rank_dishes(filtered_pool, req, meal_range)
+
+    @classmethod
+    def _select_from_ranked(cls, filtered_pool: List[Dish], meal_structure_dished: Dict[str, List[Dish]],
+                            meal_code: str, req: MealRequest, meal_structure: Dict[str, int]) -> List[Dish]:
+        """2~4. 在排好名的分桶里选主要菜品、备选菜品并补足数量"""
         # 配置参数
         config = cls._get_selection_config()
 
-        # 1. 准备菜品池
-        filtered_pool = cls._prepare_dish_pool(dish_list, meal_code, req)
-        meal_structure_dished = cls._structure_and_rank_dishes(filtered_pool, req, meal_range)
-
         # 2. 选择主要菜品
+        if cls._out_of_time("recommend"):
+            return cls._quick_pick(meal_structure_dished, meal_structure)
         selected_dishes = cls._select_recommend_dishes(
             meal_structure_dished, meal_structure, req, config
         )
 
         # 3. 选择备选菜品
+        if cls._out_of_time("alternatives"):
+            return selected_dishes
         alternative_dishes = cls._select_alternative_dishes(
             meal_structure_dished, selected_dishes, meal_structure, config
         )
 
         # 4. 补充不足的菜品（使用增强版的补充方法）
+        if cls._out_of_time("supplement"):
+            return selected_dishes + alternative_dishes
         final_dishes = cls._supplement_with_category_balance(
             selected_dishes, alternative_dishes, filtered_pool,
             meal_structure, req, meal_code
@@ -202,6 +447,41 @@ class MealGeneratorV2:
 
         return final_dishes + alternative_dishes
 
+    @staticmethod
+    def _out_of_time(stage: str) -> bool:
+        """当前作用域的耗时预算已用完时记下跳过的阶段并返回 True；没有预算时总是 False"""
+        deadline = current_deadline()
+        if deadline is None or not deadline.expired:
+            return False
+        deadline.skip(stage)
+        return True
+
+    @staticmethod
+    def _skipped_stages() -> int:
+        deadline = current_deadline()
+        return len(deadline.skipped) if deadline is not None else 0
+
+    @classmethod
+    def _quick_pick(cls, meal_structure_dished: Dict[str, List[Dish]], meal_structure: Dict[str, int]) -> List[Dish]:
+        """
+        超时时的保底选菜：各结构按现有顺序（排过名就是名次，否则是洗牌后的顺序）
+        取够数量，只做主料去重，不再打分
+        """
+        selected: List[Dish] = []
+        used_main_foods: Set[int] = set()
+        for structure_type in ('staple', 'main_dish', 'baby_food', 'side_dish', 'soup'):
+            target_count = meal_structure.get(structure_type, 0)
+            picked = 0
+            for dish in meal_structure_dished.get(structure_type, []):
+                if picked >= target_count:
+                    break
+                if cls._dedup_increase_weight(dish, used_main_foods):
+                    dish.meal_structure_type = {structure_type: "selected"}
+                    dish.is_selected = 1
+                    selected.append(dish)
+                    picked += 1
+        return selected
+
     @classmethod
     def _supplement_with_category_balance(cls, selected_dishes: List[Dish],
                                           alternative_dishes: List[Dish],
@@ -234,6 +514,7 @@ class MealGeneratorV2:
 
         # 优先补充缺乏的类别
         supplemented_dishes = selected_dishes.copy()
+        used_main_foods = cls._used_main_foods(supplemented_dishes)
 
         for category, deficiency in deficient_categories:
             if len(supplemented_dishes) >= total_target:
@@ -253,7 +534,7 @@ class MealGeneratorV2:
                 if len(supplemented_dishes) >= total_target:
                     break
 
-                selected_dish = cls._dedup_increase_weight(dish, supplemented_dishes)
+                selected_dish = cls._dedup_increase_weight(dish, used_main_foods)
                 if selected_dish:
                     supplemented_dishes.append(selected_dish)
                     break
@@ -270,7 +551,7 @@ class MealGeneratorV2:
             )
 
             for dish in remaining_dishes[:remaining_slots]:
-                selected_dish = cls._dedup_increase_weight(dish, supplemented_dishes)
+                selected_dish = cls._dedup_increase_weight(dish, used_main_foods)
                 if selected_dish:
                     supplemented_dishes.append(selected_dish)
 
@@ -368,29 +649,16 @@ class MealGeneratorV2:
 
     @classmethod
     def _prepare_dish_pool(cls, dish_list: List[Dish], meal_code: str, req: MealRequest) -> List[Dish]:
-        """准备过滤后的菜品池"""
-        # 过敏原过滤
-        allergens = set(DishComboData.get_family_allergens(req.member_ids))
-
-        filtered_dishes = [
-            d for d in dish_list
-            if ("all" == meal_code or meal_code in cls.tag_pick(d, 'meal_time', 'code'))
-            # and (not req.cook_time_limit or d.cook_time <= req.cook_time_limit)
-            # and not allergens.intersection(set(d.allergens))
-        ]
-
-        # 新增：输出want_eat匹配信息（用于调试）
-        if hasattr(req, 'want_eat') and req.want_eat:
-            matched_dishes = []
-            for dish in filtered_dishes:
-                score = cls._calculate_want_eat_score(dish, req.want_eat)
-                if score > 0:
-                    matched_dishes.append((dish.name, score))
-
-            if matched_dishes:
-                print(f"🎯 want_eat匹配结果: {req.want_eat}")
-                for dish_name, score in matched_dishes[:5]:  # 只显示前5个
-                    print(f"   - {dish_name}: +{score}分")
+        """准备过滤后的菜品池（过敏原已在 load_request_dishes 按家庭掩码过滤）"""
+        # 餐次过滤：目录菜查 meal_time 位图
+        if "all" == meal_code:
+            filtered_dishes = list(dish_list)
+        else:
+            snapshot = DishCatalog.get()
+            filtered_dishes = snapshot.select(
+                dish_list, snapshot.tag_index.tag('meal_time', meal_code),
+                lambda d: meal_code in cls.tag_pick(d, 'meal_time', 'code')
+            )
 
         return filtered_dishes
 
@@ -413,13 +681,14 @@ class MealGeneratorV2:
         if not dishes:
             return []
 
-        # 使用类别相关的随机种子确保刷新变化
-        category_rng = random.Random(req.refresh_key + hash(dishes[0].name if dishes else 0))
+        # 使用类别相关的随机种子确保刷新变化（crc32 跨进程稳定，内置 hash 对字符串每个进程都不同）
+        category_rng = random.Random(req.refresh_key + zlib.crc32((dishes[0].name or "").encode("utf-8")))
 
-        # 计算每个菜品的分数
+        # 计算每个菜品的分数：营养补充加分在 菜品×营养素 矩阵上一次算完
+        bonuses = DishCatalog.get().matrix.nutrient_bonus(dishes, nutrient_range)
         scored_dishes = []
-        for dish in dishes:
-            score = cls._calculate_dish_score(dish, req, nutrient_range)
+        for dish, bonus in zip(dishes, bonuses):
+            score = cls._calculate_dish_score(dish, req, nutrient_range, nutrient_bonus=int(bonus))
             scored_dishes.append((dish, score))
 
         # 按分数降序排序
@@ -489,6 +758,7 @@ class MealGeneratorV2:
         """从指定类别中选择菜品（增加want_eat计数）"""
         selected = []
         existing_dish_ids = set(d.dish_id for d in existing_dishes)
+        used_main_foods = cls._used_main_foods(existing_dishes)
 
         # 分析当前类别分布
         current_distribution = cls._analyze_food_category_distribution(existing_dishes)
@@ -499,7 +769,7 @@ class MealGeneratorV2:
         current_want_eat_count = 0
         if hasattr(req, 'want_eat') and req.want_eat:
             for dish in existing_dishes:
-                want_score = cls._calculate_want_eat_score(dish, req.want_eat, 0)  # 用0避免递归
+                want_score = DishScoreContext.current(req).want_eat_score(dish)
                 if want_score > 0:
                     current_want_eat_count += 1
 
@@ -530,7 +800,7 @@ class MealGeneratorV2:
             if len(selected) >= target_count:
                 break
 
-            selected_dish = cls._dedup_increase_weight(dish, existing_dishes + selected)
+            selected_dish = cls._dedup_increase_weight(dish, used_main_foods)
             if selected_dish:
                 selected_dish.meal_structure_type = {structure_type: "selected"}
                 selected_dish.is_selected = 1
@@ -610,11 +880,12 @@ class MealGeneratorV2:
 
         # 补充菜品
         supplemented_dishes = selected_dishes.copy()
+        used_main_foods = cls._used_main_foods(supplemented_dishes)
         for dish in supplement_pool:
             if len(supplemented_dishes) >= total_target:
                 break
 
-            selected_dish = cls._dedup_increase_weight(dish, supplemented_dishes)
+            selected_dish = cls._dedup_increase_weight(dish, used_main_foods)
             if selected_dish:
                 selected_dish.meal_structure = {"supplement": "selected"}
                 supplemented_dishes.append(selected_dish)
@@ -623,89 +894,15 @@ class MealGeneratorV2:
 
     @classmethod
     def _calculate_dish_score(cls, dish: Dish, req: MealRequest, nutrient_range: Dict,
-                              current_want_eat_count: int = 0) -> int:
-        """计算菜品分数（增加want_eat数量控制）"""
-        base_score = len(dish.need_tags)
-
-        # 1. 标签匹配度
-        if hasattr(req, 'need_tags') and req.need_tags:
-            req_tags = req.need_tags
-            if isinstance(req_tags, str):
-                req_tags = req_tags.split(",")
-
-            matched_tags = set(req_tags) & set(dish.need_tags)
-            match_score = len(matched_tags) * 2
-            base_score += match_score
-
-        # 2. want_eat匹配加分（新增数量控制）
-        if hasattr(req, 'want_eat') and req.want_eat:
-            want_eat_score = cls._calculate_want_eat_score(dish, req.want_eat, current_want_eat_count)
-            base_score += want_eat_score
-
-        # 3. 营养补充加分
-        nutrient_bonus = cls._calculate_nutrient_bonus(dish, nutrient_range)
-        return base_score + nutrient_bonus
-
-    @classmethod
-    def _calculate_want_eat_score(cls, dish: Dish, want_eat: str, current_want_eat_count: int) -> int:
+                              current_want_eat_count: int = 0, nutrient_bonus: int = None) -> int:
         """
-        计算want_eat匹配分数（增加数量控制）
-        规则：
-        - 如果当前已选的want_eat菜品少于2个：正常加分
-        - 如果已选超过2个：大幅降低加分，避免过度集中
+        计算菜品分数（增加want_eat数量控制）；nutrient_bonus 可传入批量算好的营养加分
+        1. 需求标签数 + 标签匹配度、2. want_eat 匹配加分：由请求的 DishScoreContext 解析并按菜缓存
+        3. 营养补充加分：随剩余需求变化，每次现算
         """
-        if not want_eat:
-            return 0
-
-        # 解析want_eat
-        want_items = []
-        for item in want_eat.replace('，', ',').split(','):
-            item = item.strip()
-            if item:
-                want_items.append(item)
-
-        if not want_items:
-            return 0
-
-        # 🎯 关键修改：控制want_eat菜品数量
-        if current_want_eat_count >= 1:
-            # 已经选了2个want_eat菜品，大幅降低后续加分
-            base_multiplier = 0.2
-        else:
-            # 还可以继续选want_eat菜品，正常加分
-            base_multiplier = 1.0
-
-        total_score = 0
-        dish_name = dish.name.lower() if dish.name else ""
-
-        for want_item in want_items:
-            want_lower = want_item.lower()
-
-            # 菜品名称完全匹配
-            if dish_name == want_lower:
-                total_score += int(20 * base_multiplier)
-            # 菜品名称包含
-            elif want_lower in dish_name:
-                total_score += int(10 * base_multiplier)
-
-        # 食材匹配（权重低于菜品名称匹配）
-        if hasattr(dish, 'foods') and dish.foods:
-            for food in dish.foods:
-                food_name = getattr(food, 'foodName', '').lower() if getattr(food, 'foodName') else ""
-                if not food_name:
-                    continue
-
-                for want_item in want_items:
-                    want_lower = want_item.lower()
-
-                    # 食材名称完全匹配
-                    if food_name == want_lower:
-                        total_score += int(8 * base_multiplier)  # 降低食材匹配分数
-                    # 食材名称包含
-                    elif want_lower in food_name:
-                        total_score += int(4 * base_multiplier)  # 降低食材匹配分数
-
-        return total_score
+        if nutrient_bonus is None:
+            nutrient_bonus = cls._calculate_nutrient_bonus(dish, nutrient_range)
+        return DishScoreContext.current(req).score(dish, nutrient_bonus, current_want_eat_count)
 
     @classmethod
     def _calculate_nutrient_bonus(cls, dish: Dish, meal_range: Dict[str, Dict[str, float]]) -> int:
@@ -737,116 +934,43 @@ class MealGeneratorV2:
                 if "need" in remaining[nutrient]:
                     remaining[nutrient]["need"] = max(0, remaining[nutrient]["need"] - value)
 
-    # 修改  方法，使其更智能
+    # 份量调整方式：heuristic 整餐统一缩放；solver 逐道菜求解份量倍数（PortionSolver）
+    portion_mode = os.environ.get("EJIACAN_PORTION_MODE", "heuristic")
+
     @classmethod
     def _scale_portions(cls, dishes: List[Dish], meal_range: Dict[str, Dict[str, float]]):
-        """智能调整份量 - 考虑营养优先级"""
+        """智能调整份量 - 考虑营养优先级（规则见 NutrientMatrix.portion_scale）"""
         if not dishes:
             return
 
-        # 1. 计算当前总营养
-        total_nutrients = defaultdict(float)
-        for d in dishes:
-            for nutrient, value in d.nutrients.items():
-                total_nutrients[nutrient] += value
-
-        # 3. 分析营养状况
-        nutrition_status = {}
-        for nutrient, values in meal_range.items():
-            current = total_nutrients.get(nutrient, 0)
-            min_need = values.get("min", 0)
-            max_need = values.get("max", 0)
-            need = values.get("need", 0)
-
-            priority = nutrient_priority.get(nutrient, 1)
-
-            nutrition_status[nutrient] = {
-                'current': current,
-                'min_need': min_need,
-                'max_need': max_need,
-                'need': need,
-                'priority': priority,
-                'deficit_ratio': (min_need - current) / min_need if min_need > 0 else 0,
-                'excess_ratio': (current - max_need) / max_need if max_need > 0 else 0
-            }
-
-        # 4. 分层调整策略
-        final_scale = cls._calculate_optimal_scale(nutrition_status, dishes)
-
-        # 5. 应用调整
+        final_scale = DishCatalog.get().matrix.portion_scale(dishes, meal_range)
+        if (cls.portion_mode == "solver" and not cls._out_of_time("portion_solver")
+                and cls._solve_portions(dishes, meal_range, final_scale)):
+            return
+        logger.debug("portion scale %.2f (%d dishes)", final_scale, len(dishes))
         if final_scale != 1.0:
             cls._apply_portion_scale(dishes, final_scale)
 
     @classmethod
-    def _calculate_optimal_scale(cls, nutrition_status: Dict, dishes: List[Dish]) -> float:
-        """计算最优缩放比例 - 考虑营养优先级"""
-
-        # 策略1：检查关键营养素严重不足
-        critical_nutrients = ['protein', 'calories']
-        for nutrient in critical_nutrients:
-            if nutrient in nutrition_status:
-                status = nutrition_status[nutrient]
-                if status['current'] < status['min_need'] * 0.8:  # 严重不足
-                    # 需要放大，但限制最大倍数
-                    required_scale = min(1.5, status['min_need'] / max(status['current'], 1e-6))
-                    print(f"⚠️ {nutrient}严重不足，需要放大: {required_scale:.2f}倍")
-                    return required_scale
-
-        # 策略2：处理超标营养素（考虑优先级）
-        shrink_factors = []
-        for nutrient, status in nutrition_status.items():
-            if status['current'] > status['max_need']:
-                # 高优先级营养素超标 - 轻微缩小
-                if status['priority'] >= 8:
-                    shrink_factor = 0.9  # 轻微调整
-                # 低优先级营养素超标 - 正常缩小
-                else:
-                    shrink_factor = status['max_need'] / status['current']
-                shrink_factors.append(shrink_factor)
-                print(f"📉 {nutrient}超标，建议缩小: {shrink_factor:.2f}倍")
-
-        # 策略3：处理不足营养素（考虑优先级）
-        expand_factors = []
-        for nutrient, status in nutrition_status.items():
-            if status['current'] < status['min_need']:
-                # 高优先级营养素不足 - 优先满足
-                if status['priority'] >= 8:
-                    expand_factor = min(1.3, status['min_need'] / max(status['current'], 1e-6))
-                    expand_factors.append(expand_factor)
-                    print(f"📈 {nutrient}不足，建议放大: {expand_factor:.2f}倍")
-
-        # 策略4：平衡决策
-        if shrink_factors:
-            # 有超标情况，优先处理（取最严重的）
-            final_scale = min(shrink_factors)
-
-            # 但如果有关键营养素严重不足，需要权衡
-            critical_deficit = any(
-                status['priority'] >= 8 and status['current'] < status['min_need'] * 0.9
-                for nutrient, status in nutrition_status.items()
-            )
-
-            if critical_deficit and final_scale < 0.8:
-                # 不能缩太小，否则关键营养素更不足
-                final_scale = max(0.8, final_scale)
-                print(f"⚖️ 权衡：关键营养素不足，限制最小缩放为: {final_scale:.2f}")
-
-        elif expand_factors:
-            # 只有不足情况，适度放大
-            final_scale = min(expand_factors)  # 取最保守的放大
-        else:
-            # 营养均衡，不需要调整
-            final_scale = 1.0
-
-        # 限制调整范围
-        final_scale = max(0.5, min(2.0, final_scale))
-
-        if final_scale != 1.0:
-            print(f"🎯 最终调整比例: {final_scale:.2f}倍")
-        else:
-            print("✅ 营养均衡，无需调整")
-
-        return final_scale
+    def _solve_portions(cls, dishes: List[Dish], meal_range: Dict[str, Dict[str, float]], warm_scale: float) -> bool:
+        """
+        主要菜品逐道求份量倍数（以整餐统一缩放为起始解），备选菜仍按统一缩放；
+        没有主要菜品时返回 False，由调用方走统一缩放
+        """
+        selected = [d for d in dishes if getattr(d, 'is_selected', 0) == 1]
+        if not selected:
+            return False
+        matrix = DishCatalog.get().matrix
+        values, _ = matrix.take(selected)
+        multipliers = PortionSolver.solve(values, matrix.codes, meal_range, warm_start=warm_scale)
+        for dish, scale in zip(selected, multipliers):
+            scale = round(float(scale), 2)
+            if scale != 1.0:
+                cls._apply_portion_scale([dish], scale)
+        others = [d for d in dishes if getattr(d, 'is_selected', 0) != 1]
+        if others and warm_scale != 1.0:
+            cls._apply_portion_scale(others, warm_scale)
+        return True
 
     @classmethod
     def _apply_portion_scale(cls, dishes: List[Dish], scale: float):
@@ -878,14 +1002,10 @@ class MealGeneratorV2:
 
     @classmethod
     def _group_dishes_by_structure(cls, dish_list: List[Dish]) -> Dict[str, List[Dish]]:
-        """根据餐次结构对菜品进行分类"""
-
-        for dish in dish_list:
-            structure_type = cls._classify_dish_structure_type(dish)
-            if structure_type in structure_def:
-                structure_def[structure_type].append(dish)
-
-        return structure_def
+        """根据餐次结构对菜品进行分类（structure_def 只提供类型，分桶结果每次新建）"""
+        # 目录菜的结构类型在加载快照时已算好
+        return DishCatalog.get().group_by_structure(dish_list, structure_def.keys(),
+                                                    cls._classify_dish_structure_type)
 
     @classmethod
     def _classify_dish_structure_type(cls, dish: Dish) -> str:
@@ -956,6 +1076,94 @@ class MealGeneratorV2:
         # 如果以上都无法判断，保守地分类为配菜
         return 'side_dish'
 
+    # -------------------------------------------------
+    # 换一道菜（在已生成的一餐上局部修改）
+    # -------------------------------------------------
+    @classmethod
+    def swap_dish(cls, combo: ComboMeal, dish_id: int, req: MealRequest) -> Optional[ComboMeal]:
+        """
+        把一餐里的一道主要菜品换成同结构类型的下一道：
+        - 候选来自这一餐的排名结果（按请求指纹存在 PlanCache，第一次换菜时算一次）
+        - 跳过本餐已选的菜、被换掉的菜，以及与其余已选菜主料重复的菜；备选菜可被换上来
+        - 新菜沿用被换菜的份量缩放比例；nutrients / food_category_distribution / 总烹饪时间只做增量修改
+        返回修改后的新 ComboMeal（入参不变）；没有可换的菜时返回 None
+        """
+        pos = next((i for i, d in enumerate(combo.dishes)
+                    if d.dish_id == dish_id and getattr(d, 'is_selected', 0) == 1), None)
+        if pos is None:
+            raise ValueError(f"dish {dish_id} is not a selected dish of this meal")
+        old = combo.dishes[pos]
+        structure_type = next(iter(old.meal_structure_type or {}), None) or cls._classify_dish_structure_type(old)
+
+        snapshot = DishCatalog.get()
+        ranked = cls._ranked_meal_pool(req, combo.meal_type).get(structure_type, [])
+        selected = [d for d in combo.dishes if getattr(d, 'is_selected', 0) == 1 and d is not old]
+        taken = {d.dish_id for d in selected} | {dish_id}
+        used_main_foods = cls._used_main_foods(selected)
+        candidates = [snapshot.dishes[snapshot.tag_index.position[i]] for i in ranked
+                      if i not in taken and i in snapshot.tag_index.position]
+        if not candidates:
+            return None
+        # 主料都重复时退而取排名第一的
+        replacement = next((d for d in candidates
+                            if d.main_food_id is None or d.main_food_id not in used_main_foods), candidates[0])
+
+        new = DishCatalog.checkout(replacement)
+        original = snapshot.tag_index.position.get(dish_id)
+        if original is not None and snapshot.dishes[original].exact_portion.grams:
+            scale = old.exact_portion.grams / snapshot.dishes[original].exact_portion.grams
+            if abs(scale - 1.0) > 1e-6:
+                cls._apply_portion_scale([new], scale)
+        new.meal_structure_type = {structure_type: "selected"}
+        new.is_selected = 1
+
+        # 换上来的如果是本餐的备选菜，备选里去掉它（总烹饪时间原本就算了备选菜）
+        promoted = any(d.dish_id == new.dish_id for d in combo.dishes)
+        dishes = [new if d is old else d for d in combo.dishes if d.dish_id != new.dish_id]
+        nutrients = dict(combo.nutrients)
+        for code, value in old.nutrients.items():
+            nutrients[code] = nutrients.get(code, 0.0) - value
+        for code, value in new.nutrients.items():
+            nutrients[code] = nutrients.get(code, 0.0) + value
+        distribution = dict(combo.food_category_distribution)
+        old_category = cls._map_food_to_category(snapshot.dishes[original] if original is not None else old)
+        if distribution.get(old_category, 0) > 1:
+            distribution[old_category] -= 1
+        else:
+            distribution.pop(old_category, None)
+        new_category = cls._map_food_to_category(new)
+        distribution[new_category] = distribution.get(new_category, 0) + 1
+        return dataclasses.replace(combo, dishes=dishes, nutrients=nutrients,
+                                   food_category_distribution=distribution,
+                                   total_cook_time=combo.total_cook_time - old.cook_time
+                                   + (0 if promoted else new.cook_time))
+
+    @classmethod
+    def _ranked_meal_pool(cls, req: MealRequest, meal_code: str) -> Dict[str, List[int]]:
+        """
+        一餐的排名结果 {结构类型: [dish_id, ...]}，与生成时同样的过滤、洗牌和打分；
+        按 目录水位 + 请求 + 家庭需求 + 过敏原 存在 PlanCache，同一餐连续换菜不重复排名
+        """
+        daily_range = CommonNutrientCalculator.get_daily_range(req.members)
+        allergen_codes = DishComboData.get_family_allergens(req.member_ids or [])
+        watermark = DishCatalog.get().watermark
+        key = PlanCache.fingerprint(f"ranked:{meal_code}", req, watermark, daily_range, allergen_codes)
+        if watermark is not None:
+            cached = PlanCache.get(key)
+            if cached is not None:
+                return cached
+
+        pool = cls.load_request_dishes(req, allergen_codes)
+        random.Random(req.refresh_key).shuffle(pool)
+        meal_range = cls._build_single_meal_range(daily_range, meal_code)
+        with DishScoreContext.scope(req):
+            filtered_pool = cls._prepare_dish_pool(pool, meal_code, req)
+            ranked = cls._structure_and_rank_dishes(filtered_pool, req, meal_range)
+        ranked_ids = {structure_type: [d.dish_id for d in dishes] for structure_type, dishes in ranked.items()}
+        if watermark is not None:
+            PlanCache.put(key, ranked_ids)
+        return ranked_ids
+
     # -------------------------------------------------
     # 打包单餐
     # -------------------------------------------------
@@ -994,13 +1202,20 @@ class MealGeneratorV2:
     from ejiacanAI.dish2_combo_models import Dish, ExactPortion, DishFoodNutrient
 
     @classmethod
-    def build_true_dishes(cls, wide_rows: List[DishFoodNutrient], req: MealRequest) -> List[Dish]:
-        dish_map = cls._group_by_dish_and_food(wide_rows)
+    def build_true_dishes(cls, wide_rows: Iterable[DishFoodNutrient], req: MealRequest) -> List[Dish]:
+        """
+        wide_rows 可以是列表也可以是流式迭代器，但必须按 dish_id 有序
+        （视图查询都带 ORDER BY dish_id, food_id）；每凑齐一道菜的行就立即组装，
+        内存里只保留当前这道菜的原始行。
+        """
         dishes: List[Dish] = []
+        composition = []  # (dish_id, food_id, grams)，营养素最后一次矩阵乘法算出
+        food_cache: Dict[int, Dict] = {}
 
-        for dish_id, food_map in dish_map.items():
+        for dish_id, food_map in cls._iter_dish_food_groups(wide_rows):
             meta = cls._get_meta(food_map)
-            ingredients, nutrients, allergens, foods = cls._aggregate_foods(food_map)
+            ingredients, allergens, foods = cls._aggregate_foods(food_map, food_cache)
+            composition.extend((dish_id, f.food_id, f.food_amount_grams) for f in foods)
             dish_tags = cls._build_dish_tags(meta.tags_json)
 
             # 🎯 新增：计算菜品包含的所有食物类别
@@ -1017,17 +1232,30 @@ class MealGeneratorV2:
                 need_tags=meta.need_tags.split(",") if meta.need_tags else [],
 
                 ingredients=ingredients,
-                nutrients=nutrients,
+                nutrients={},
                 exact_portion=ExactPortion(size="M", grams=meta.dish_default_portion_g),
                 allergens=list(allergens),
                 foods=foods,
                 food_categories=food_categories,  # 🎯 设置所有类别
+                main_food_id=cls._main_food_id(foods),
 
                 dish_tags=dish_tags,
             ))
+
+        if dishes:
+            nutrients = NutrientKernel.dish_nutrients(NutrientKernel.composition(composition))
+            for dish in dishes:
+                dish.nutrients = nutrients.get(dish.dish_id, {})
         return dishes
 
     # ------------------ 下面全是小工具 ------------------
+    @staticmethod
+    def _main_food_id(foods: List[Food]) -> Optional[int]:
+        """主料：用量最大的食材（并列取先出现的），没有食材时为 None"""
+        if not foods:
+            return None
+        return max(foods, key=lambda f: float(f.food_amount_grams or 0)).food_id
+
     @classmethod
     def _get_dish_food_categories(cls, foods: List[Food]) -> List[str]:
         """
@@ -1051,67 +1279,42 @@ class MealGeneratorV2:
         return list(categories)
 
     @staticmethod
-    def _group_by_dish_and_food(wide_rows):
-        d = defaultdict(lambda: defaultdict(list))
-        for r in wide_rows:
-            d[r.dish_id][r.food_id].append(r)
-        return d
+    def _iter_dish_food_groups(wide_rows):
+        """按连续的 dish_id 切组，逐道菜产出 (dish_id, {food_id: [rows]})"""
+        for dish_id, rows in groupby(wide_rows, key=lambda r: r.dish_id):
+            food_map = defaultdict(list)
+            for r in rows:
+                food_map[r.food_id].append(r)
+            yield dish_id, food_map
 
     @staticmethod
     def _get_meta(food_map):
         return next(iter(food_map.values()))[0]
 
     @classmethod
-    def _aggregate_foods(cls, food_map):
+    def _aggregate_foods(cls, food_map, food_cache: Optional[Dict[int, Dict]] = None):
+        """
+        食材列表、过敏原、Food 对象；营养素由 NutrientKernel 批量计算
+        food_cache：同一次组装内 food_id -> 共用字段，同一食材在各道菜里共用字符串和数值对象
+        """
         ingredients: List[Dict[str, str]] = []
-        nutrients: Dict[str, float] = defaultdict(float)
         allergens: set[str] = set()
         foods: List[Food] = []  # 新增：存储Food对象列表
+        if food_cache is None:
+            food_cache = {}
 
         for food_id, rows in food_map.items():
             first = rows[0]
 
-            # 创建Food对象
+            # 创建Food对象：只有用量和是否主料是这道菜自己的
+            shared = food_cache.get(first.food_id)
+            if shared is None:
+                shared = food_cache[first.food_id] = cls._food_shared_fields(first)
             food = Food(
                 food_id=first.food_id,
                 food_amount_grams=first.food_amount_grams,
-                foodCode=first.foodCode,
-                foodName=first.foodName,
-                category1=first.category1,
-                category2=first.category2,
-                is_main_food=first.is_main_food,
-                edible=first.edible,
-                water=first.water,
-                energyKCal=first.energyKCal,
-                energyKJ=first.energyKJ,
-                protein=first.protein,
-                fat=first.fat,
-                CHO=first.CHO,
-                dietaryFiber=first.dietaryFiber,
-                cholesterol=first.cholesterol,
-                ash=first.ash,
-                vitaminA=first.vitaminA,
-                carotene=first.carotene,
-                retinol=first.retinol,
-                thiamin=first.thiamin,
-                riboflavin=first.riboflavin,
-                niacin=first.niacin,
-                vitaminC=first.vitaminC,
-                vitaminETotal=first.vitaminETotal,
-                vitaminE1=first.vitaminE1,
-                vitaminE2=first.vitaminE2,
-                vitaminE3=first.vitaminE3,
-                Ca=first.Ca,
-                P=first.P,
-                K=first.K,
-                Na=first.Na,
-                Mg=first.Mg,
-                Fe=first.Fe,
-                Zn=first.Zn,
-                Se=first.Se,
-                Cu=first.Cu,
-                Mn=first.Mn,
-                remark=first.remark
+                is_main_food=sys.intern(first.is_main_food) if first.is_main_food else first.is_main_food,
+                **shared
             )
             foods.append(food)
 
@@ -1121,15 +1324,21 @@ class MealGeneratorV2:
                 'grams': f"{float(first.food_amount_grams or 0):.1f}"
             })
 
-            for field, key in NUTRIENT_MAPPING.items():
-                val = getattr(first, field, None)
-                if val is not None:
-                    nutrients[key] += float(val) * float(first.food_amount_grams) / 100
+            # 一种食材含多个过敏原时视图里是多行，每行一个过敏原
+            for r in rows:
+                if r.allergen_code:
+                    allergens.add(r.allergen_code)
 
-            if first.allergen_code:
-                allergens.add(first.allergen_code)
+        return ingredients, allergens, foods
 
-        return ingredients, dict(nutrients), allergens, foods  # 修改：增加foods返回值
+    @staticmethod
+    def _food_shared_fields(row: DishFoodNutrient) -> Dict:
+        """Food 中与具体菜品无关的字段，字符串做 intern"""
+        shared = {}
+        for name in _FOOD_SHARED_FIELDS:
+            val = getattr(row, name)
+            shared[name] = sys.intern(val) if isinstance(val, str) else val
+        return shared
 
     @staticmethod
     def _build_dish_tags(tags_json: Optional[str]) -> Dict[str, List[Dict[str, str]]]:
@@ -1156,6 +1365,8 @@ class MealGeneratorV2:
     def filter_dishes(cls, dish_list: List[Dish], req: MealRequest) -> List[Dish]:
         # 创建结果列表而不是在原列表上修改
         filtered_dishes = []
+        raw = req.dish_series
+        allowed = {s.strip() for s in raw.split(',')} if raw else set()
 
         for dish in dish_list:
             # 假设 dish 是 Dish 对象，而不是 (dish_id, meta) 元组
@@ -1169,8 +1380,6 @@ class MealGeneratorV2:
 
             # 检查菜品系列
             dish_series = cls.tag_pick(dish, 'cuisine', 'code')
-            raw = req.dish_series
-            allowed = {s.strip() for s in raw.split(',')} if raw else set()
 
             # 检查两个集合是否有交集
             if allowed and not any(series in allowed for series in dish_series):
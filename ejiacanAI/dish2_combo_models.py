@@ -36,6 +36,7 @@ class MealRequest:
     dish_series: Optional[str] = None  # 菜系ID
     dish_category: Optional[str] = None # 菜品类别
     want_eat: Optional[str] = None  # 逗号或空格隔开的食材/菜品名称
+    deadline_ms: Optional[int] = None  # 生成耗时预算（毫秒），超时返回已有的完整方案并标记 degraded；None 不限
 
 @dataclass
 class ExactPortion:
@@ -72,6 +73,7 @@ class ComboMeal:
     nutrients: Dict[str, float] = field(default_factory=dict)  # 新增：营养素汇总
     need_nutrients: Dict[str, float] = field(default_factory=dict)  # 新增：目标营养素需求
     food_category_distribution: Dict[str, int] = field(default_factory=dict)
+    degraded: bool = False  # 超出 deadline_ms 时跳过了部分阶段（排名 / 备选 / 补充 / 份量求解）
 
 @dataclass
 class DishFoodNutrient1:
@@ -150,10 +152,11 @@ class MemberNeedNutrient:
 
 # v3_dish_food_complete_view 中需要调整 DishFoodNutrient 和 Dish 模型
 
-@dataclass
+@dataclass(slots=True)
 class DishFoodNutrient:
     """
     对应 dish_food_complete_view 一行
+    用 __slots__ 存字段（没有 __dict__），逐行读取整个目录时内存小得多
     """
     dish_id: int
     dish_name: str
@@ -228,6 +231,7 @@ class Dish:
     dish_tags: Dict[str, List[Dict[str, str]]]
     foods: List[Food] = field(default_factory=list)  # 新增：食材详细信息
     food_categories: List[str] = field(default_factory=list)  # 如 ['protein', 'vege_fruit']
+    main_food_id: Optional[int] = None  # 主料（用量最大的食材）的 food_id，目录组装时算好，用于主料去重
     # 以下全部给默认值
     need_tags: List[str] = field(default_factory=list)
     implicit_tags: List[str] = field(default_factory=list)
@@ -236,9 +240,13 @@ class Dish:
     rating: Optional[float] = None
     description: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Food:
-    """食材信息"""
+    """
+    食材信息（__slots__，没有 __dict__）
+    目录里同一食材会出现在很多道菜中，组装时除用量 / 是否主料外的字段
+    都共用同一批对象（见 MealGeneratorV2._aggregate_foods）
+    """
     food_id: int
     food_amount_grams: int
     foodCode: int
@@ -0,0 +1,159 @@
+# dish2_matrix.py
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models.nutrient_config import NUTRIENT_MAPPING, nutrient_priority
+
+# 菜品营养素编码（Dish.nutrients 的 key），即 NUTRIENT_MAPPING 的取值
+DISH_NUTRIENT_CODES: Tuple[str, ...] = tuple(dict.fromkeys(NUTRIENT_MAPPING.values()))
+
+
+class NutrientMatrix:
+    """
+    菜品 × 营养素 的列存矩阵：
+    - values[i, j]：第 i 道菜的营养素 codes[j] 含量
+    - present[i, j]：该营养素是否出现在 Dish.nutrients 里（区分"没有数据"和"含量为 0"）
+    Dish 本身不变，nutrients 字典仍是对外输出的数据；矩阵记住每行来自哪个字典，
+    take() 时字典已被份量缩放替换掉的菜会按当前字典现算一行，结果与逐个字典计算一致。
+    codes 之外的营养素不参与计算；不传 codes 时取所有菜的营养素并集。
+    """
+
+    def __init__(self, dishes: Sequence, codes: Optional[Sequence[str]] = None):
+        if codes is None:
+            codes = list(dict.fromkeys(k for d in dishes for k in d.nutrients))
+        self.codes: Tuple[str, ...] = tuple(codes)
+        self.code_index: Dict[str, int] = {c: j for j, c in enumerate(self.codes)}
+        self.dish_ids = np.array([d.dish_id for d in dishes], dtype=np.int64)
+        self.dish_index: Dict[int, int] = {d.dish_id: i for i, d in enumerate(dishes)}
+        self.values, self.present = self._build([d.nutrients for d in dishes])
+        self._sources = [d.nutrients for d in dishes]
+
+    def __len__(self):
+        return len(self.dish_ids)
+
+    def take(self, dishes: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """取一组菜对应的 (values, present) 子矩阵，行顺序与 dishes 一致"""
+        if not len(self.dish_ids):
+            return self._build([d.nutrients for d in dishes])
+        rows = []
+        missing = []
+        for k, d in enumerate(dishes):
+            i = self.dish_index.get(d.dish_id)
+            if i is not None and self._sources[i] is d.nutrients:
+                rows.append(i)
+            else:
+                rows.append(-1)
+                missing.append(k)
+        rows = np.array(rows, dtype=np.int64)
+        values = self.values[rows]
+        present = self.present[rows]
+        if missing:
+            extra_values, extra_present = self._build([dishes[k].nutrients for k in missing])
+            values[missing] = extra_values
+            present[missing] = extra_present
+        return values, present
+
+    def vector(self, meal_range: Dict[str, Dict[str, float]], field: str) -> np.ndarray:
+        """把 {营养素: {min/max/need}} 中某个字段按列顺序取成向量，缺失为 0"""
+        return np.array([meal_range.get(c, {}).get(field, 0) for c in self.codes], dtype=float)
+
+    def totals(self, dishes: Sequence) -> np.ndarray:
+        """一组菜的营养素合计（按列）"""
+        values, _ = self.take(dishes)
+        return values.sum(axis=0)
+
+    # -------------------------------------------------
+    # 向量化打分
+    # -------------------------------------------------
+    def nutrient_bonus(self, dishes: Sequence, meal_range: Dict[str, Dict[str, float]]) -> np.ndarray:
+        """
+        与 MealGeneratorV2._calculate_nutrient_bonus 相同的规则，一次算完一组候选菜：
+        每个还有需求的营养素 +int(min(提供/需求, 2) * 3)，总分封顶 10
+        """
+        if not dishes or not meal_range:
+            return np.zeros(len(dishes), dtype=int)
+        values, present = self.take(dishes)
+        need = self.vector(meal_range, "need")
+        hit = present & (need > 0) & (values > 0)
+        ratio = np.minimum(np.divide(values, need, out=np.zeros_like(values), where=need > 0), 2.0)
+        bonus = np.where(hit, np.floor(ratio * 3), 0).sum(axis=1)
+        return np.minimum(bonus, 10).astype(int)
+
+    def remaining_gap(self, dishes: Sequence, meal_range: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+        """扣掉已选菜之后的剩余需求：need = max(0, need - 合计)，返回新的 meal_range"""
+        totals = self.totals(dishes) if dishes else np.zeros(len(self.codes))
+        remaining = {k: dict(v) for k, v in meal_range.items()}
+        for code, values in remaining.items():
+            j = self.code_index.get(code)
+            if j is not None and "need" in values:
+                values["need"] = max(0.0, values["need"] - float(totals[j]))
+        return remaining
+
+    def portion_scale(self, dishes: Sequence, meal_range: Dict[str, Dict[str, float]]) -> float:
+        """
+        整餐份量缩放系数，规则同原 _calculate_optimal_scale：
+        1. protein/calories 严重不足（< min*0.8）直接放大，最多 1.5 倍
+        2. 有超标：高优先级(>=8) 按 0.9，其余按 max/current，取最小；
+           高优先级营养素又明显不足（< min*0.9）时不低于 0.8
+        3. 只有不足：高优先级营养素按 min/current 放大，最多 1.3，取最小
+        最终限制在 [0.5, 2.0]
+        """
+        if not dishes or not meal_range:
+            return 1.0
+        totals = self.totals(dishes)
+        codes = list(meal_range.keys())
+        current = np.array([float(totals[self.code_index[c]]) if c in self.code_index else 0.0
+                            for c in codes])
+        min_need = np.array([meal_range[c].get("min", 0) for c in codes], dtype=float)
+        max_need = np.array([meal_range[c].get("max", 0) for c in codes], dtype=float)
+        high = np.array([nutrient_priority.get(c, 1) >= 8 for c in codes])
+        safe_current = np.maximum(current, 1e-6)
+
+        for critical in ("protein", "calories"):
+            if critical in meal_range:
+                k = codes.index(critical)
+                if current[k] < min_need[k] * 0.8:
+                    return float(min(1.5, min_need[k] / safe_current[k]))
+
+        excess = current > max_need
+        if excess.any():
+            shrink = np.where(high, 0.9, np.divide(max_need, current, out=np.zeros_like(current),
+                                                    where=current > 0))[excess]
+            scale = float(shrink.min())
+            critical_deficit = bool((high & (current < min_need * 0.9)).any())
+            if critical_deficit and scale < 0.8:
+                scale = max(0.8, scale)
+        else:
+            expand_mask = high & (current < min_need)
+            if expand_mask.any():
+                scale = float(np.minimum(1.3, min_need / safe_current)[expand_mask].min())
+            else:
+                scale = 1.0
+        return max(0.5, min(2.0, scale))
+
+    def pairwise_overlap(self) -> np.ndarray:
+        """
+        两两营养重叠度（n × n），规则同 DishMergeProcessor._calculate_nutrient_overlap：
+        对两道菜都有的营养素取 min/max 的平均，没有共同营养素为 0
+        """
+        v = self.values[:, None, :]
+        w = self.values[None, :, :]
+        common = self.present[:, None, :] & self.present[None, :, :]
+        hi = np.maximum(v, w)
+        ratio = np.divide(np.minimum(v, w), hi, out=np.zeros_like(hi), where=hi > 0)
+        count = common.sum(axis=2)
+        total = np.where(common, ratio, 0).sum(axis=2)
+        return np.divide(total, count, out=np.zeros(total.shape), where=count > 0)
+
+    # ------------------ 下面全是小工具 ------------------
+    def _build(self, nutrient_dicts: List[Dict[str, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        values = np.zeros((len(nutrient_dicts), len(self.codes)), dtype=float)
+        present = np.zeros(values.shape, dtype=bool)
+        for i, nutrients in enumerate(nutrient_dicts):
+            for code, val in nutrients.items():
+                j = self.code_index.get(code)
+                if j is not None:
+                    values[i, j] = val
+                    present[i, j] = True
+        return values, present
@@ -0,0 +1,164 @@
+# dish2_nutrient_kernel.py
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from dbconnect.forksafe import after_fork_in_child
+from ejiacanAI.dish2_combo_data import DishComboData
+from models.nutrient_config import NUTRIENT_MAPPING
+
+logger = logging.getLogger(__name__)
+
+# food_nutrition 的营养列（每 100g 可食部），列顺序即矩阵列顺序
+FOOD_NUTRIENT_FIELDS: Tuple[str, ...] = tuple(NUTRIENT_MAPPING.keys())
+
+# 需求标签规则用到的"每 100g 成品"营养列
+PER_100G_FIELDS: Tuple[str, ...] = (
+    "energyKCal", "protein", "fat", "CHO", "dietaryFiber",
+    "cholesterol", "vitaminA", "thiamin", "riboflavin", "niacin",
+    "vitaminC", "vitaminETotal", "Ca", "P", "K", "Na", "Mg",
+    "Fe", "Zn", "Se", "Cu", "Mn"
+)
+
+
+class FoodNutrientTable:
+    """
+    食物 × 营养素 稠密矩阵（来自 food_nutrition，进程内只加载一次）
+    - values：每 100g 的含量，NULL 记 0
+    - present：该值是否非 NULL（菜品营养字典只收录有数据的营养素）
+    - edible：可食部比例（0~1），NULL 按 1 处理
+    """
+
+    def __init__(self, rows: Sequence[Dict]):
+        self.food_ids = np.array([int(r["foodCode"]) for r in rows], dtype=np.int64)
+        self.food_index: Dict[int, int] = {int(f): i for i, f in enumerate(self.food_ids)}
+        self.field_index: Dict[str, int] = {f: j for j, f in enumerate(FOOD_NUTRIENT_FIELDS)}
+        self.values = np.zeros((len(rows), len(FOOD_NUTRIENT_FIELDS)), dtype=float)
+        self.present = np.zeros(self.values.shape, dtype=bool)
+        for i, r in enumerate(rows):
+            for j, f in enumerate(FOOD_NUTRIENT_FIELDS):
+                v = r.get(f)
+                if v is not None:
+                    self.values[i, j] = float(v)
+                    self.present[i, j] = True
+        edible = self.values[:, self.field_index["edible"]]
+        self.edible = np.where(self.present[:, self.field_index["edible"]], edible / 100.0, 1.0)
+
+    def __len__(self):
+        return len(self.food_ids)
+
+
+class DishComposition:
+    """
+    菜品 × 食物 稀疏用量矩阵（克），列与 FoodNutrientTable 的行对齐。
+    同一道菜同一食物出现多行时用量累加；不在 food_nutrition 里的食物忽略并记日志。
+    """
+
+    def __init__(self, triples: Iterable[Tuple[int, int, float]], foods: FoodNutrientTable):
+        dish_ids: List[int] = []
+        self.dish_index: Dict[int, int] = {}
+        rows, cols, grams = [], [], []
+        unknown = set()
+        for dish_id, food_id, g in triples:
+            i = self.dish_index.get(dish_id)
+            if i is None:
+                i = self.dish_index[dish_id] = len(dish_ids)
+                dish_ids.append(dish_id)
+            j = foods.food_index.get(int(food_id))
+            if j is None:
+                unknown.add(food_id)
+                continue
+            rows.append(i)
+            cols.append(j)
+            grams.append(float(g or 0))
+        if unknown:
+            logger.warning("foods missing from food_nutrition, ignored: %s", sorted(unknown)[:20])
+        self.dish_ids = np.array(dish_ids, dtype=np.int64)
+        shape = (len(dish_ids), len(foods))
+        self.grams = sparse.csr_matrix((grams, (rows, cols)), shape=shape)
+        # 出现关系（不看用量），用来判断营养素"有没有数据"
+        self.incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+
+    def __len__(self):
+        return len(self.dish_ids)
+
+
+class NutrientKernel:
+    """
+    菜品营养统一计算：一次稀疏矩阵乘法得到所有菜品的营养
+    - dish_nutrients：菜品合计（生重口径，含量 × 用量 / 100），供选菜生成器使用
+    - dish_per_100g：每 100g 成品（按可食部折算后按总用量归一），供需求标签规则使用
+    """
+    _foods: Optional[FoodNutrientTable] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def foods(cls) -> FoodNutrientTable:
+        if cls._foods is None:
+            with cls._lock:
+                if cls._foods is None:
+                    cls._foods = FoodNutrientTable(DishComboData.list_food_nutrition())
+        return cls._foods
+
+    @classmethod
+    def reload_foods(cls):
+        """food_nutrition 更新后调用，下一次计算重新加载"""
+        cls._foods = None
+
+    @classmethod
+    def _after_fork(cls):
+        cls._lock = threading.Lock()
+
+    @classmethod
+    def composition(cls, triples: Iterable[Tuple[int, int, float]]) -> DishComposition:
+        """由 (dish_id, food_id, grams) 三元组构造用量矩阵"""
+        return DishComposition(triples, cls.foods())
+
+    @classmethod
+    def composition_for(cls, dish_ids: Optional[List[int]] = None) -> DishComposition:
+        """从 ejia_dish_food_rel 读用量；dish_ids 为空表示全部菜品"""
+        rows = DishComboData.list_dish_food_rel(dish_ids)
+        return cls.composition((r["dish_id"], r["food_id"], r["amount_grams"]) for r in rows)
+
+    @classmethod
+    def dish_nutrients(cls, comp: DishComposition) -> Dict[int, Dict[str, float]]:
+        """
+        {dish_id: {营养素编码: 合计}}，编码取 NUTRIENT_MAPPING 的值；
+        只收录至少一种食材有数据的营养素，与逐食材累加的结果一致
+        """
+        foods = cls.foods()
+        totals = comp.grams @ foods.values / 100.0
+        present = (comp.incidence @ foods.present.astype(float)) > 0
+        codes = [NUTRIENT_MAPPING[f] for f in FOOD_NUTRIENT_FIELDS]
+        result = {}
+        for i, dish_id in enumerate(comp.dish_ids):
+            cols = np.flatnonzero(present[i])
+            result[int(dish_id)] = {codes[j]: float(totals[i, j]) for j in cols}
+        return result
+
+    @classmethod
+    def dish_per_100g(cls, comp: DishComposition,
+                      fields: Sequence[str] = PER_100G_FIELDS) -> Dict[int, Dict[str, float]]:
+        """
+        {dish_id: {营养列: 每100g成品含量}}
+        贡献 = 含量 × 用量 × 可食部 / 100，再按菜品总用量归一到 100g；总用量为 0 的菜返回 {}
+        """
+        foods = cls.foods()
+        cols = [foods.field_index[f] for f in fields]
+        edible_values = foods.values[:, cols] * foods.edible[:, None]
+        totals = comp.grams @ edible_values / 100.0
+        weight = np.asarray(comp.grams.sum(axis=1)).ravel()
+        result = {}
+        for i, dish_id in enumerate(comp.dish_ids):
+            if weight[i] == 0:
+                result[int(dish_id)] = {}
+                continue
+            factor = 100.0 / weight[i]
+            result[int(dish_id)] = {f: float(totals[i, k] * factor) for k, f in enumerate(fields)}
+        return result
+
+
+after_fork_in_child(NutrientKernel._after_fork)
@@ -0,0 +1,226 @@
+# dish2_plan_cache.py
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from dbconnect.forksafe import after_fork_in_child
+from ejiacanAI.dish2_combo_models import ComboMeal, MealRequest
+
+logger = logging.getLogger(__name__)
+
+
+class SqlitePlanStore:
+    """
+    同一台机器上多个 worker 共用的方案存储（SQLite 文件，值是 pickle 后的方案）。
+    只做 get / put / 过期清理，出错一律当未命中处理，不影响生成。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS plan_cache "
+                         "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT value, expires_at FROM plan_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def put(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO plan_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                         (key, now + ttl, sqlite3.Binary(value)))
+            conn.execute("DELETE FROM plan_cache WHERE expires_at <= ?", (now,))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """没有未过期的同 key 条目时才写入，返回是否写入"""
+        now = time.time()
+        with self._conn() as conn:
+            cur = conn.execute("INSERT INTO plan_cache (key, expires_at, value) VALUES (?, ?, ?) "
+                               "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at, value = excluded.value "
+                               "WHERE plan_cache.expires_at <= ?",
+                               (key, now + ttl, sqlite3.Binary(value), now))
+            return cur.rowcount > 0
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM plan_cache")
+
+    # ------------------ 下面全是小工具 ------------------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+
+class PlanCache:
+    """
+    已生成方案的缓存：key = 请求指纹（MealRequest 规范化后的字段 + 生成入口）
+    + 目录水位 + 家庭每日需求 + 家庭过敏原，四者都不变时生成结果必然相同。
+    - 进程内 LRU（max_entries 条）+ TTL（ttl 秒）
+    - 设置环境变量 EJIACAN_PLAN_CACHE_DB（SQLite 文件路径）后，未命中时再查共享存储，
+      生成结果同时写回共享存储，同机多个 worker 共用
+    - 存的是 pickle 后的字节，每次命中都反序列化出新对象，调用方可以随意修改
+    """
+    max_entries = 512
+    ttl = 300
+
+    _entries: "OrderedDict[str, tuple]" = OrderedDict()
+    _lock = threading.Lock()
+    _store: Optional[SqlitePlanStore] = None
+    _store_checked = False
+    _stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0}
+
+    @staticmethod
+    def fingerprint(entry: str, req: MealRequest, watermark: Optional[str],
+                    daily_range: Dict[str, Dict[str, float]], allergen_codes: Iterable[str]) -> str:
+        """规范化后的请求指纹（sha1），跨进程稳定；耗时预算不影响完整方案，不计入指纹"""
+        req_fields = dataclasses.asdict(req)
+        req_fields.pop('deadline_ms', None)
+        payload = {
+            'entry': entry,
+            'req': req_fields,
+            'catalog': watermark,
+            'daily_range': daily_range,
+            'allergens': sorted(set(allergen_codes)),
+        }
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[List[ComboMeal]]:
+        now = time.monotonic()
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry[0] > now:
+                cls._entries.move_to_end(key)
+                cls._stats['hits'] += 1
+                return pickle.loads(entry[1])
+            if entry is not None:
+                del cls._entries[key]
+
+        store = cls._shared_store()
+        if store is not None:
+            try:
+                value = store.get(key)
+            except Exception as e:
+                logger.warning("plan cache store read failed: %s", e)
+                value = None
+            if value is not None:
+                cls._remember(key, bytes(value))
+                with cls._lock:
+                    cls._stats['shared_hits'] += 1
+                return pickle.loads(value)
+
+        with cls._lock:
+            cls._stats['misses'] += 1
+        return None
+
+    @classmethod
+    def put(cls, key: str, meals: List[ComboMeal]):
+        value = pickle.dumps(meals, protocol=pickle.HIGHEST_PROTOCOL)
+        cls._remember(key, value)
+        with cls._lock:
+            cls._stats['puts'] += 1
+        store = cls._shared_store()
+        if store is not None:
+            try:
+                store.put(key, value, cls.ttl)
+            except Exception as e:
+                logger.warning("plan cache store write failed: %s", e)
+
+    @classmethod
+    def add(cls, key: str, meals: Any) -> bool:
+        """
+        只在 key 没有未过期条目（本进程和共享存储都没有）时写入，返回是否写入；
+        用于预生成的方案：用户已经看过的那一批不能被替换掉
+        """
+        now = time.monotonic()
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return False
+        value = pickle.dumps(meals, protocol=pickle.HIGHEST_PROTOCOL)
+        store = cls._shared_store()
+        if store is not None:
+            try:
+                if not store.add(key, value, cls.ttl):
+                    return False
+            except Exception as e:
+                logger.warning("plan cache store write failed: %s", e)
+        if not cls._remember(key, value, only_if_absent=True):
+            return False
+        with cls._lock:
+            cls._stats['puts'] += 1
+        return True
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+        store = cls._shared_store()
+        if store is not None:
+            store.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats['entries'] = len(cls._entries)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0.0
+        stats['shared_store'] = cls._store.path if cls._store is not None else None
+        return stats
+
+    # ------------------ 下面全是小工具 ------------------
+    @classmethod
+    def _after_fork(cls):
+        # 进程内条目照常可用；SQLite 连接不能跨 fork 使用，共享存储在子进程里重新打开
+        cls._lock = threading.Lock()
+        cls._store = None
+        cls._store_checked = False
+
+    @classmethod
+    def _remember(cls, key: str, value: bytes, only_if_absent: bool = False) -> bool:
+        with cls._lock:
+            now = time.monotonic()
+            if only_if_absent:
+                entry = cls._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    return False
+            cls._entries[key] = (now + cls.ttl, value)
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > cls.max_entries:
+                cls._entries.popitem(last=False)
+                cls._stats['evictions'] += 1
+        return True
+
+    @classmethod
+    def _shared_store(cls) -> Optional[SqlitePlanStore]:
+        if not cls._store_checked:
+            with cls._lock:
+                if not cls._store_checked:
+                    path = os.environ.get("EJIACAN_PLAN_CACHE_DB")
+                    if path:
+                        try:
+                            cls._store = SqlitePlanStore(path)
+                        except Exception as e:
+                            logger.warning("plan cache store %s unavailable: %s", path, e)
+                    cls._store_checked = True
+        return cls._store
+
+
+after_fork_in_child(PlanCache._after_fork)
@@ -0,0 +1,149 @@
+# dish2_portion_solver.py
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+from scipy.optimize import linprog
+
+from dbconnect.forksafe import after_fork_in_child
+from models.nutrient_config import nutrient_priority
+
+logger = logging.getLogger(__name__)
+
+# nutrient_priority 用的是小写名字，菜品营养素编码要先换过去
+_PRIORITY_NAMES = {
+    'Protein': 'protein',
+    'EnergyKCal': 'calories',
+    'Fat': 'fat',
+    'Carbohydrate': 'carbohydrate',
+    'DietaryFiber': 'dietary_fiber',
+}
+
+
+class PortionSolver:
+    """
+    逐道菜的份量倍数：最小化 各营养素落在 [min, max] 之外的偏差 × 优先级 / 需求量，
+    写成线性规划（偏差拆成 不足 / 超出 两个非负变量），用 HiGHS 求解：
+        min  Σ_j w_j (u_j + o_j) + smooth · Σ_i |x_i - 1|
+        s.t. Σ_i A_ij x_i + u_j >= min_j,  Σ_i A_ij x_i - o_j <= max_j,  x_i ∈ [min_scale, max_scale]
+    smooth 只在偏差相同的解之间起作用，让份量尽量少动。
+    以整餐统一缩放（启发式结果）作为起始解：求解超时、失败或不比它好时返回统一缩放。
+    """
+    min_scale = 0.5
+    max_scale = 2.0
+    time_limit = 0.05   # 秒
+    smooth = 1e-3
+
+    _lock = threading.Lock()
+    _stats = {'solved': 0, 'kept_warm_start': 0, 'failed': 0, 'seconds': 0.0}
+
+    @classmethod
+    def solve(cls, values: np.ndarray, codes: Sequence[str], meal_range: Dict[str, Dict[str, float]],
+              warm_start: float = 1.0) -> np.ndarray:
+        """
+        values：选中菜品 × 营养素（列顺序同 codes）的当前含量；返回每道菜的份量倍数
+        """
+        n = values.shape[0]
+        warm = np.full(n, min(cls.max_scale, max(cls.min_scale, warm_start)))
+        cols, lo, hi, weight = cls._targets(codes, meal_range)
+        if not n or not cols:
+            return warm
+
+        a = values[:, cols]
+        start = time.perf_counter()
+        solution = cls._solve_lp(a, lo, hi, weight)
+        if solution is None:
+            outcome, result = 'failed', warm
+        elif cls._error(a, solution, lo, hi, weight) >= cls._error(a, warm, lo, hi, weight):
+            outcome, result = 'kept_warm_start', warm
+        else:
+            outcome, result = 'solved', solution
+        with cls._lock:
+            cls._stats[outcome] += 1
+            cls._stats['seconds'] += time.perf_counter() - start
+        return result
+
+    @classmethod
+    def fit_error(cls, values: np.ndarray, codes: Sequence[str], meal_range: Dict[str, Dict[str, float]],
+                  multipliers: np.ndarray) -> float:
+        """加权偏差（与目标函数的偏差项相同），0 表示所有营养素都在区间内"""
+        cols, lo, hi, weight = cls._targets(codes, meal_range)
+        if not cols:
+            return 0.0
+        return cls._error(values[:, cols], multipliers, lo, hi, weight)
+
+    @classmethod
+    def stats(cls) -> Dict[str, float]:
+        with cls._lock:
+            stats = dict(cls._stats)
+        stats['seconds'] = round(stats['seconds'], 3)
+        return stats
+
+    # ------------------ 下面全是小工具 ------------------
+    @classmethod
+    def _after_fork(cls):
+        cls._lock = threading.Lock()
+
+    @staticmethod
+    def priority(code: str) -> int:
+        return nutrient_priority.get(_PRIORITY_NAMES.get(code, code), 1)
+
+    @classmethod
+    def _targets(cls, codes: Sequence[str], meal_range: Dict[str, Dict[str, float]]):
+        """有区间的营养素：(列下标, min, max, 权重)；权重 = 优先级 / 需求量，把各营养素的单位拉平"""
+        cols, lo, hi, weight = [], [], [], []
+        for j, code in enumerate(codes):
+            r = meal_range.get(code)
+            if not r:
+                continue
+            low, high = float(r.get("min", 0) or 0), float(r.get("max", 0) or 0)
+            ref = float(r.get("need", 0) or 0) or (low + high) / 2 or high
+            if ref <= 0:
+                continue
+            cols.append(j)
+            lo.append(low)
+            hi.append(high if high > 0 else np.inf)
+            weight.append(cls.priority(code) / ref)
+        return cols, np.array(lo), np.array(hi), np.array(weight)
+
+    @staticmethod
+    def _error(a: np.ndarray, x: np.ndarray, lo: np.ndarray, hi: np.ndarray, weight: np.ndarray) -> float:
+        total = x @ a
+        deviation = np.maximum(lo - total, 0) + np.where(np.isfinite(hi), np.maximum(total - hi, 0), 0)
+        return float(weight @ deviation)
+
+    @classmethod
+    def _solve_lp(cls, a: np.ndarray, lo: np.ndarray, hi: np.ndarray, weight: np.ndarray) -> Optional[np.ndarray]:
+        """变量顺序 [x(n), u(m), o(m), d(n)]，d_i >= |x_i - 1|"""
+        n, m = a.shape
+        bounded = np.isfinite(hi)
+        c = np.concatenate([np.zeros(n), weight, np.where(bounded, weight, 0), np.full(n, cls.smooth)])
+
+        eye_n, eye_m = np.eye(n), np.eye(m)
+        zeros_nm, zeros_mn = np.zeros((n, m)), np.zeros((m, n))
+        rows = [
+            # -A^T x - u <= -min
+            np.hstack([-a.T, -eye_m, np.zeros((m, m)), zeros_mn]),
+            # A^T x - o <= max（没有上限的营养素不加）
+            np.hstack([a.T, np.zeros((m, m)), -eye_m, zeros_mn])[bounded],
+            # x - d <= 1, -x - d <= -1
+            np.hstack([eye_n, zeros_nm, zeros_nm, -eye_n]),
+            np.hstack([-eye_n, zeros_nm, zeros_nm, -eye_n]),
+        ]
+        b = np.concatenate([-lo, hi[bounded], np.ones(n), -np.ones(n)])
+        bounds = [(cls.min_scale, cls.max_scale)] * n + [(0, None)] * (2 * m + n)
+        try:
+            result = linprog(c, A_ub=np.vstack(rows), b_ub=b, bounds=bounds, method="highs",
+                             options={"time_limit": cls.time_limit})
+        except Exception as e:
+            logger.warning("portion solver failed: %s", e)
+            return None
+        if result.status != 0 or result.x is None:
+            logger.debug("portion solver status %s: %s", result.status, result.message)
+            return None
+        return np.clip(result.x[:n], cls.min_scale, cls.max_scale)
+
+
+after_fork_in_child(PortionSolver._after_fork)
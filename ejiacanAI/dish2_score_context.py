@@ -0,0 +1,111 @@
+# dish2_score_context.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from ejiacanAI.dish2_catalog import DishCatalog
+from ejiacanAI.dish2_combo_models import Dish, MealRequest
+from ejiacanAI.dish2_want_eat import NO_HITS, WantEatMatcher, WantHits
+
+_current: ContextVar[Optional["DishScoreContext"]] = ContextVar("ejiacan_dish_score_context", default=None)
+
+
+class DishScoreContext:
+    """
+    一次选菜请求的打分上下文：
+    - need_tags 在构造时解析一次；want_eat 编译成 WantEatMatcher，
+      目录菜的命中次数第一次用到时经目录的 WantEatIndex 一次查出
+    - 每道菜与请求相关、与选菜进度无关的部分（需求标签分、want_eat 命中次数）按 dish_id 记住
+    - 只有动态项（已选 want_eat 数量对应的倍率、营养补充加分）每次现算
+    want_eat 规则：菜名完全匹配 20 / 包含 10，食材完全匹配 8 / 包含 4，已选过 want_eat 菜后按 0.2 倍。
+    """
+
+    def __init__(self, req: MealRequest):
+        self.req = req
+        req_tags = getattr(req, 'need_tags', None)
+        if isinstance(req_tags, str):
+            req_tags = req_tags.split(",")
+        self.req_tags = set(req_tags) if req_tags else None
+        self.want_items = self._parse_want_eat(getattr(req, 'want_eat', None))
+        self.matcher = WantEatMatcher(self.want_items)
+        self._static: Dict[int, int] = {}
+        self._want_hits: Dict[int, WantHits] = {}
+        self._snapshot = None
+        self._catalog_hits: Optional[Dict[int, WantHits]] = None
+        self.score_calls = 0
+        self.static_misses = 0
+
+    @staticmethod
+    def current(req: MealRequest) -> "DishScoreContext":
+        """当前作用域里同一请求的上下文；没有作用域（或请求不同）时给一个不共享的新上下文"""
+        ctx = _current.get()
+        if ctx is not None and ctx.req is req:
+            return ctx
+        return DishScoreContext(req)
+
+    @staticmethod
+    @contextmanager
+    def scope(req: MealRequest):
+        """with DishScoreContext.scope(req): ... 作用域内的打分共用一份解析结果和缓存"""
+        ctx = DishScoreContext(req)
+        token = _current.set(ctx)
+        try:
+            yield ctx
+        finally:
+            _current.reset(token)
+
+    # -------------------------------------------------
+    # 打分
+    # -------------------------------------------------
+    def score(self, dish: Dish, nutrient_bonus: int, current_want_eat_count: int = 0) -> int:
+        self.score_calls += 1
+        return self.static_score(dish) + self.want_eat_score(dish, current_want_eat_count) + nutrient_bonus
+
+    def static_score(self, dish: Dish) -> int:
+        """需求标签数 + 与请求需求标签的匹配分"""
+        score = self._static.get(dish.dish_id)
+        if score is None:
+            self.static_misses += 1
+            score = len(dish.need_tags)
+            if self.req_tags:
+                score += len(self.req_tags.intersection(dish.need_tags)) * 2
+            self._static[dish.dish_id] = score
+        return score
+
+    def want_eat_score(self, dish: Dish, current_want_eat_count: int = 0) -> int:
+        """
+        want_eat 分：已选过 want_eat 菜（current_want_eat_count >= 1）时倍率降到 0.2；
+        每一项按倍率取整后再累加，与原逐项计算一致
+        """
+        if not self.want_items:
+            return 0
+        hits = self._want_hits.get(dish.dish_id)
+        if hits is None:
+            hits = self._want_hits[dish.dish_id] = self._lookup_want_hits(dish)
+        multiplier = 0.2 if current_want_eat_count >= 1 else 1.0
+        name_exact, name_part, food_exact, food_part = hits
+        return (name_exact * int(20 * multiplier) + name_part * int(10 * multiplier)
+                + food_exact * int(8 * multiplier) + food_part * int(4 * multiplier))
+
+    def stats(self) -> Dict[str, int]:
+        return {'score_calls': self.score_calls, 'static_misses': self.static_misses,
+                'cached_dishes': len(self._static)}
+
+    # ------------------ 下面全是小工具 ------------------
+    @staticmethod
+    def _parse_want_eat(want_eat: Optional[str]) -> List[str]:
+        if not want_eat:
+            return []
+        return [item.strip().lower() for item in want_eat.replace('，', ',').split(',') if item.strip()]
+
+    def _lookup_want_hits(self, dish: Dish) -> WantHits:
+        """目录菜（菜名、食材还是快照里那一份）查索引，其它菜用自动机现扫"""
+        if self._snapshot is None:
+            self._snapshot = DishCatalog.get()
+        snapshot = self._snapshot
+        pos = snapshot.tag_index.position.get(dish.dish_id)
+        if pos is None or snapshot.dishes[pos].foods is not dish.foods or snapshot.dishes[pos].name != dish.name:
+            return self.matcher.dish_hits(dish)
+        if self._catalog_hits is None:
+            self._catalog_hits = snapshot.want_eat.hits(self.matcher)
+        return self._catalog_hits.get(pos, NO_HITS)
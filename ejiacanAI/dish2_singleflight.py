@@ -0,0 +1,87 @@
+# dish2_singleflight.py
+import copy
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from dbconnect.forksafe import after_fork_in_child
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    进程内的同 key 请求合并：同一时刻同一个 key 只有第一个调用者（leader）真正计算，
+    其余调用者等它算完共用结果（拿到的是 clone 出来的副本，互不影响）。
+    - 等待超过 wait_timeout 秒的调用者不再等，自己算一遍（记 timeouts）
+    - leader 抛异常时，等待中的调用者收到同一个异常
+    """
+    wait_timeout = 10.0
+
+    _calls: Dict[str, _Call] = {}
+    _lock = threading.Lock()
+    _stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    @classmethod
+    def do(cls, key: str, fn: Callable[[], Any], timeout: Optional[float] = None,
+           clone: Callable[[Any], Any] = copy.deepcopy) -> Any:
+        with cls._lock:
+            call = cls._calls.get(key)
+            leader = call is None
+            if leader:
+                call = cls._calls[key] = _Call()
+                cls._stats['leaders'] += 1
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = e
+                with cls._lock:
+                    cls._stats['errors'] += 1
+                raise
+            finally:
+                with cls._lock:
+                    cls._calls.pop(key, None)
+                call.event.set()
+
+        if not call.event.wait(cls.wait_timeout if timeout is None else timeout):
+            with cls._lock:
+                cls._stats['timeouts'] += 1
+            logger.warning("singleflight wait timed out, computing separately: %s", key)
+            return fn()
+        with cls._lock:
+            cls._stats['coalesced'] += 1
+        if call.error is not None:
+            raise call.error
+        return clone(call.result)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        with cls._lock:
+            stats = dict(cls._stats)
+            stats['in_flight'] = len(cls._calls)
+        return stats
+
+    # ------------------ 下面全是小工具 ------------------
+    @classmethod
+    def _after_fork(cls):
+        # 父进程里进行中的调用在子进程里不会有人算完，不能让子进程的请求去等它们
+        cls._lock = threading.Lock()
+        cls._calls = {}
+
+
+after_fork_in_child(SingleFlight._after_fork)
@@ -0,0 +1,104 @@
+# dish2_tag_index.py
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ejiacanAI.dish2_combo_models import Dish, MealRequest
+
+
+class TagIndex:
+    """
+    菜品目录的标签倒排索引：(分组, 标签code) -> 菜品位图。
+    位图用 Python int，第 i 位对应目录里第 i 道菜；过滤就是位与 / 位或，
+    最后 positions() 一次性展开成下标。
+    """
+    request_cache_size = 256
+
+    def __init__(self, dishes: Sequence[Dish], classify: Optional[Callable[[Dish], str]] = None):
+        self.size = len(dishes)
+        self.all = (1 << self.size) - 1
+        self.position: Dict[int, int] = {}
+        self._tags: Dict[Tuple[str, str], int] = {}
+        self._codes: Dict[str, int] = {}
+        self._structure: Dict[str, int] = {}
+        self.structure_types: List[Optional[str]] = [None] * self.size
+        self._cook_times = [d.cook_time for d in dishes]
+        self._cook_cache: Dict[int, int] = {}
+        self._request_cache: Dict[Tuple, List[int]] = {}
+
+        for i, dish in enumerate(dishes):
+            bit = 1 << i
+            self.position[dish.dish_id] = i
+            for group, tags in (dish.dish_tags or {}).items():
+                for tag in tags:
+                    code = tag.get('code')
+                    self._tags[(group, code)] = self._tags.get((group, code), 0) | bit
+                    self._codes[code] = self._codes.get(code, 0) | bit
+            if classify is not None:
+                structure_type = classify(dish)
+                self.structure_types[i] = structure_type
+                self._structure[structure_type] = self._structure.get(structure_type, 0) | bit
+
+    def tag(self, group: str, code: str) -> int:
+        return self._tags.get((group, code), 0)
+
+    def union(self, group: str, codes: Iterable[str]) -> int:
+        """分组内任一 code 命中"""
+        mask = 0
+        for code in codes:
+            mask |= self._tags.get((group, code), 0)
+        return mask
+
+    def any_group(self, code: str) -> int:
+        """任一分组下带该 code（目录 SQL 的餐次条件就是这个语义）"""
+        return self._codes.get(code, 0)
+
+    def structure(self, structure_type: str) -> int:
+        return self._structure.get(structure_type, 0)
+
+    def cook_time_at_most(self, limit: Optional[int]) -> int:
+        """烹饪时间不超过 limit（或没有烹饪时间）的菜；limit 为 None 时不限"""
+        if limit is None:
+            return self.all
+        mask = self._cook_cache.get(limit)
+        if mask is None:
+            mask = 0
+            for i, t in enumerate(self._cook_times):
+                if t is None or t <= limit:
+                    mask |= 1 << i
+            self._cook_cache[limit] = mask
+        return mask
+
+    def request_mask(self, req: MealRequest) -> int:
+        """
+        一次请求的目录过滤，与原目录 SQL 的餐次条件 + MealGeneratorV2.filter_dishes 等价：
+        餐次（任一分组带 meal_type 标签）∩ 烹饪时间 ∩ 菜系（dish_series 任一命中）
+        """
+        mask = self.all
+        if req.meal_type and req.meal_type != "all":
+            mask &= self.any_group(req.meal_type)
+        mask &= self.cook_time_at_most(req.cook_time_limit)
+        allowed = {s.strip() for s in req.dish_series.split(',')} if req.dish_series else set()
+        if allowed:
+            mask &= self.union('cuisine', allowed)
+        return mask
+
+    def request_positions(self, req: MealRequest) -> List[int]:
+        """
+        request_mask 展开后的下标，按过滤键（餐次, 烹饪时间, 菜系）记住：
+        过滤键相同的请求（批量生成时按它分组）只算一次位图、展开一次；返回值只读
+        """
+        key = (req.meal_type, req.cook_time_limit, req.dish_series)
+        positions = self._request_cache.get(key)
+        if positions is None:
+            if len(self._request_cache) >= self.request_cache_size:
+                self._request_cache.clear()
+            positions = self._request_cache[key] = self.positions(self.request_mask(req))
+        return positions
+
+    @staticmethod
+    def positions(mask: int) -> List[int]:
+        """位图 -> 升序下标列表"""
+        return [i for i, b in enumerate(reversed(bin(mask)[2:])) if b == '1'] if mask else []
+
+    @staticmethod
+    def has(mask: int, pos: int) -> bool:
+        return (mask >> pos) & 1 == 1
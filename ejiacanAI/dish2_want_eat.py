@@ -0,0 +1,152 @@
+# dish2_want_eat.py
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from ejiacanAI.dish2_combo_models import Dish
+
+# (菜名完全匹配, 菜名包含, 食材完全匹配, 食材包含) 的次数
+WantHits = Tuple[int, int, int, int]
+NO_HITS: WantHits = (0, 0, 0, 0)
+
+
+class WantEatMatcher:
+    """
+    want_eat 词条编译成的 Aho-Corasick 自动机（词条已小写）：
+    扫一遍文本就能拿到所有出现在其中的词条，不用逐个词条做子串判断。
+    同一词条写了多次按次数计分（与逐项累加一致）。
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self.weight = Counter(t for t in terms if t)
+        self.terms: List[str] = list(self.weight)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for k, term in enumerate(self.terms):
+            state = 0
+            for ch in term:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(k)
+        self._link()
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    def find(self, text: str) -> Set[int]:
+        """文本中出现的词条下标"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+    def counts(self, text: str) -> Tuple[int, int]:
+        """(与文本完全相同的词条数, 被文本包含但不相同的词条数)"""
+        exact = part = 0
+        for k in self.find(text):
+            if self.terms[k] == text:
+                exact += self.weight[self.terms[k]]
+            else:
+                part += self.weight[self.terms[k]]
+        return exact, part
+
+    def dish_hits(self, dish: Dish) -> WantHits:
+        """不在目录索引里的菜（或已被改过的副本）直接扫菜名和食材名"""
+        name_exact, name_part = self.counts(dish.name.lower() if dish.name else "")
+        food_exact = food_part = 0
+        for food in getattr(dish, 'foods', None) or []:
+            food_name = food.foodName.lower() if getattr(food, 'foodName', None) else ""
+            if food_name:
+                exact, part = self.counts(food_name)
+                food_exact += exact
+                food_part += part
+        return name_exact, name_part, food_exact, food_part
+
+    # ------------------ 下面全是小工具 ------------------
+    def _link(self):
+        """按层序补 fail 指针，并把 fail 链上的输出并到当前状态"""
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                if out[fail[nxt]]:
+                    out[nxt] = out[nxt] + out[fail[nxt]]
+
+
+class WantEatIndex:
+    """
+    目录侧的 want_eat 索引：菜名 / 食材名（小写去重后的词表）-> 菜品下标，
+    再加一份 字 -> 词表 的倒排。查询时每个词条先用它的字求交得到候选词，
+    只对候选词跑一遍自动机，最后经倒排映射回菜品，不用逐道菜扫描。
+    """
+
+    def __init__(self, dishes: Sequence[Dish]):
+        self._vocab: Dict[str, int] = {}
+        self._texts: List[str] = []
+        self._name_dishes: Dict[int, List[int]] = {}
+        self._food_dishes: Dict[int, Dict[int, int]] = {}  # 词 -> {菜品下标: 出现次数}
+        self._chars: Dict[str, Set[int]] = {}
+
+        for pos, dish in enumerate(dishes):
+            if dish.name:
+                self._name_dishes.setdefault(self._word(dish.name.lower()), []).append(pos)
+            for food in dish.foods or []:
+                if food.foodName:
+                    positions = self._food_dishes.setdefault(self._word(food.foodName.lower()), {})
+                    positions[pos] = positions.get(pos, 0) + 1
+
+    def hits(self, matcher: WantEatMatcher) -> Dict[int, WantHits]:
+        """{菜品下标: 命中次数}，只含至少命中一次的菜"""
+        result: Dict[int, List[int]] = {}
+        for vid in self._candidates(matcher):
+            exact, part = matcher.counts(self._texts[vid])
+            if not exact and not part:
+                continue
+            for pos in self._name_dishes.get(vid, ()):
+                hits = result.setdefault(pos, [0, 0, 0, 0])
+                hits[0] += exact
+                hits[1] += part
+            for pos, n in self._food_dishes.get(vid, {}).items():
+                hits = result.setdefault(pos, [0, 0, 0, 0])
+                hits[2] += exact * n
+                hits[3] += part * n
+        return {pos: tuple(h) for pos, h in result.items()}
+
+    # ------------------ 下面全是小工具 ------------------
+    def _word(self, text: str) -> int:
+        vid = self._vocab.get(text)
+        if vid is None:
+            vid = self._vocab[text] = len(self._texts)
+            self._texts.append(text)
+            for ch in set(text):
+                self._chars.setdefault(ch, set()).add(vid)
+        return vid
+
+    def _candidates(self, matcher: WantEatMatcher) -> Set[int]:
+        """包含某个词条全部字的词（必要条件，最终由自动机确认）"""
+        candidates: Set[int] = set()
+        for term in matcher.terms:
+            postings = [self._chars.get(ch) for ch in set(term)]
+            if not postings or any(p is None for p in postings):
+                continue
+            postings.sort(key=len)
+            candidates |= postings[0].intersection(*postings[1:])
+        return candidates
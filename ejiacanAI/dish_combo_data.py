@@ -2,21 +2,21 @@
 from typing import List, Dict, Tuple, Optional
 
 from ejiacanAI.dish_combo_models import Dish, MemberInfo
-from dbconnect.dbconn import db
+from dbconnect.dbconn import db, in_clause
 
 class DishComboData:
 
     # 1. 家庭总需求上限
     @staticmethod
     def get_family_needs(member_ids: List[int]) -> Dict[str, float]:
-        ids_str = ",".join(map(str, member_ids))
+        ids_in, params = in_clause(member_ids)
         sql = f"""
             SELECT nutrient_code, COALESCE(SUM(max_need_qty), 0) AS max_total
             FROM ejia_member_daily_nutrient_actual
-            WHERE member_id IN ({ids_str})
+            WHERE member_id IN ({ids_in})
             GROUP BY nutrient_code
         """
-        return {str(r["nutrient_code"]): float(r["max_total"]) for r in db.query(sql)}
+        return {str(r["nutrient_code"]): float(r["max_total"]) for r in db.query(sql, params)}
 
     # 2. 需求池（已声明 + 外推 + 兜底）
     # dish_combo_data.py
@@ -30,7 +30,7 @@ class DishComboData:
         if not member_ids:
             return {}
 
-        ids_str = ",".join(map(str, member_ids))
+        ids_in, params = in_clause(member_ids)
 
         # 完全保持原有的SQL逻辑，但修改返回格式
         sql = f"""
@@ -58,11 +58,11 @@ class DishComboData:
                     ''
                 ) as external_needs
             FROM ejia_user_family_member um
-            WHERE um.id IN ({ids_str})
+            WHERE um.id IN ({ids_in})
         """
 
         result = {}
-        for row in db.query(sql):
+        for row in db.query(sql, params):
             member_id = row["member_id"]
             needs = []
 
@@ -109,9 +109,9 @@ class DishComboData:
     # 4. 家庭过敏原
     @staticmethod
     def get_family_allergens(member_ids: List[int]) -> List[str]:
-        ids_str = ",".join(map(str, member_ids))
+        ids_in, params = in_clause(member_ids)
         return [row["allergen_code"] for row in db.query(
-            f"SELECT DISTINCT allergen_code FROM ejia_member_allergen WHERE member_id IN ({ids_str})"
+            f"SELECT DISTINCT allergen_code FROM ejia_member_allergen WHERE member_id IN ({ids_in})", params
         )]
 
     # 5. 菜品过敏原（food 级）
@@ -122,25 +122,25 @@ class DishComboData:
         )]
         if not food_ids:
             return []
-        ids_str = ",".join(map(str, food_ids))
+        ids_in, params = in_clause(food_ids)
         sql = f"""
             SELECT DISTINCT allergen_code
             FROM ejia_allergen_food_rel
-            WHERE food_id IN ({ids_str})
+            WHERE food_id IN ({ids_in})
         """
-        dish_allergens = [row["allergen_code"] for row in db.query(sql)]
+        dish_allergens = [row["allergen_code"] for row in db.query(sql, params)]
         return list(set(dish_allergens) & set(family_allergens))
 
     @staticmethod
     def get_member_info(member_ids: List[int]) -> List[MemberInfo]:
         """获取成员详细信息"""
-        ids_str = ",".join(map(str, member_ids))
+        ids_in, params = in_clause(member_ids)
         sql = f"""
             SELECT id, age, gender, height_cm, weight_kg
             FROM ejia_user_family_member
-            WHERE id IN ({ids_str})
+            WHERE id IN ({ids_in})
         """
-        rows = db.query(sql)
+        rows = db.query(sql, params)
         return [
             MemberInfo(
                 member_id=row["id"],
@@ -197,18 +197,18 @@ class DishComboData:
         """
         if not need_codes:
             return []
-        codes_str = ",".join(f"'{c}'" for c in need_codes)
+        codes_in, params = in_clause(need_codes)
         sql = f"""
             SELECT dish_id,
                    MAX(match_score) AS max_score,
                    GROUP_CONCAT(DISTINCT need_code) AS need_codes
             FROM   ejia_need_dish_match
-            WHERE  need_code IN ({codes_str})
+            WHERE  need_code IN ({codes_in})
             GROUP  BY dish_id
             ORDER  BY max_score DESC
-            LIMIT  {take}
+            LIMIT  %s
         """
-        rows = db.query(sql)
+        rows = db.query(sql, params + [int(take)])
         return [
             Dish(
                 dish_id=int(r["dish_id"]),
@@ -3,6 +3,7 @@ from __future__ import annotations
 import copy
 from typing import List, Dict, Optional, Tuple, Set
 from ejiacanAI.dish_combo_models import Dish, MemberInfo, MergeConfig
+from ejiacanAI.dish2_matrix import NutrientMatrix
 
 
 class DishMergeProcessor:
@@ -67,6 +68,8 @@ class DishMergeProcessor:
         """
         best_pair = None
         best_score = -1.0
+        # 所有菜对的营养重叠度一次算出
+        overlap = NutrientMatrix(dishes).pairwise_overlap()
 
         for i in range(len(dishes)):
             for j in range(i + 1, len(dishes)):
@@ -77,7 +80,7 @@ class DishMergeProcessor:
                     continue
 
                 # 计算合并得分
-                score = self._calculate_merge_score(dish1, dish2)
+                score = self._calculate_merge_score(dish1, dish2, float(overlap[i, j]))
 
                 # 选择得分最高的菜品对
                 if score > best_score and score >= self.merge_config.min_similarity_for_merge:
@@ -109,12 +112,14 @@ class DishMergeProcessor:
 
         return True
 
-    def _calculate_merge_score(self, dish1: Dish, dish2: Dish) -> float:
+    def _calculate_merge_score(self, dish1: Dish, dish2: Dish, nutrient_score: float = None) -> float:
         """
         计算两道菜的合并得分（0-1）
         逻辑：营养重叠度(60%) + 需求冗余度(30%) + 优先级适配度(10%)
+        nutrient_score 可传入批量算好的营养重叠度
         """
-        nutrient_score = self._calculate_nutrient_overlap(dish1, dish2)
+        if nutrient_score is None:
+            nutrient_score = self._calculate_nutrient_overlap(dish1, dish2)
         need_score = self._calculate_need_redundancy(dish1, dish2)
         priority_score = self._calculate_priority_score(dish1, dish2)
 
@@ -64,7 +64,7 @@ class FamilyMergeRecommender:
         # 5) 主料去重选前 max_dishes 道
         chosen, seen_main = [], set()
         for d, _ in scored:
-            main = next(iter(d.ingredients.keys()), "")
+            main = d.main_ingredient
             if main in seen_main:
                 continue
             chosen.append(d)
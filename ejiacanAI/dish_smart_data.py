@@ -98,6 +98,8 @@ class DishSmartData:
                 )
             dish_map[did].nutrients[r["nutrient_name"]] = float(r["nutrient_amount"])
             dish_map[did].ingredients[r["ingredient_name"]] = float(r["amount_grams"])
+        for d in dish_map.values():
+            d.main_ingredient = max(d.ingredients, key=d.ingredients.get, default="")
         return list(dish_map.values())
 
     # ---------- 等级配置 ----------
@@ -40,6 +40,7 @@ class Dish:
     cook_time: int
     popularity: float
     allergens: List[str]
+    main_ingredient: str = ""  # 主料（用量最大的食材），菜品池组装时算好
 
 class Algorithm:
     MMR = 1
@@ -41,6 +41,7 @@ class RecommendationConfig:
 @dataclass
 class MemberConstraints:
     allergy_member_ids: List[int] = field(default_factory=list)
+    allergen_codes: List[str] = field(default_factory=list)  # 上述成员的过敏原编码（去重）
     diet_taboos: List[str] = field(default_factory=list)
     taste_preferences: List[str] = field(default_factory=list)
     cooking_ability: int = 2  # 1-简单, 2-中等, 3-复杂
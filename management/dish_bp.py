@@ -4,6 +4,7 @@ from flask import Blueprint, Flask, render_template, request, redirect, url_for
 import json
 from management.dish_data import DishData
 from management.dish_models import DishPage2SaveCmd
+from ejiacanAI.dish2_catalog import DishCatalog
 
 dish_bp = Blueprint('dish', __name__, url_prefix='/dish')
 
@@ -125,6 +126,8 @@ def save_dish(dish_id: int):
 
     # 保存食材（包含是否为主料）
     DishData.save_dish_foods(dish_id, food_codes, food_amounts, food_is_main_food)
+    # 菜品目录变了，推荐用的进程内快照下次取用时后台重载
+    DishCatalog.invalidate()
     return redirect(url_for("dish.dish_list"))
 
 # ------------- 给某个dish打上标签，根据ejia_enum_diet_need_nutrient_rule定义 -------------
@@ -132,8 +135,7 @@ def save_dish(dish_id: int):
 def needtag_dish(dish_id: int):
     """读规则 → 算营养 → 比阈值 → 写标签"""
     rules = DishData.get_need_rule()
-    rows = DishData.get_dish_food_nut(dish_id)  # 原始食材行
-    total = DishData.calc_per_100g_raw(rows)  # 手动算
+    total = DishData.calc_dishes_per_100g([dish_id]).get(dish_id, {})  # 每100g成品营养
 
     hit_codes = []
     for rule in rules:
@@ -149,6 +151,7 @@ def needtag_dish(dish_id: int):
             hit_codes.append(rule.need_code)
 
     DishData.update_dish_needtag(dish_id, hit_codes)
+    DishCatalog.invalidate()
     return redirect(url_for("dish.dish_list"))
 
 @dish_bp.route("/bodyimage")
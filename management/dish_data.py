@@ -1,6 +1,7 @@
 from typing import List, Dict, Optional
 from management.dish_models import DishListItem, DishPage2SaveCmd, NutrientRule
 from dbconnect.dbconn import db
+from ejiacanAI.dish2_nutrient_kernel import NutrientKernel
 
 class DishData:
     @staticmethod
@@ -123,15 +124,16 @@ class DishData:
         :param dish_id: 菜品主键
         :param tag_ids: 需要绑定的 tag_id 列表（空列表=清空）
         """
-        # 1. 清空旧关系
-        db.execute("DELETE FROM ejia_dish_tag_rel WHERE dish_id = %s", dish_id)
+        with db.transaction() as tx:
+            # 1. 清空旧关系
+            tx.execute("DELETE FROM ejia_dish_tag_rel WHERE dish_id = %s", dish_id)
 
-        # 2. 批量写入新关系
-        if tag_ids:
-            db.executemany(
-                "INSERT INTO ejia_dish_tag_rel(dish_id, tag_id) VALUES (%s, %s)",
-                [(dish_id, tid) for tid in tag_ids]
-            )
+            # 2. 批量写入新关系
+            if tag_ids:
+                tx.executemany(
+                    "INSERT INTO ejia_dish_tag_rel(dish_id, tag_id) VALUES (%s, %s)",
+                    [(dish_id, tid) for tid in tag_ids]
+                )
 
     @staticmethod
     def save_dish_foods(dish_id: int, food_codes: List[str], amount_grams: List[int],
@@ -143,28 +145,29 @@ class DishData:
         :param amount_grams: 对应的用量列表（克）
         :param is_main_food: 对应的是否为主料列表（1是主料，0不是主料）
         """
-        # 1. 清空旧关系
-        db.execute("DELETE FROM ejia_dish_food_rel WHERE dish_id = %s", dish_id)
+        with db.transaction() as tx:
+            # 1. 清空旧关系
+            tx.execute("DELETE FROM ejia_dish_food_rel WHERE dish_id = %s", dish_id)
 
-        # 2. 批量写入新关系
-        if food_codes and len(food_codes) == len(amount_grams):
-            # 如果没有提供is_main_food参数，默认为0
-            if is_main_food is None:
-                is_main_food = [0] * len(food_codes)
+            # 2. 批量写入新关系
+            if food_codes and len(food_codes) == len(amount_grams):
+                # 如果没有提供is_main_food参数，默认为0
+                if is_main_food is None:
+                    is_main_food = [0] * len(food_codes)
 
-            # 确保is_main_food长度与food_codes一致
-            if len(is_main_food) != len(food_codes):
-                is_main_food = [0] * len(food_codes)
+                # 确保is_main_food长度与food_codes一致
+                if len(is_main_food) != len(food_codes):
+                    is_main_food = [0] * len(food_codes)
 
-            data = [
-                (dish_id, food_code, amount, main_food)
-                for food_code, amount, main_food in zip(food_codes, amount_grams, is_main_food)
-            ]
+                data = [
+                    (dish_id, food_code, amount, main_food)
+                    for food_code, amount, main_food in zip(food_codes, amount_grams, is_main_food)
+                ]
 
-            db.executemany(
-                "INSERT INTO ejia_dish_food_rel(dish_id, food_id, amount_grams, is_main_food) VALUES (%s, %s, %s, %s)",
-                data
-            )
+                tx.executemany(
+                    "INSERT INTO ejia_dish_food_rel(dish_id, food_id, amount_grams, is_main_food) VALUES (%s, %s, %s, %s)",
+                    data
+                )
 
 # ----------- 1. 读取需求标签规则表 -----------
     @staticmethod
@@ -178,50 +181,26 @@ class DishData:
         return [NutrientRule(**r) for r in rows]
 
     @staticmethod
-    def get_dish_food_nut(dish_id: int) -> List[Dict]:
-        """
-        原样返回 v3_dish_food_complete_view 里该菜品的所有食材行
-        不做任何汇总、转换，供上层按需处理
-        """
-        sql = """
-            SELECT *
-            FROM v3_dish_food_complete_view
-            WHERE dish_id = %s
-        """
-        return db.query(sql, dish_id)
-
     def calc_per_100g_raw(rows: List[dict]) -> Dict[str, float]:
         """
-        手动按用量重新计算每100g成品菜的营养素
-        视图里：
-            营养列 = 每100g食材可食部含量
-            food_amount_grams = 该食材在菜品里的用量(g)
+        按用量重新计算每100g成品菜的营养素（rows 为 v3_dish_food_complete_view 的食材行）
         公式：
             贡献 = 营养列 * food_amount_grams * edible / 100
-        再按菜品总重归一化到100g成品
+        再按菜品总重归一化到100g成品；计算交给 NutrientKernel
         """
-        # 菜品总重（生食总克数）
-        total_weight = sum(float(r['food_amount_grams']) for r in rows)
-        if total_weight == 0:
+        if not rows:
             return {}
-        nutrient_cols = [
-            "energyKCal", "protein", "fat", "CHO", "dietaryFiber",
-            "cholesterol", "vitaminA", "thiamin", "riboflavin", "niacin",
-            "vitaminC", "vitaminETotal", "Ca", "P", "K", "Na", "Mg",
-            "Fe", "Zn", "Se", "Cu", "Mn"
-        ]
-        total = {col: 0.0 for col in nutrient_cols}
-
-        for r in rows:
-            w = float(r['food_amount_grams'])
-            edible = float(r['edible']) / 100.0  # 可食部比例
-            for col in nutrient_cols:
-                per100g = float(r.get(col, 0))  # 每100g可食部含量
-                total[col] += per100g * w * edible / 100.0
+        dish_id = rows[0]['dish_id']
+        comp = NutrientKernel.composition((dish_id, r['food_id'], r['food_amount_grams']) for r in rows)
+        return NutrientKernel.dish_per_100g(comp).get(dish_id, {})
 
-        # 归一化到每100g成品
-        factor = 100.0 / total_weight
-        return {col: val * factor for col, val in total.items()}
+    @staticmethod
+    def calc_dishes_per_100g(dish_ids: List[int] = None) -> Dict[int, Dict[str, float]]:
+        """
+        按 ejia_dish_food_rel 的用量批量计算每100g成品营养素：{dish_id: {营养列: 值}}
+        dish_ids 为空表示全部菜品，所有菜一次矩阵乘法算完
+        """
+        return NutrientKernel.dish_per_100g(NutrientKernel.composition_for(dish_ids))
 
     @staticmethod
     def update_dish_needtag(dish_id: int, need_codes: List[str]) -> None:
@@ -20,24 +20,25 @@ class DishNeedTaggerBatch:
             print(f"❌ 获取菜品列表失败: {str(e)}")
             return []
 
-    def process_single_dish(self, dish_id: int, dish_name: str) -> bool:
-        """处理单个菜品 - 完全复用needtag_dish逻辑"""
+    def process_single_dish(self, dish_id: int, dish_name: str,
+                            rules: List = None, total: Optional[Dict[str, float]] = None) -> bool:
+        """
+        处理单个菜品 - 完全复用needtag_dish逻辑
+        批量调用时传入预先读好的 rules 和算好的每100g营养 total
+        """
         try:
             print(f"\n📊 正在处理菜品: {dish_name} (ID: {dish_id})")
 
             # 1. 读规则
-            rules = DishData.get_need_rule()
+            if rules is None:
+                rules = DishData.get_need_rule()
 
-            # 2. 获取食材营养信息
-            rows = DishData.get_dish_food_nut(dish_id)
-            if not rows:
+            # 2~3. 算营养（ejia_dish_food_rel 用量 × food_nutrition）
+            if total is None:
+                total = DishData.calc_dishes_per_100g([dish_id]).get(dish_id)
+            if total is None:
                 print("    ℹ️  该菜品无食材信息")
                 return False
-
-            print(f"    包含 {len(rows)} 种食材")
-
-            # 3. 算营养 - 直接调用 DishData 的方法
-            total = DishData.calc_per_100g_raw(rows)
             if not total:
                 print("    ℹ️  无法计算菜品营养成分")
                 return False
@@ -79,11 +80,18 @@ class DishNeedTaggerBatch:
             print("❌ 无法获取菜品数据，终止处理")
             return 0, 0
 
+        # 规则只读一次；所有菜品的每100g营养一次矩阵乘法算完
+        rules = DishData.get_need_rule()
+        totals = DishData.calc_dishes_per_100g()
+        print(f"🧮 已计算 {len(totals)} 个菜品的营养成分")
+
         success_count = 0
         error_count = 0
 
         for dish in dishes:
-            if self.process_single_dish(dish['id'], dish['name']):
+            # 没有食材关系的菜品不在 totals 里，按"无法计算"处理
+            total = totals.get(dish['id'], {})
+            if self.process_single_dish(dish['id'], dish['name'], rules, total):
                 success_count += 1
             else:
                 error_count += 1
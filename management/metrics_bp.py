@@ -0,0 +1,41 @@
+import hmac
+import os
+
+from flask import Blueprint, abort, jsonify, request
+
+from dbconnect.dbconn import db
+from ejiacanAI.dish2_catalog import DishCatalog
+from ejiacanAI.dish2_plan_cache import PlanCache
+from ejiacanAI.dish2_singleflight import SingleFlight
+from models.nutrition_data import NutrientTargetCache
+
+# 内部运维接口：连接池、SQL 指纹、慢查询、目录、缓存等内部状态，不能对公网开放
+metrics_bp = Blueprint('metrics', __name__, url_prefix='/internal/metrics')
+
+
+@metrics_bp.before_request
+def require_token():
+    """
+    请求头带 Authorization: Bearer <EJIACAN_METRICS_TOKEN>；没配置令牌时整个蓝图不可用（404）。
+    不按来源 IP 放行：nginx 反代过来的请求 remote_addr 都是本机
+    """
+    token = os.environ.get("EJIACAN_METRICS_TOKEN")
+    if not token:
+        abort(404)
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        abort(403)
+
+
+# 数据库指标：连接池状态 + 按 SQL 指纹聚合的耗时统计
+@metrics_bp.route('/db')
+def db_metrics():
+    top = request.args.get('top', type=int)
+    return jsonify({
+        'pool': db.pool_stats(),
+        'queries': db.query_stats(top),
+        'catalog': DishCatalog.stats(),
+        'nutrient_targets': NutrientTargetCache.stats(),
+        'plan_cache': PlanCache.stats(),
+        'singleflight': SingleFlight.stats()
+    })
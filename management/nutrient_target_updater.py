@@ -5,7 +5,7 @@ from datetime import datetime, date, timedelta
 from typing import List, Dict, Any
 
 from dbconnect.dbconn import db
-from models.nutrition_data import NutritionData
+from models.nutrition_data import NutritionData, NutrientTargetCache
 
 class NutrientTargetUpdater:
     """营养目标更新器"""
@@ -313,6 +313,8 @@ class NutrientTargetUpdater:
 
         # 清理旧记录
         self.cleanup_old_records()
+        # 当天的实际需求已重写，本进程的缓存作废
+        NutrientTargetCache.invalidate(day=date.today())
 
         print(f"\n🎯 更新完成 - 成功: {success_count}, 失败: {error_count}")
         return success_count, error_count
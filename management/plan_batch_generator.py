@@ -0,0 +1,76 @@
+# plan_batch_generator.py
+"""
+批量生成家庭餐单（夜间预生成）：
+    python -m management.plan_batch_generator requests.ndjson -o plans.ndjson [--workers 8] [--chunk-size 50]
+
+输入每行一个 JSON，字段同 MealRequest（need_tags 可以是逗号分隔的字符串）；输入为 - 时读标准输入。
+输出每行一个家庭：{"index", "member_ids", "meals"} 或 {"index", "member_ids", "error"}，
+按完成顺序边算边写；吞吐（家庭/秒）打印到标准错误。
+"""
+import argparse
+import contextlib
+import dataclasses
+import json
+import sys
+from typing import IO, Iterator
+
+from ejiacanAI.dish2_batch import MealBatch
+from ejiacanAI.dish2_combo_models import MealRequest
+
+_REQUEST_FIELDS = {f.name for f in dataclasses.fields(MealRequest)}
+
+
+def read_requests(stream: IO[str]) -> Iterator[MealRequest]:
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        data = json.loads(line)
+        unknown = set(data) - _REQUEST_FIELDS
+        if unknown:
+            print(f"⚠️ 第 {line_no} 行忽略未知字段: {', '.join(sorted(unknown))}", file=sys.stderr)
+        data = {k: v for k, v in data.items() if k in _REQUEST_FIELDS}
+        for key in ("need_tags", "implicit_tags"):
+            if isinstance(data.get(key), str):
+                data[key] = [t for t in data[key].split(",") if t]
+        if data.get("member_ids") is not None:
+            data["member_ids"] = [int(m) for m in data["member_ids"]]
+        yield MealRequest(**data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成家庭餐单，输出 NDJSON")
+    parser.add_argument("input", help="请求文件（NDJSON），- 表示标准输入")
+    parser.add_argument("-o", "--output", default="-", help="输出文件（NDJSON），默认标准输出")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数；1 表示在当前进程顺序执行")
+    parser.add_argument("--chunk-size", type=int, default=50, help="每块家庭数")
+    args = parser.parse_args(argv)
+
+    src = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    batch = MealBatch(workers=args.workers, chunk_size=args.chunk_size)
+    try:
+        with src:
+            requests = list(read_requests(src))
+        # 生成过程中的 print 一律转到标准错误，标准输出只留 NDJSON（fork 出的子进程同样继承）
+        with contextlib.redirect_stdout(sys.stderr):
+            for result in batch.run(requests):
+                record = {"index": result.index, "member_ids": result.request.member_ids}
+                if result.error is None:
+                    record["meals"] = [dataclasses.asdict(m) for m in result.meals]
+                else:
+                    record["error"] = result.error
+                dst.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                dst.flush()
+    finally:
+        if dst is not sys.stdout:
+            dst.close()
+
+    stats = batch.stats()
+    print(f"🎯 批量生成完成 - 家庭: {stats['families']}, 失败: {stats['failed']}, "
+          f"耗时: {stats['seconds']}s, 吞吐: {stats['families_per_sec']} 家庭/秒", file=sys.stderr)
+    return 0 if stats['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
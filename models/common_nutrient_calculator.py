@@ -19,9 +19,14 @@ class CommonNutrientCalculator:
         """计算每日营养需求范围，使用 CommonNutrientCalculator 逻辑"""
         ranges = defaultdict(lambda: {"min": 0.0, "max": 0.0, "need": 0.0})
 
+        # 全家成员的实际需求一次取回（当天缓存 + 一条批量查询）
+        targets_by_member = NutritionData.get_daily_nutrient_targets_actual_batch(
+            m.get('member_id') for m in members
+        )
+
         # 为每个成员计算营养需求（使用 CommonNutrientCalculator）
         for member in members:
-            daily_targets = NutritionData.get_daily_nutrient_targets_actual(member)
+            daily_targets = targets_by_member.get(NutritionData.member_key(member.get('member_id')), {})
 
             # 累加到总需求中
             for nutrient_code, target_content in daily_targets.items():
@@ -1,9 +1,12 @@
+import dataclasses
 from typing import List, Dict
 
 from flask import Blueprint, jsonify, request
-from dbconnect.dbconn import db
+from dbconnect.dbconn import db, in_clause
+from dbconnect.deadline import DeadlineExceeded
 from ejiacanAI.dish2_combo_generator import MealGeneratorV2
-from ejiacanAI.dish2_combo_models import MealRequest
+from ejiacanAI.dish2_combo_models import MealRequest, Dish, ExactPortion, Food
+from ejiacanAI.dish2_combo_models import ComboMeal as PlanMeal  # 与下面旧版 ComboMeal 区分
 from ejiacanAI.dish_combo_models import ComboMeal
 from ejiacanAI.engine import ILPRecommender
 from ejiacanAI.data_access import EnhancedDataAccess
@@ -16,6 +19,8 @@ from models.family_data import FamilyData
 logger = logging.getLogger(__name__)
 family_bp = Blueprint('family', __name__, url_prefix='/family')
 
+MAX_PREFETCH = 3  # getCombos 一次最多预生成的"换一批"方案数
+
 @family_bp.route('getMembers/<int:user_id>', methods=['GET'])
 def get_members(user_id):
     """获取成员的饮食方案"""
@@ -114,13 +119,10 @@ def get_combos(member_ids=None):
         if not data:
             return jsonify({'status': 'error', 'message': 'Invalid JSON data'})
 
-        meal_type = data.get('meal_type', 'all')
-        cuisine = data.get('cuisine', None)
-        category = data.get('category', None)
-        need_tags = data.get('need_tags', None)
-        members = data.get('members', [])  # 新增的members参数
-        province_code = data.get('province_code', 'default')
-        want_eat = data.get('want_eat', None)
+        # 参数解析与 swapDish 共用，两边的 MealRequest 指纹一致才能命中方案 / 排名缓存
+        req = _meal_request_from_json(data, member_ids)
+        # 顺带预生成后面几批（refresh_key+1..），换一批时直接命中缓存；同步计算，上限要小
+        prefetch = _int_field(data, 'prefetch', 0, minimum=0, maximum=MAX_PREFETCH)
 
         # 1. 获取智能推荐结果
         # recommendations = recommender.recommend(member_ids_list, meal_type, max_results)
@@ -131,36 +133,9 @@ def get_combos(member_ids=None):
         #     filter_allergens=True
         # )
         if member_ids is None:
-            req = MealRequest(
-                member_ids=[0],
-                members=members,
-                province_code=province_code,
-                meal_type=meal_type,  # 生成三餐
-                refresh_key=3,  # 每次换种子即可洗牌
-                cook_time_limit=30,  # 30 分钟以内
-                deficit_kcal=0,  # 无热量缺口
-                dish_series=cuisine,  # 菜系ID
-                dish_category=category,
-                want_eat=want_eat,
-                need_tags=need_tags.split(","),
-            )
-            all_day_meals = MealGeneratorV2.generate_per_meal_default(req)
+            all_day_meals = MealGeneratorV2.generate_per_meal_default(req, prefetch=prefetch)
         else:
-            member_ids_list = list(map(int, member_ids.split(',')))
-            req = MealRequest(
-                member_ids=member_ids_list,
-                members=members,
-                province_code=province_code,
-                meal_type=meal_type,  # 生成三餐
-                refresh_key=3,  # 每次换种子即可洗牌
-                cook_time_limit=30,  # 30 分钟以内
-                deficit_kcal=0,  # 无热量缺口
-                dish_series=cuisine,  # 菜系ID
-                dish_category=category,
-                want_eat=want_eat,
-                need_tags=need_tags.split(","),
-            )
-            all_day_meals = MealGeneratorV2.generate_per_meal(req)
+            all_day_meals = MealGeneratorV2.generate_per_meal(req, prefetch=prefetch)
 
         if not all_day_meals:
             return jsonify({"status": "success", "data": [], "message": "未找到合适的菜品组合"})
@@ -174,14 +149,126 @@ def get_combos(member_ids=None):
             "data": all_day_meals,
             "metadata": {
                 "recommendation_type": "smart",
-                "total_recommendations": len(all_day_meals)
+                "total_recommendations": len(all_day_meals),
+                "degraded": any(m.degraded for m in all_day_meals)
             }
         })
 
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except DeadlineExceeded as e:
+        return jsonify({'status': 'error', 'message': f'生成超时: {e}'}), 503
     except Exception as e:
         logger.error("Get combos error: %s", str(e))
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@family_bp.route('/swapDish/', methods=['POST'])
+@family_bp.route('/swapDish/<member_ids>', methods=['POST'])
+def swap_dish(member_ids=None):
+    """
+    换一道菜：请求体 = getCombos 的参数 + combo（getCombos 返回的其中一餐）+ dish_id（要换掉的菜），
+    只改这一餐，返回改好的一餐
+    """
+    try:
+        data = request.get_json()
+        if not data or not data.get('combo') or data.get('dish_id') is None:
+            return jsonify({'status': 'error', 'message': 'combo and dish_id are required'}), 400
+
+        req = _meal_request_from_json(data, member_ids)
+        combo = _combo_from_json(data['combo'])
+        swapped = MealGeneratorV2.swap_dish(combo, _int_field(data, 'dish_id'), req)
+        if swapped is None:
+            return jsonify({"status": "success", "data": None, "message": "没有可替换的菜品"})
+        return jsonify({"status": "success", "data": swapped})
+
+    except (ValueError, TypeError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except DeadlineExceeded as e:
+        return jsonify({'status': 'error', 'message': f'换菜超时: {e}'}), 503
+    except Exception as e:
+        logger.error("Swap dish error: %s", str(e))
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+def _int_field(data: Dict, name: str, default=None, minimum: int = None, maximum: int = None):
+    """请求体里的整数参数：缺省时返回 default，不是整数或超出范围时抛 ValueError（路由返回 400）"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{name} must be >= {minimum}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"{name} must be <= {maximum}")
+    return value
+
+
+def _meal_request_from_json(data: Dict, member_ids: str = None) -> MealRequest:
+    """
+    getCombos / swapDish 共用的 MealRequest 构造：换菜时的请求要和生成时完全一致（包括 need_tags 的规范化），
+    才能复用缓存的方案和排名结果。参数非法时抛 ValueError（路由返回 400）
+    """
+    need_tags = data.get('need_tags', None)
+    if isinstance(need_tags, str):
+        need_tags = need_tags.split(",")
+    return MealRequest(
+        member_ids=list(map(int, member_ids.split(','))) if member_ids else [0],
+        members=data.get('members', []),
+        province_code=data.get('province_code', 'default'),
+        meal_type=data.get('meal_type', 'all'),  # 生成三餐
+        refresh_key=_int_field(data, 'refresh_key', 3),  # 换一批：客户端每次 +1，换种子即可洗牌
+        cook_time_limit=30,  # 30 分钟以内
+        deficit_kcal=0,  # 无热量缺口
+        dish_series=data.get('cuisine', None),  # 菜系ID
+        dish_category=data.get('category', None),
+        want_eat=data.get('want_eat', None),
+        need_tags=[t for t in (need_tags or []) if t],
+        deadline_ms=_int_field(data, 'deadline_ms', None, minimum=1),  # 生成耗时预算（毫秒）
+    )
+
+
+def _combo_from_json(data: Dict) -> PlanMeal:
+    """
+    getCombos 返回的一餐（JSON）还原成 ComboMeal，未知字段忽略；
+    客户端传来的 combo 缺字段或结构不对时抛 ValueError，指出是哪个位置的哪个字段（路由返回 400）
+    """
+    combo = _fields_from_json(PlanMeal, data, 'combo')
+    dishes = combo.get('dishes') or []
+    if not isinstance(dishes, list):
+        raise ValueError("combo.dishes must be a list")
+    combo['dishes'] = []
+    for i, d in enumerate(dishes):
+        path = f"combo.dishes[{i}]"
+        d = _fields_from_json(Dish, d, path)
+        if isinstance(d.get('exact_portion'), dict):
+            d['exact_portion'] = ExactPortion(**_fields_from_json(ExactPortion, d['exact_portion'],
+                                                                  f"{path}.exact_portion"))
+        foods = d.get('foods') or []
+        if not isinstance(foods, list):
+            raise ValueError(f"{path}.foods must be a list")
+        d['foods'] = [Food(**_fields_from_json(Food, f, f"{path}.foods[{j}]")) for j, f in enumerate(foods)]
+        combo['dishes'].append(Dish(**d))
+    return PlanMeal(**combo)
+
+
+def _fields_from_json(cls, data, path: str) -> Dict:
+    """JSON 对象里 dataclass cls 认识的字段；不是对象或缺少必填字段时抛 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must be an object")
+    fields = [f for f in dataclasses.fields(cls) if f.init]
+    missing = [f.name for f in fields if f.name not in data
+               and f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING]
+    if missing:
+        raise ValueError(f"{path} missing field(s): {', '.join(missing)}")
+    names = {f.name for f in fields}
+    return {k: v for k, v in data.items() if k in names}
+
 def _convert_combos_to_response(combos: List[ComboMeal]) -> List[Dict]:
     """将 ComboMeal 对象转换为前端需要的 JSON 格式"""
     result = []
@@ -297,21 +384,19 @@ def get_diet_solutions(member_ids=None):
                   """
             rows = db.query(sql)
         else:
-            # 把 "1,2,3" 转成元组供 SQL IN
-            ids_tuple = tuple(map(int, member_ids.split(',')))
-            if len(ids_tuple) == 1:
-                ids_tuple = (ids_tuple[0], -1)  # 单元素 IN 兼容
+            # 把 "1,2,3" 展开成固定档位的 IN 占位符
+            ids_in, params = in_clause(map(int, member_ids.split(',')))
 
-            sql = """
+            sql = f"""
                   SELECT DISTINCT ds.code, \
                                   ds.name, \
                                   ds.icon, \
                                   ds.desc_text
                   FROM ejia_member_diet_need dn
                            JOIN ejia_enum_diet_need_tbl ds ON dn.need_code = ds.code
-                  WHERE dn.member_id IN %s
+                  WHERE dn.member_id IN ({ids_in})
                   """
-            rows = db.query(sql, (ids_tuple,))
+            rows = db.query(sql, params)
 
         result = {r['code']: {'name': r['name'], 'icon': r['icon'], 'desc': r['desc_text']} for r in rows}
         return jsonify({"status": "success", "data": result})
@@ -47,42 +47,33 @@ class FamilyData:
                 current_time
             )
 
-            combo_log_id = db.execute_return_id(combo_log_sql, combo_log_params)
-
-            # 2. 插入成员日志表 (ejia_combo_member_log)
-            member_affected = 0
             member_log_sql = """
                 INSERT INTO ejia_combo_member_log (
                     owner_id, combo_log_id, member_id, created_at
                 ) VALUES (%s, %s, %s, %s)
             """
-            for member in members:
-                member_log_params = (
-                    owner_id,
-                    combo_log_id,
-                    str(member.get('member_id')),
-                    current_time
-                )
-                member_affected += db.execute(member_log_sql, member_log_params)
-
-            # 3. 插入菜品日志表 (ejia_combo_dish_log)
             dishes = combo.get('dishes', [])
-            dish_affected = 0
-
             dish_log_sql = """
                 INSERT INTO ejia_combo_dish_log (
                     owner_id, combo_log_id, dish_id, created_at
                 ) VALUES (%s, %s, %s, %s)
             """
 
-            for dish in dishes:
-                dish_log_params = (
-                    owner_id,
-                    combo_log_id,
-                    str(dish.get('dish_id')),
-                    current_time
-                )
-                dish_affected += db.execute(dish_log_sql, dish_log_params)
+            # 三张表在同一个事务里写入：一条连接、一次提交，任一步失败整体回滚
+            with db.transaction() as tx:
+                combo_log_id = tx.execute_return_id(combo_log_sql, combo_log_params)
+
+                # 2. 插入成员日志表 (ejia_combo_member_log)
+                member_affected = tx.executemany(member_log_sql, [
+                    (owner_id, combo_log_id, str(member.get('member_id')), current_time)
+                    for member in members
+                ])
+
+                # 3. 插入菜品日志表 (ejia_combo_dish_log)
+                dish_affected = tx.executemany(dish_log_sql, [
+                    (owner_id, combo_log_id, str(dish.get('dish_id')), current_time)
+                    for dish in dishes
+                ])
 
             total_affected += (1 + member_affected + dish_affected)
 
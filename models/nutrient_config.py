@@ -72,6 +72,7 @@ nutrient_priority = {
     'dietary_fiber': 6,  # 中优先级
     # 其他营养素默认优先级为1
 }
+# 餐次结构类型（只读模板：取 key 分桶，不要往列表里追加菜品）
 structure_def = {
     'main_dish': [],
     'side_dish': [],
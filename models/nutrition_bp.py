@@ -171,6 +171,9 @@ class NutritionAnalyzer:
 
         results = []
 
+        # 所有用户的实际营养需求一次预取进当天缓存，下面逐个计算时直接命中
+        NutritionData.get_daily_nutrient_targets_actual_batch(u.get('id') for u in users_input)
+
         for user_data in users_input:
             # 转换为输入模型
             user_input = NutritionAnalysisInput(**user_data)
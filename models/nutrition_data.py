@@ -1,8 +1,64 @@
-from typing import List, Dict, Optional, Any
-from dbconnect.dbconn import db
+import threading
+import time
+from datetime import date
+from typing import List, Dict, Optional, Any, Iterable, Tuple
+from dbconnect.dbconn import db, in_clause
+from dbconnect.deadline import DeadlineExceeded
+from dbconnect.forksafe import after_fork_in_child
 from models.nutrition_models import NutrientRDI, NutritionAnalysisInput
 
 
+class NutrientTargetCache:
+    """
+    成员每日实际营养需求缓存：key = (member_id, 日期)，只保留当天的条目。
+    - NutrientTargetUpdater.run_daily_update 重写当天数据后调用 invalidate()
+    - 每日更新一般在另一个进程里跑，本进程收不到 invalidate，所以条目最多保留 ttl 秒
+    - 没有数据的成员也缓存一个空字典（否则每次都要再查一遍），只保留 negative_ttl 秒：
+      每日更新可能还没跑，跑完后要尽快看到；invalidate 同样会清掉这些条目
+    """
+    ttl = 600
+    negative_ttl = 60
+
+    _entries: Dict[Tuple[int, date], Tuple[float, Dict[str, Dict[str, Any]]]] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, member_id: int, day: date) -> Optional[Dict[str, Dict[str, Any]]]:
+        entry = cls._entries.get((member_id, day))
+        if entry is None or time.monotonic() - entry[0] >= (cls.ttl if entry[1] else cls.negative_ttl):
+            return None
+        return entry[1]
+
+    @classmethod
+    def put(cls, member_id: int, day: date, targets: Dict[str, Dict[str, Any]]):
+        with cls._lock:
+            if any(d != day for _, d in cls._entries):
+                # 跨天了，前一天的条目整体丢掉
+                cls._entries = {k: v for k, v in cls._entries.items() if k[1] == day}
+            cls._entries[(member_id, day)] = (time.monotonic(), targets)
+
+    @classmethod
+    def invalidate(cls, member_ids: Optional[Iterable[int]] = None, day: Optional[date] = None):
+        """清掉某天（默认全部日期）某些成员（默认全部成员）的缓存"""
+        with cls._lock:
+            ids = None if member_ids is None else {int(m) for m in member_ids}
+            cls._entries = {k: v for k, v in cls._entries.items()
+                            if not ((ids is None or k[0] in ids) and (day is None or k[1] == day))}
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        entries = list(cls._entries.values())
+        return {'entries': len(entries), 'negative_entries': sum(1 for _, targets in entries if not targets),
+                'ttl': cls.ttl, 'negative_ttl': cls.negative_ttl}
+
+    @classmethod
+    def _after_fork(cls):
+        cls._lock = threading.Lock()
+
+
+after_fork_in_child(NutrientTargetCache._after_fork)
+
+
 class NutritionData:
     """营养数据分析类"""
 
@@ -136,42 +192,75 @@ class NutritionData:
 
     @staticmethod
     def get_daily_nutrient_targets_actual(member: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
-        """从 ejia_member_daily_nutrient_actual 表获取成员实际营养素需求"""
-        try:
-            member_id = member.get('member_id')
-            if not member_id:
-                raise ValueError("member_id 不能为空")
+        """从 ejia_member_daily_nutrient_actual 表获取成员实际营养素需求（走当天缓存）"""
+        member_id = NutritionData.member_key(member.get('member_id'))
+        if member_id is None:
+            print("获取成员实际营养素需求时出错: member_id 不能为空")
+            return {}
+        return NutritionData.get_daily_nutrient_targets_actual_batch([member_id]).get(member_id, {})
+
+    @staticmethod
+    def get_daily_nutrient_targets_actual_batch(member_ids: Iterable[Any]) -> Dict[int, Dict[str, Dict[str, Any]]]:
+        """
+        批量获取成员实际营养素需求：{member_id: {nutrient_code: {...}}}
+        先查当天缓存，没命中的成员一条 IN 查询取回；没有数据（或查询出错）的成员返回空字典，让调用方使用计算值
+        """
+        today = date.today()
+        ids = list(dict.fromkeys(k for k in map(NutritionData.member_key, member_ids) if k is not None))
+        result: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        missing = []
+        for member_id in ids:
+            cached = NutrientTargetCache.get(member_id, today)
+            if cached is None:
+                missing.append(member_id)
+            else:
+                result[member_id] = cached
+        if not missing:
+            return result
 
-            sql = """
-                SELECT nutrient_code, need_qty, unit, max_qty, unit_ul
+        try:
+            ids_in, params = in_clause(missing)
+            sql = f"""
+                SELECT member_id, nutrient_code, need_qty, unit, max_qty, unit_ul
                 FROM ejia_member_daily_nutrient_actual 
-                WHERE member_id = %s 
-                ORDER BY nutrient_code
+                WHERE member_id IN ({ids_in}) 
+                ORDER BY member_id, nutrient_code
             """
-
-            results = db.query(sql, [member_id])
-
-            # 转换为与 calculate_daily_nutrient_targets 一致的格式
-            nutrient_targets = {}
-            for row in results:
-                nutrient_code = row['nutrient_code']
-                nutrient_targets[nutrient_code] = {
-                    'amount': float(row['need_qty']) if row['need_qty'] is not None else 0.0,
-                    'unit': row['unit'],
-                    'amount_ul': float(row['max_qty']) if row['max_qty'] is not None else None,
-                    'unit_ul': row['unit_ul']
-                }
-            # 如果数据库中没有数据，返回空字典，让调用方使用计算值
+            rows = db.query(sql, params)
+            failed = False
+        except DeadlineExceeded:
+            raise  # 请求耗时预算已用完，不能当作"没有数据"用计算值顶替
+        except Exception as e:
+            print(f"获取成员实际营养素需求时出错: {str(e)}")
+            rows = []
+            failed = True
+
+        # 转换为与 calculate_daily_nutrient_targets 一致的格式
+        fetched: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        for row in rows:
+            fetched.setdefault(int(row['member_id']), {})[row['nutrient_code']] = {
+                'amount': float(row['need_qty']) if row['need_qty'] is not None else 0.0,
+                'unit': row['unit'],
+                'amount_ul': float(row['max_qty']) if row['max_qty'] is not None else None,
+                'unit_ul': row['unit_ul']
+            }
+        for member_id in missing:
+            nutrient_targets = fetched.get(member_id, {})
             if not nutrient_targets:
+                # 如果数据库中没有数据，返回空字典，让调用方使用计算值
                 print(f"成员 {member_id} 今日无实际营养素需求数据，将使用计算值")
-                return {}
-
-            return nutrient_targets
+            if not failed:
+                # 查询出错时不缓存，下次重查；确实没有数据的成员缓存空字典（negative_ttl）
+                NutrientTargetCache.put(member_id, today, nutrient_targets)
+            result[member_id] = nutrient_targets
+        return result
 
-        except Exception as e:
-            print(f"获取成员实际营养素需求时出错: {str(e)}")
-            # 出错时返回空字典，让调用方使用计算值
-            return {}
+    @staticmethod
+    def member_key(member_id: Any) -> Optional[int]:
+        """成员 id 统一成 int（前端可能传字符串）；空值或非数字返回 None"""
+        if member_id is None or not str(member_id).strip().isdigit():
+            return None
+        return int(member_id)
 
     @staticmethod
     def calculate_bmi(height: float, weight: float) -> float:
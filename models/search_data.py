@@ -37,8 +37,8 @@ class SearchData:
             search_pattern = f"%{keyword}%"
             params = (search_pattern, search_pattern, search_pattern, search_pattern, limit)
 
-            rows = db.query(sql, params)
-            return [DishFoodNutrient(**r) for r in rows]
+            # 逐批读取，不先把整张宽表缓存成 dict 列表
+            return [DishFoodNutrient(**r) for r in db.stream(sql, params)]
 
         except Exception as e:
             print(f"search_dishes_by_keyword错误: {str(e)}")
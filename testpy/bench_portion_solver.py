@@ -0,0 +1,73 @@
+# bench_portion_solver.py
+"""
+份量调整对比：整餐统一缩放（NutrientMatrix.portion_scale）vs 逐道菜求解（PortionSolver），
+在合成的餐上比较营养偏差（PortionSolver.fit_error，0 表示全部落在区间内）和耗时。
+不连数据库：
+    python testpy/bench_portion_solver.py [餐数] [每餐菜数]
+"""
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ejiacanAI.dish2_matrix import DISH_NUTRIENT_CODES, NutrientMatrix
+from ejiacanAI.dish2_portion_solver import PortionSolver
+from soak_structure_groups import make_dishes
+
+TARGET_CODES = ["Protein", "EnergyKCal", "Fat", "Carbohydrate", "DietaryFiber", "Sodium", "Calcium", "Iron"]
+
+
+def make_meal_range(rng: random.Random, totals: np.ndarray, codes):
+    """目标围绕这餐的实际合计随机偏移 ±60%，区间 ±20%（与 get_daily_range 相同）"""
+    meal_range = {}
+    for code in TARGET_CODES:
+        if code not in codes:
+            continue
+        current = float(totals[codes.index(code)]) or 10.0
+        need = current * rng.uniform(0.4, 1.6)
+        meal_range[code] = {"min": need * 0.8, "max": need * 1.2, "need": need}
+    return meal_range
+
+
+def percentile(values, q):
+    return float(np.percentile(np.array(values), q)) if values else 0.0
+
+
+def main(meals: int = 500, per_meal: int = 6):
+    rng = random.Random(7)
+    dishes = make_dishes(2000)
+    matrix = NutrientMatrix(dishes, DISH_NUTRIENT_CODES)
+    codes = list(matrix.codes)
+
+    heuristic_err, solver_err, heuristic_ms, solver_ms = [], [], [], []
+    for _ in range(meals):
+        meal = rng.sample(dishes, per_meal)
+        values, _ = matrix.take(meal)
+        meal_range = make_meal_range(rng, values.sum(axis=0), codes)
+
+        start = time.perf_counter()
+        scale = matrix.portion_scale(meal, meal_range)
+        heuristic_ms.append((time.perf_counter() - start) * 1000)
+        heuristic_err.append(PortionSolver.fit_error(values, codes, meal_range, np.full(per_meal, scale)))
+
+        start = time.perf_counter()
+        multipliers = PortionSolver.solve(values, codes, meal_range, warm_start=scale)
+        solver_ms.append((time.perf_counter() - start) * 1000 + heuristic_ms[-1])
+        solver_err.append(PortionSolver.fit_error(values, codes, meal_range, multipliers))
+
+    print(f"{meals} 餐，每餐 {per_meal} 道菜")
+    print(f"{'':10}{'平均偏差':>10}{'达标率':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, err, ms in (("统一缩放", heuristic_err, heuristic_ms), ("逐道求解", solver_err, solver_ms)):
+        within = sum(e < 1e-6 for e in err) / len(err)
+        print(f"{name:10}{np.mean(err):>12.3f}{within:>12.1%}{percentile(ms, 50):>10.2f}{percentile(ms, 95):>10.2f}")
+    print(PortionSolver.stats())
+    assert all(s <= h + 1e-9 for s, h in zip(solver_err, heuristic_err)), "求解结果不应比统一缩放差"
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,84 @@
+# soak_structure_groups.py
+"""
+结构分桶浸泡测试：连续跑 10000 次请求级的 分桶 + 排名，
+每 1000 次打印一次耗时和内存，确认两者不随请求数增长。
+用合成的菜品目录，不连数据库：
+    python testpy/soak_structure_groups.py [请求数] [菜品数]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ejiacanAI.dish2_catalog import CatalogSnapshot, DishCatalog
+from ejiacanAI.dish2_combo_generator import MealGeneratorV2
+from ejiacanAI.dish2_combo_models import Dish, ExactPortion, MealRequest
+from ejiacanAI.dish2_matrix import DISH_NUTRIENT_CODES
+
+STRUCTURE_TYPES = ["main_dish", "side_dish", "staple", "soup", "baby_food"]
+MEAL_TIMES = ["breakfast", "lunch", "dinner"]
+
+
+def make_dishes(n: int):
+    rng = random.Random(42)
+    dishes = []
+    for i in range(n):
+        dishes.append(Dish(
+            dish_id=i + 1,
+            dish_emoji="",
+            name=f"dish{i + 1}",
+            cook_time=rng.randint(5, 40),
+            ingredients=[{"name": f"food{rng.randint(1, 300)}", "grams": "100.0"}],
+            nutrients={c: rng.uniform(0, 50) for c in rng.sample(DISH_NUTRIENT_CODES, 8)},
+            default_portion=200,
+            exact_portion=ExactPortion(size="M", grams=200),
+            allergens=[],
+            dish_tags={
+                "structure_type": [{"code": rng.choice(STRUCTURE_TYPES), "name": ""}],
+                "meal_time": [{"code": m, "name": ""} for m in MEAL_TIMES if rng.random() < 0.6],
+            },
+        ))
+    return dishes
+
+
+def install_snapshot(dishes):
+    DishCatalog._snapshot = CatalogSnapshot(1, "soak", dishes, 0.0,
+                                            classify=MealGeneratorV2._classify_dish_structure_type)
+    DishCatalog._last_check = float("inf")  # 不触发后台水位比对
+
+
+def main(requests: int = 10000, dish_count: int = 2000, window: int = 1000):
+    install_snapshot(make_dishes(dish_count))
+    snapshot = DishCatalog.get()
+    meal_range = {c: {"min": 10, "max": 60, "need": 30} for c in DISH_NUTRIENT_CODES[:10]}
+
+    tracemalloc.start()
+    timings, memory = [], []
+    start = time.perf_counter()
+    for k in range(1, requests + 1):
+        req = MealRequest(meal_type=MEAL_TIMES[k % 3], refresh_key=k)
+        pool = [DishCatalog.checkout(d) for d in snapshot.dishes[:dish_count // 4]]
+        pool = MealGeneratorV2._prepare_dish_pool(pool, req.meal_type, req)
+        MealGeneratorV2._structure_and_rank_dishes(pool, req, meal_range)
+        if k % window == 0:
+            elapsed = (time.perf_counter() - start) * 1000 / window
+            current, _ = tracemalloc.get_traced_memory()
+            timings.append(elapsed)
+            memory.append(current / 1024 / 1024)
+            print(f"{k:>6} 次  平均 {elapsed:7.3f} ms/次  内存 {memory[-1]:7.2f} MB")
+            start = time.perf_counter()
+    tracemalloc.stop()
+
+    # 第一个窗口含预热，从第二个窗口开始比较
+    base_t, base_m = timings[min(1, len(timings) - 1)], memory[min(1, len(memory) - 1)]
+    assert timings[-1] < base_t * 1.5, f"耗时随请求增长：{timings}"
+    assert memory[-1] - base_m < 5, f"内存随请求增长：{memory}"
+    print("OK：耗时和内存保持平稳")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)